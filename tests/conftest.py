@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pytest
+from PIL import Image, PngImagePlugin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PARAMETERS = ("masterpiece, 1girl, ganyu \\(genshin impact\\), (blue hair:1.2)\n"
+              "Negative prompt: lowres\n"
+              "Steps: 20, Sampler: Euler a, CFG scale: 7, Seed: 1234, Size: 64x64")
+
+def write_png(path, parameters=PARAMETERS):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    info = PngImagePlugin.PngInfo()
+    if parameters is not None:
+        info.add_text("parameters", parameters)
+    Image.new("RGB", (64, 64), (200, 100, 50)).save(path, pnginfo=info)
+    return path
+
+@pytest.fixture
+def image_folder(tmp_path, monkeypatch):
+    """
+    几张带生成信息的小 PNG，分在两个子文件夹里；工作目录切到临时目录，日志和清单不会写进仓库。
+    """
+    monkeypatch.chdir(tmp_path)
+    root = tmp_path / "图片"
+    for folder in ("a", "b"):
+        for index in range(3):
+            write_png(str(root / folder / f"{index}.png"), PARAMETERS.replace("Seed: 1234", f"Seed: {index}"))
+    write_png(str(root / "a" / "plain.png"), None)
+    return str(root)
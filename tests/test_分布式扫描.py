@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import time
+
+import 分布式扫描 as distributed
+
+def test_slow_unit_keeps_its_lease(image_folder, monkeypatch, tmp_path):
+    """
+    单元处理时间比租约长时，心跳线程要能续约，结果被接受，单元只领取一次。
+    """
+    original = distributed.scanner.extract_image_info
+
+    def slow_extract(path, *args, **kwargs):
+        time.sleep(0.4)
+        return original(path, *args, **kwargs)
+
+    monkeypatch.setattr(distributed.scanner, "extract_image_info", slow_extract)
+    queue_path = str(tmp_path / "queue.sqlite")
+    distributed.init_queue(queue_path, image_folder, depth=0)
+    processed = distributed.run_worker(queue_path, "w1", poll_seconds=0.1, lease_seconds=1, heartbeat_seconds=0.2)
+
+    assert processed == 1
+    connection = sqlite3.connect(queue_path)
+    status, attempts, file_count = connection.execute("SELECT status, attempts, file_count FROM units").fetchone()
+    connection.close()
+    assert (status, attempts, file_count) == ("done", 1, 7)
+
+def test_lost_lease_stops_the_unit(image_folder, monkeypatch, tmp_path):
+    """
+    续约失败时停止处理，结果不交回。
+    """
+    def failing_renew(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    original = distributed.scanner.extract_image_info
+    calls = []
+
+    def counting_extract(path, *args, **kwargs):
+        calls.append(path)
+        time.sleep(0.2)
+        return original(path, *args, **kwargs)
+
+    monkeypatch.setattr(distributed, "renew_lease", failing_renew)
+    monkeypatch.setattr(distributed.scanner, "extract_image_info", counting_extract)
+    queue_path = str(tmp_path / "queue.sqlite")
+    distributed.init_queue(queue_path, image_folder, depth=0)
+    # 每次领取后都续约失败：单元不交结果，租约过期后被重新领取，超过重试次数后标记为失败
+    processed = distributed.run_worker(queue_path, "w1", poll_seconds=0.1, lease_seconds=0.5, heartbeat_seconds=0.1)
+
+    assert processed == 0
+    connection = sqlite3.connect(queue_path)
+    status, result = connection.execute("SELECT status, result FROM units").fetchone()
+    connection.close()
+    assert status == "failed" and result is None
+    assert len(calls) < distributed.MAX_ATTEMPTS * 7
+
+def test_distributed_rows_match_single_machine_scan_with_sidecars(image_folder, tmp_path):
+    with open(f"{image_folder}/a/plain.txt", "w", encoding="utf-8") as f:
+        f.write("1girl, smile")
+    queue_path = str(tmp_path / "queue.sqlite")
+    distributed.init_queue(queue_path, image_folder, depth=1)
+    distributed.run_worker(queue_path, "w1", poll_seconds=0.1)
+    merged = distributed.merge_results(queue_path)
+    expected = distributed.scanner.get_image_info(image_folder)
+
+    def key(row):
+        return row["图片的绝对路径"]
+    assert sorted(merged, key=key) == sorted(expected, key=key)
+    assert any(row.get("生成信息来源", "").startswith("附带文件 plain.txt") for row in merged)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import io
+import zlib
+
+import pytest
+from PIL import Image
+
+from conftest import PARAMETERS
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+def make_gif(comment):
+    frames = [Image.new("P", (16, 16), color) for color in (1, 2)]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format="GIF", save_all=True, append_images=frames[1:], comment=comment)
+    return buffer.getvalue()
+
+def png_chunk(chunk_type, payload):
+    return len(payload).to_bytes(4, "big") + chunk_type + payload + zlib.crc32(chunk_type + payload).to_bytes(4, "big")
+
+def make_apng_with_text_after_actl(text):
+    frames = [Image.new("RGB", (16, 16), color) for color in ((255, 0, 0), (0, 255, 0))]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format="PNG", save_all=True, append_images=frames[1:])
+    data = buffer.getvalue()
+    actl = data.index(b"acTL") - 4
+    after_actl = actl + 12 + int.from_bytes(data[actl:actl + 4], "big")
+    return data[:after_actl] + png_chunk(b"tEXt", b"parameters\x00" + text.encode("latin-1")) + data[after_actl:]
+
+def mp4_box(box_type, payload, large=False):
+    if large: # 64 位长度
+        return (1).to_bytes(4, "big") + box_type + (16 + len(payload)).to_bytes(8, "big") + payload
+    return (8 + len(payload)).to_bytes(4, "big") + box_type + payload
+
+def make_mp4(comment, large_mdat=False):
+    data_box = mp4_box(b"data", (1).to_bytes(4, "big") + b"\x00" * 4 + comment.encode("utf-8"))
+    ilst = mp4_box(b"ilst", mp4_box(b"\xa9cmt", data_box))
+    hdlr = mp4_box(b"hdlr", b"\x00" * 8 + b"mdirappl" + b"\x00" * 9)
+    meta = mp4_box(b"meta", b"\x00" * 4 + hdlr + ilst) # ISO 的 full box
+    moov = mp4_box(b"moov", mp4_box(b"trak", b"\x00" * 32) + mp4_box(b"udta", meta))
+    return mp4_box(b"ftyp", b"isom\x00\x00\x02\x00isom") + mp4_box(b"mdat", b"\x00" * 64, large=large_mdat) + moov
+
+def ebml_element(element_id, payload, unknown_size=False):
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    if unknown_size:
+        return id_bytes + b"\x01\xff\xff\xff\xff\xff\xff\xff" + payload
+    return id_bytes + (0x0100000000000000 | len(payload)).to_bytes(8, "big") + payload # 8 字节长度
+
+def matroska_tags(name, value):
+    simple_tag = ebml_element(scanner.MATROSKA_SIMPLE_TAG_ID, ebml_element(scanner.MATROSKA_TAG_NAME_ID, name.encode())
+                              + ebml_element(scanner.MATROSKA_TAG_STRING_ID, value.encode("utf-8")))
+    return ebml_element(scanner.MATROSKA_TAGS_ID, ebml_element(scanner.MATROSKA_TAG_ID, simple_tag))
+
+def make_matroska(comment, tags_after_cluster):
+    header = ebml_element(scanner.EBML_HEADER_ID, ebml_element(0x4282, b"webm"))
+    tags = matroska_tags("COMMENT", comment)
+    cluster = ebml_element(scanner.MATROSKA_CLUSTER_ID, b"\x00" * 64)
+    if not tags_after_cluster:
+        return header + ebml_element(scanner.MATROSKA_SEGMENT_ID, tags + cluster, unknown_size=True)
+    # SeekHead 的长度固定（位置字段用 8 字节），先算出 Tags 相对 Segment 内容开头的位置
+    def seek_head(position):
+        seek = ebml_element(scanner.MATROSKA_SEEK_ID_ID, scanner.MATROSKA_TAGS_ID.to_bytes(4, "big")) \
+            + ebml_element(scanner.MATROSKA_SEEK_POSITION_ID, position.to_bytes(8, "big"))
+        return ebml_element(scanner.MATROSKA_SEEK_HEAD_ID, ebml_element(scanner.MATROSKA_SEEK_ID, seek))
+    position = len(seek_head(0)) + len(cluster)
+    return header + ebml_element(scanner.MATROSKA_SEGMENT_ID, seek_head(position) + cluster + tags)
+
+def test_gif_comment():
+    data = make_gif(PARAMETERS.encode("utf-8"))
+    assert scanner.read_gif_comments(data) == [("comment", PARAMETERS)]
+    assert scanner.pick_generation_text(scanner.read_gif_comments(data)) == PARAMETERS
+
+def test_gif_truncated_after_comment_keeps_comment():
+    data = make_gif(b"1girl, smile")
+    truncated = data[:data.index(b"1girl, smile") + 40]
+    assert scanner.read_gif_comments(truncated) == [("comment", "1girl, smile")]
+    with pytest.raises(ValueError):
+        scanner.read_gif_comments(data[:data.index(b"1girl")]) # 注释本身被截断，什么也没找到
+
+def test_apng_text_after_actl():
+    data = make_apng_with_text_after_actl(PARAMETERS)
+    assert data.index(b"acTL") < data.index(b"tEXt") < data.index(b"fcTL")
+    assert ("parameters", PARAMETERS) in scanner.read_png_texts_before_image_data(data)
+
+def test_apng_oversized_chunk_length():
+    data = bytearray(make_apng_with_text_after_actl("1girl"))
+    fctl = data.index(b"fcTL") - 4
+    data[fctl:fctl + 4] = (1 << 30).to_bytes(4, "big") # 长度远超文件大小
+    assert ("parameters", "1girl") in scanner.read_png_texts_before_image_data(bytes(data))
+    with pytest.raises(ValueError):
+        scanner.read_png_texts_before_image_data(bytes(data[:data.index(b"tEXt") + 4])) # 文本块本身被截断
+
+@pytest.mark.parametrize("large_mdat", [False, True])
+def test_mp4_comment_in_udta_meta_ilst(large_mdat):
+    data = make_mp4(PARAMETERS, large_mdat)
+    assert scanner.read_mp4_metadata_texts(data) == [("comment", PARAMETERS)]
+
+def test_mp4_bad_box_lengths():
+    data = make_mp4("1girl")
+    moov = data.index(b"moov") - 4
+    oversized = data[:moov] + (1 << 31).to_bytes(4, "big") + data[moov + 4:] # moov 的长度超出文件：按文件结尾截断
+    assert scanner.read_mp4_metadata_texts(oversized) == [("comment", "1girl")]
+    too_small = data[:moov] + (4).to_bytes(4, "big") + data[moov + 4:] # 比头还短
+    with pytest.raises(ValueError):
+        scanner.read_mp4_metadata_texts(too_small)
+
+@pytest.mark.parametrize("tags_after_cluster", [False, True])
+def test_matroska_simple_tag(tags_after_cluster):
+    data = make_matroska(PARAMETERS, tags_after_cluster)
+    assert scanner.read_matroska_tags(data) == [("COMMENT", PARAMETERS)]
+
+def test_matroska_oversized_and_truncated():
+    data = make_matroska("1girl", tags_after_cluster=False)
+    tag_string = data.index(scanner.MATROSKA_TAG_STRING_ID.to_bytes(2, "big"))
+    # TagString 的长度比文件还长：按 Tags 的结尾截断
+    oversized = data[:tag_string + 2] + (0x0100000000000000 | (1 << 40)).to_bytes(8, "big") + data[tag_string + 10:]
+    assert scanner.read_matroska_tags(oversized)[0][0] == "COMMENT"
+    with pytest.raises((ValueError, IndexError)):
+        scanner.read_matroska_tags(data[:6]) # EBML 头都没读完
+
+def test_animation_files_through_extract_image_info(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cases = {"a.gif": make_gif(PARAMETERS.encode("utf-8")), "b.apng": make_apng_with_text_after_actl(PARAMETERS),
+             "c.mp4": make_mp4(PARAMETERS), "d.webm": make_matroska(PARAMETERS, tags_after_cluster=True)}
+    for name, data in cases.items():
+        (tmp_path / name).write_bytes(data)
+        row = scanner.extract_image_info(str(tmp_path / name))
+        assert row["正面提示词"].startswith("masterpiece"), name
+        assert "Seed: 1234" in row["其他设置"], name
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import os
+
+from conftest import PARAMETERS, write_png
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+def entry(path, size=100, mtime_ns=1, **fields):
+    result = {"path": path, "folder": os.path.dirname(path), "size": size, "mtime_ns": mtime_ns}
+    for field in scanner.DELTA_COMPARED_FIELDS:
+        result[field] = fields.get(field, "")
+    return result
+
+def test_merge_join_categories():
+    old = [entry("/p/a.png"), entry("/p/b.png"), entry("/p/c.png"), entry("/p/d.png", 正面提示词="1girl")]
+    new = [entry("/p/b.png", mtime_ns=2), entry("/p/c.png", 损坏原因="PNG 缺少 IEND 结束块（文件被截断）"),
+           entry("/p/d.png", 正面提示词="1girl"), entry("/p/e.png")]
+    changes = {new_entry["path"] if new_entry else old_entry["path"]: (change_type, fields)
+               for change_type, old_entry, new_entry, fields in scanner.merge_join_manifests(old, new)}
+    assert changes == {
+        "/p/a.png": ("删除", []),
+        "/p/b.png": ("修改", ["修改时间变了（内容大小没变）"]),
+        "/p/c.png": ("修改", ["损坏原因:  → PNG 缺少 IEND 结束块（文件被截断）"]),
+        "/p/e.png": ("新增", []),
+    } # d.png 没变，不产出
+
+def test_compare_with_manifest_across_scans(image_folder):
+    manifest_path = scanner.get_manifest_path(image_folder)
+    changes, had_previous = scanner.compare_with_manifest(scanner.get_image_info(image_folder), manifest_path)
+    assert not had_previous and len(changes) == 7 and {change["变化类型"] for change in changes} == {"新增"}
+
+    changes, had_previous = scanner.compare_with_manifest(scanner.get_image_info(image_folder), manifest_path)
+    assert had_previous and changes == []
+
+    changed_path = os.path.join(image_folder, "a", "1.png")
+    write_png(changed_path, PARAMETERS.replace("Steps: 20", "Steps: 30"))
+    truncated_path = os.path.join(image_folder, "b", "1.png")
+    with open(truncated_path, "rb") as f:
+        data = f.read()
+    with open(truncated_path, "wb") as f:
+        f.write(data[:-12]) # 去掉 IEND
+    os.remove(os.path.join(image_folder, "a", "2.png"))
+    write_png(os.path.join(image_folder, "b", "3.png"))
+
+    changes, _ = scanner.compare_with_manifest(scanner.get_image_info(image_folder), manifest_path)
+    by_path = {os.path.relpath(change["图片的绝对路径"], image_folder): change for change in changes}
+    assert {path: change["变化类型"] for path, change in by_path.items()} == {
+        os.path.join("a", "1.png"): "修改", os.path.join("b", "1.png"): "修改",
+        os.path.join("a", "2.png"): "删除", os.path.join("b", "3.png"): "新增"}
+    assert "其他设置" in by_path[os.path.join("a", "1.png")]["变化的字段"]
+    assert "损坏原因" in by_path[os.path.join("b", "1.png")]["变化的字段"]
+    assert "文件大小" in by_path[os.path.join("b", "1.png")]["变化的字段"]
+
+    changes, _ = scanner.compare_with_manifest(scanner.get_image_info(image_folder), manifest_path, save=False)
+    assert changes == [] # 上一次比较时已经写了新的快照
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+import os
+import warnings
+
+import 图片信息基准测试 as benchmark
+
+def test_loading_a_version_keeps_the_warning_formatter(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    original = warnings.formatwarning
+    benchmark._load_version(os.path.join(benchmark.SCRIPT_DIR, "获取图片信息并且自动打开完成文件_第7版.py"))
+    assert warnings.formatwarning is original
+    # 第7版的格式化器还生效时这里会 RecursionError
+    assert "UserWarning" in warnings.formatwarning("x", UserWarning, "f.py", 1)
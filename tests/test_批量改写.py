@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import os
+
+from PIL import Image
+
+import 批量改写图片生成信息 as rewriter
+
+TEXT = "中文提示词, 1girl\nNegative prompt: bad\nSteps: 20, Sampler: Euler a, CFG scale: 7, Seed: 1"
+
+def write_jpeg(path):
+    exif = Image.Exif()
+    # 带 BOM 的 UTF-16：能正确读出来，但和重新编码后的字节不一样
+    exif.get_ifd(0x8769)[0x9286] = b"UNICODE\x00\xff\xfe" + TEXT.encode("utf-16-le")
+    Image.new("RGB", (32, 32), (10, 20, 30)).save(path, exif=exif.tobytes())
+    with open(path, "rb") as f:
+        return f.read()
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_replace_without_match_leaves_jpeg_untouched(tmp_path):
+    path = str(tmp_path / "a.jpg")
+    original = write_jpeg(path)
+    transform = rewriter.make_transform("replace", r"no such text")
+    assert rewriter.rewrite_file(path, transform, dry_run=True) == []
+    assert rewriter.rewrite_file(path, transform) == []
+    assert read(path) == original
+
+def test_strip_and_fix_still_rewrite(tmp_path):
+    path = str(tmp_path / "a.jpg")
+    write_jpeg(path)
+    assert rewriter.rewrite_file(path, rewriter.make_transform("fix")) == ["改写 UserComment"]
+    assert rewriter.rewrite_file(path, rewriter.make_transform("fix")) == []
+    assert rewriter.rewrite_file(path, rewriter.make_transform("strip")) == ["删除 UserComment"]
+    assert rewriter.rewrite_file(path, rewriter.make_transform("strip")) == []
+
+def test_output_dir_gets_every_file(tmp_path):
+    source = tmp_path / "原图"
+    source.mkdir()
+    write_jpeg(str(source / "a.jpg"))
+    (source / "空.png").write_bytes(b"")
+    (source / "其实是文字.jpg").write_bytes(b"not an image")
+    Image.new("RGB", (8, 8)).save(str(source / "无信息.png"))
+    output = tmp_path / "输出"
+    rewriter.rewrite_folder(str(source), rewriter.make_transform("strip"), output_dir=str(output))
+    assert sorted(os.listdir(output)) == sorted(os.listdir(source))
+    for name in ("空.png", "其实是文字.jpg", "无信息.png"):
+        assert read(str(output / name)) == read(str(source / name))
+    assert TEXT.encode("utf-16-le") not in read(str(output / "a.jpg"))
+
+    dry_output = tmp_path / "试运行"
+    rewriter.rewrite_folder(str(source), rewriter.make_transform("strip"), output_dir=str(dry_output), dry_run=True)
+    assert not dry_output.exists()
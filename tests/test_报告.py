@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import openpyxl
+import pytest
+
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+def sheet_values(workbook):
+    return {sheet.title: [[("" if value is None else value) for value in row] for row in sheet.iter_rows(values_only=True)]
+            for sheet in workbook.worksheets}
+
+@pytest.mark.parametrize("dedupe_prompts", [False, True])
+def test_streaming_report_matches_in_memory_report(image_folder, monkeypatch, dedupe_prompts):
+    monkeypatch.setattr(scanner, "REPORT_NOTIFIER", "none")
+    with open(f"{image_folder}/b/broken.png", "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n" + b"\x00" * 40)
+    prompt_table = scanner.PromptTable()
+    rows = scanner.get_image_info(image_folder, on_row=prompt_table.add)
+    assert any(row.get("损坏原因") for row in rows)
+
+    in_memory = scanner.create_excel_report(rows, base_filename="内存", prompt_table=prompt_table,
+                                            dedupe_prompts=dedupe_prompts)
+    sorter = scanner.ExternalSorter(scanner.make_row_sort_key(()), 1000) # 预算很小，强制写临时文件
+    for row in rows:
+        sorter.add(row)
+    try:
+        streamed = scanner.create_streaming_excel_report(sorter, base_filename="流式", prompt_table=prompt_table,
+                                                         dedupe_prompts=dedupe_prompts)
+    finally:
+        sorter.close()
+    assert sorter.run_count > 1
+
+    expected = sheet_values(openpyxl.load_workbook(in_memory))
+    actual = sheet_values(openpyxl.load_workbook(streamed))
+    assert actual == expected
+    assert ("正面提示词" in expected["图片信息"][0]) != dedupe_prompts
+    assert "损坏原因" not in expected["图片信息"][0] and len(expected["损坏文件"]) == 2
+
+def test_sort_key_parses_settings_once_per_row(monkeypatch):
+    calls = []
+    parse_settings = scanner.parse_settings
+    monkeypatch.setattr(scanner, "parse_settings", lambda text: calls.append(text) or parse_settings(text))
+    key = scanner.make_row_sort_key(("Sampler", "所在文件夹", "Seed", "Steps"))
+    row = {"所在文件夹": "/a", "其他设置": "Steps: 20, Sampler: Euler a, Seed: 7"}
+    assert key(row) == [[1, "Euler a"], [1, "/a"], [0, 7.0], [0, 20.0]]
+    assert len(calls) == 1
+
+def test_sort_and_group_share_the_memory_budget():
+    streaming_sorter, group_sorter = scanner.create_report_sorters(1000, ("Seed",), "正面提示词")
+    try:
+        assert streaming_sorter.memory_budget_bytes + group_sorter.sorter.memory_budget_bytes == 1000
+    finally:
+        streaming_sorter.close()
+        group_sorter.close()
+    streaming_sorter, group_sorter = scanner.create_report_sorters(1000, ("Seed",), "")
+    streaming_sorter.close()
+    assert streaming_sorter.memory_budget_bytes == 1000 and group_sorter is None
+    assert scanner.create_report_sorters(1000, (), "") == (None, None)
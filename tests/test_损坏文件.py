@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import io
+
+import pytest
+from PIL import Image
+
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+def jpeg_bytes():
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    exif.get_ifd(0x8769)[0x9286] = b"ASCII\x00\x00\x001girl\nSteps: 20, Sampler: Euler a, CFG scale: 7, Seed: 1"
+    Image.new("RGB", (64, 64), (120, 30, 200)).save(buffer, "JPEG", exif=exif.tobytes())
+    return buffer.getvalue()
+
+@pytest.mark.parametrize("from_memory", [False, True])
+def test_jpeg_with_appended_trailer_is_not_damaged(tmp_path, monkeypatch, from_memory):
+    monkeypatch.chdir(tmp_path)
+    data = jpeg_bytes() + b"MotionPhoto_Data" + b"\x00\x01" * 200
+    path = tmp_path / "trailer.jpg"
+    path.write_bytes(data)
+    assert scanner.validate_image_file(str(path), data if from_memory else None) == ("", True)
+    row = scanner.extract_image_info(str(path))
+    assert "损坏原因" not in row
+    assert row["其他设置"].startswith("Steps: 20")
+
+def test_truncated_jpeg_is_still_damaged(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data = jpeg_bytes()
+    path = tmp_path / "truncated.jpg"
+    path.write_bytes(data[:len(data) - 40])
+    reason, worth_reading = scanner.validate_image_file(str(path))
+    assert "EOI" in reason and worth_reading
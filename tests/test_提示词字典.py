@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+def test_normalize_prompt_weights_and_whitespace():
+    assert scanner.normalize_prompt("(tag:1.0)") == "tag"
+    assert scanner.normalize_prompt("(tag:1.20)") == "(tag:1.2)"
+    assert scanner.normalize_prompt("  Masterpiece ,\n 1girl,,  (blue   hair:1.0) ,") == "masterpiece, 1girl, blue hair"
+    assert scanner.normalize_prompt("( smile : 0.8 ), <lora:detail : 0.8>") == "(smile:0.8), <lora:detail:0.8>"
+    assert scanner.normalize_prompt("(red, blue), green") == "(red, blue), green" # 括号里的逗号不切
+    assert scanner.normalize_prompt("") == ""
+
+def test_normalize_prompt_sort_option():
+    assert scanner.normalize_prompt("b, a, (c:1.0)") == "b, a, c"
+    assert scanner.normalize_prompt("b, a, (c:1.0)", sort_tags=True) == "a, b, c"
+    assert scanner.normalize_prompt("a, b, c", sort_tags=True) == scanner.normalize_prompt("c,b ,  a", sort_tags=True)
+
+def row(prompt, mtime_seconds):
+    return {"图片的绝对路径": f"/不存在/{mtime_seconds}.png", "正面提示词": prompt,
+            scanner.ROW_FILE_SIZE: 1, scanner.ROW_FILE_MTIME_NS: mtime_seconds * 10 ** 9}
+
+def test_prompt_table_ids_and_times():
+    table = scanner.PromptTable(sort_tags=False)
+    rows = [row("1girl, (smile:1.0)", 300), row("1girl,  smile", 100), row("smile, 1girl", 200), row("", 50)]
+    assert [table.add(r) for r in rows] == [1, 1, 2, None]
+    assert [r["提示词ID"] for r in rows] == [1, 1, 2, ""]
+    first = table.entries[0]
+    assert (first["count"], first["first_seen"], first["last_seen"]) == (2, 100, 300)
+    assert first["example"] == "1girl, (smile:1.0)" and first["normalized"] == "1girl, smile"
+
+    sorted_table = scanner.PromptTable(sort_tags=True)
+    assert [sorted_table.add(r) for r in rows[:3]] == [1, 1, 1]
+    assert sorted_table.report_rows()[0]["图片数量"] == 3
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+@pytest.mark.parametrize("scan", ["sequential", "adaptive"])
+def test_aggregators_use_size_and_mtime_from_scan(image_folder, monkeypatch, scan):
+    if scan == "sequential":
+        rows = scanner.get_image_info(image_folder)
+    else:
+        rows = scanner.get_image_info_adaptive(image_folder)
+    assert len(rows) == 7
+    for row in rows:
+        st = os.stat(row["图片的绝对路径"])
+        assert (row[scanner.ROW_FILE_SIZE], row[scanner.ROW_FILE_MTIME_NS]) == (st.st_size, st.st_mtime_ns)
+
+    def no_stat(*args, **kwargs):
+        raise AssertionError("扫描后不应该再 stat")
+    monkeypatch.setattr(scanner.os, "stat", no_stat)
+    monkeypatch.setattr(scanner.os.path, "getmtime", no_stat)
+    monkeypatch.setattr(scanner.os.path, "getsize", no_stat)
+    prompt_table = scanner.PromptTable()
+    summary = scanner.FolderSummaryAggregator()
+    for row in rows:
+        prompt_table.add(row)
+        summary.add(row)
+        entry = scanner.build_manifest_entry(row)
+        assert entry["size"] == row[scanner.ROW_FILE_SIZE]
+    monkeypatch.undo()
+    summary_rows = summary.summary_rows()
+    assert sum(summary_row["图片数量"] for summary_row in summary_rows) == 7
+    assert sum(summary_row["总字节数"] for summary_row in summary_rows) == sum(row[scanner.ROW_FILE_SIZE] for row in rows)
+
+def test_private_columns_not_in_reports(image_folder, monkeypatch):
+    monkeypatch.setattr(scanner, "REPORT_NOTIFIER", "none")
+    rows = scanner.get_image_info(image_folder)
+    columns = scanner.main_sheet_columns(list(rows[0].keys()))
+    assert not [column for column in columns if column.startswith("_")]
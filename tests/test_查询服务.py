@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+
+from conftest import write_png
+import 图片信息查询服务 as service
+
+def refresh(index):
+    index.apply_changes(*index.collect_changes())
+
+def test_refresh_picks_up_sidecar_changes(image_folder):
+    index = service.ImageIndex(image_folder)
+    refresh(index)
+    plain = os.path.join(image_folder, "a", "plain.png")
+    assert index.entries[plain][2]["生成信息来源"] == "无"
+
+    sidecar = os.path.join(image_folder, "a", "plain.txt")
+    with open(sidecar, "w", encoding="utf-8") as f:
+        f.write("1girl, smile")
+    refresh(index)
+    assert index.last_refresh["changed"] == 1
+    assert index.entries[plain][2]["正面提示词"] == "1girl, smile"
+    assert index.search(tags=["smile"])["total"] == 1
+
+    os.remove(sidecar)
+    refresh(index)
+    assert index.last_refresh["changed"] == 1
+    assert index.search(tags=["smile"])["total"] == 0
+
+def test_search_and_stat_follow_refreshes(image_folder, monkeypatch):
+    index = service.ImageIndex(image_folder)
+    refresh(index)
+    assert [row["图片的绝对路径"] for row in index.search()["results"]] == sorted(index.entries)
+    first = index.stat()
+    assert first["images"] == 7 and dict(first["top_tags"])["1girl"] == 6
+
+    # 没有变化的刷新不重新统计，查询也不再排序
+    monkeypatch.setattr(service, "Counter", None)
+    refresh(index)
+    assert index.stat()["top_tags"] == first["top_tags"]
+    monkeypatch.undo()
+
+    added = os.path.join(image_folder, "a", "0a.png")
+    write_png(added)
+    os.remove(os.path.join(image_folder, "b", "2.png"))
+    refresh(index)
+    paths = [row["图片的绝对路径"] for row in index.search()["results"]]
+    assert paths == sorted(index.entries) and added in paths and len(paths) == 7
+    assert dict(index.stat()["top_tags"])["1girl"] == 6
+
+def test_search_pages_without_scanning_everything(image_folder):
+    index = service.ImageIndex(image_folder)
+    refresh(index)
+    page = index.search(limit=2, offset=1)
+    assert [row["图片的绝对路径"] for row in page["results"]] == index.sorted_paths[1:3]
+    assert page["total"] == 7 and page["has_more"]
+
+    page = index.search(tags=["1girl"], limit=4, offset=4)
+    assert page["total"] == 6 and len(page["results"]) == 2 and not page["has_more"]
+
+    page = index.search(text="SEED: 1", limit=1)
+    assert page["total"] is None and page["has_more"] and len(page["results"]) == 1
+    page = index.search(text="seed: 1,", limit=10)
+    assert page["total"] == 2 and not page["has_more"]
+    assert [row["图片的绝对路径"] for row in page["results"]] == [path for path in index.sorted_paths if "1.png" in path]
+
+def test_malformed_content_length_gets_400(image_folder):
+    async def run():
+        query_service = service.QueryService(image_folder, port=0, refresh_interval=0)
+        port = await query_service.start()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"POST /refresh HTTP/1.1\r\nContent-Length: abc\r\n\r\n")
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            return response
+        finally:
+            query_service.server.close()
+            await query_service.server.wait_closed()
+    assert asyncio.run(run()).startswith(b"HTTP/1.1 400 ")
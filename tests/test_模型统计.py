@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import os
+
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+SETTINGS = ('Steps: 20, Sampler: Euler a, Model hash: abc123, Model: animeModel_v3, '
+            'Lora hashes: "detail: 1111, style: 2222", TI hashes: "easyneg: 3333", Version: v1.7.0')
+
+def test_parse_settings_quoted_values():
+    settings = scanner.parse_settings(SETTINGS)
+    assert settings["Steps"] == "20" and settings["Sampler"] == "Euler a"
+    assert settings["Lora hashes"] == "detail: 1111, style: 2222"
+    assert settings["TI hashes"] == "easyneg: 3333" and settings["Version"] == "v1.7.0"
+    assert scanner.parse_settings("") == {}
+
+def test_extract_model_references():
+    row = {"正面提示词": "1girl, <lora:detail:0.8>, <LORA:detail:0.5>, <lyco:extra:1>, <hypernet:hn:0.6>",
+           "其他设置": SETTINGS}
+    assert scanner.extract_model_references(row) == [
+        ("模型", "animeModel_v3", "abc123"),
+        ("LoRA", "detail", "1111"),
+        ("LoRA", "extra", ""),
+        ("Hypernetwork", "hn", ""),
+        ("LoRA", "style", "2222"), # 只在 Lora hashes 里出现
+        ("Embedding", "easyneg", "3333"),
+    ]
+    assert scanner.extract_model_references({"正面提示词": "1girl", "其他设置": "Steps: 20"}) == []
+
+def test_missing_lora_check_against_models_dir(tmp_path):
+    lora_dir = tmp_path / "models" / "Lora"
+    lora_dir.mkdir(parents=True)
+    (lora_dir / "Detail.safetensors").write_bytes(b"")
+    (lora_dir / "style.txt").write_bytes(b"") # 不是模型文件
+    aggregator = scanner.ModelUsageAggregator(models_dir=str(tmp_path / "models"))
+    assert aggregator.local_names == {"detail"}
+    aggregator.add({"图片的绝对路径": os.path.join("/图片", "1.png"), "所在文件夹": "/图片",
+                    "正面提示词": "<lora:detail:0.8>", "其他设置": SETTINGS})
+    assert sorted(row["缺失的LoRA"] for row in aggregator.missing_rows) == ["style"]
+    existence = {(row["类型"], row["名称"]): row["本地是否存在"] for row in aggregator.usage_rows()}
+    assert existence[("LoRA", "detail")] == "是" and existence[("LoRA", "style")] == "否"
+    assert existence[("模型", "animeModel_v3")] == ""
+
+def test_no_models_dir_means_no_missing_check():
+    aggregator = scanner.ModelUsageAggregator(models_dir="")
+    aggregator.add({"图片的绝对路径": "/图片/1.png", "正面提示词": "<lora:x:0.8>", "其他设置": ""})
+    assert aggregator.missing_rows == [] and aggregator.usage[("LoRA", "x")] == 1
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+CJK_PROMPT = "中文提示词测试"
+CJK_PARAMETERS = "中文提示词测试, 1girl\nNegative prompt: 低质量\nSteps: 20, Sampler: Euler a, CFG scale: 7, Seed: 1"
+
+@pytest.mark.parametrize("text", [CJK_PROMPT, CJK_PARAMETERS, "masterpiece, 1girl"])
+@pytest.mark.parametrize("byte_order, encoding", [("little", "utf-16-le"), ("big", "utf-16-be")])
+def test_unicode_user_comment_round_trip(text, byte_order, encoding):
+    value = b"UNICODE\x00" + text.encode(encoding)
+    assert scanner.decode_exif_user_comment(value, byte_order) == text
+    assert scanner._last_encoding_repair is None
+
+@pytest.mark.parametrize("bom, encoding", [(b"\xff\xfe", "utf-16-le"), (b"\xfe\xff", "utf-16-be")])
+@pytest.mark.parametrize("byte_order", ["little", "big"])
+def test_unicode_user_comment_bom_wins(bom, encoding, byte_order):
+    value = b"UNICODE\x00" + bom + CJK_PROMPT.encode(encoding)
+    assert scanner.decode_exif_user_comment(value, byte_order) == CJK_PROMPT
+
+def test_swapped_byte_order_with_parameters_is_repaired():
+    value = b"UNICODE\x00" + CJK_PARAMETERS.encode("utf-16-le")
+    assert scanner.decode_exif_user_comment(value, "big") == CJK_PARAMETERS
+    assert scanner._last_encoding_repair == "utf-16-be → utf-16-le"
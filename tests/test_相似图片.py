@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import random
+
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+def test_bk_tree_radius_search_matches_brute_force():
+    rng = random.Random(7)
+    base = rng.getrandbits(64)
+    # 大部分哈希离 base 只差几位，保证各个半径都有结果
+    values = {base ^ sum(1 << rng.randrange(64) for _ in range(rng.randrange(12))) for _ in range(300)}
+    values |= {rng.getrandbits(64) for _ in range(200)}
+    tree = scanner.BKTree()
+    for value in values:
+        tree.add(value)
+    tree.add(base) # 重复添加不会多出节点
+    values.add(base)
+    for radius in (0, 1, 4, 10):
+        for query in (base, base ^ 0b1011, rng.getrandbits(64)):
+            expected = sorted((scanner.hamming_distance(query, value), value) for value in values
+                              if scanner.hamming_distance(query, value) <= radius)
+            assert sorted(tree.search(query, radius)) == expected
+
+def test_empty_tree():
+    assert scanner.BKTree().search(0, 64) == []
+
+def test_similar_groups_are_transitive_and_skip_singletons():
+    hashes = {
+        "a.png": 0x0000000000000000,
+        "b.png": 0x0000000000000007, # 和 a 差 3 位
+        "c.png": 0x000000000000003F, # 和 b 差 3 位，和 a 差 6 位：通过 b 连到同一组
+        "d.png": 0xFFFFFFFF00000000, # 离谁都远
+        "e.png": 0xFFFFFFFFFFFFFFFF,
+        "f.png": 0xFFFFFFFFFFFFFFFF, # 和 e 完全相同
+        "g.png": 0xFFFFFFFFFFFFFFFE,
+    }
+    groups = scanner.find_similar_image_groups(hashes, max_distance=4)
+    assert groups == {"a.png": 1, "b.png": 1, "c.png": 1, "e.png": 2, "f.png": 2, "g.png": 2}
+    assert scanner.find_similar_image_groups(hashes, max_distance=0) == {"e.png": 1, "f.png": 1}
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+from conftest import write_png
+
+PROMPTS = [
+    "masterpiece, ganyu \\(genshin impact\\), (blue hair:1.2), [smile]",
+    "ganyu_(genshin_impact), {blue_hair}, lowres",
+    "1girl, (ganyu (genshin impact):0.8), BREAK red eyes",
+    "landscape, mountain",
+]
+
+@pytest.fixture
+def filter_folder(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for index, prompt in enumerate(PROMPTS):
+        sampler = "Euler a" if index % 2 == 0 else "DPM++ 2M Karras"
+        write_png(str(tmp_path / "图片" / f"{index}.png"),
+                  f"{prompt}\nNegative prompt: bad\nSteps: {20 + index}, Sampler: {sampler}, CFG scale: 7, Seed: {index}")
+    write_png(str(tmp_path / "图片" / "plain.png"), None)
+    return str(tmp_path / "图片")
+
+@pytest.mark.parametrize("expression", [
+    'tag:"ganyu (genshin impact)"',
+    "tag:ganyu_(genshin_impact)",
+    "tag:blue_hair",
+    "tag:smile",
+    "tag:red_eyes -tag:lowres",
+    'text:"(blue hair"',
+    "text:blue_hair",
+    'Sampler="Euler a"',
+    "Sampler~karras Steps>=21",
+])
+def test_pushdown_matches_unfiltered_scan(filter_folder, expression):
+    scan_filter = scanner.ScanFilter(expression)
+    expected = sorted(row["图片的绝对路径"] for row in scanner.get_image_info(filter_folder) if scan_filter.match_row(row))
+    filtered = sorted(row["图片的绝对路径"] for row in scanner.get_image_info(filter_folder, scan_filter=scan_filter))
+    assert filtered == expected
+
+def test_pushdown_keeps_escaped_tag(filter_folder):
+    scan_filter = scanner.ScanFilter('tag:"ganyu (genshin impact)"')
+    rows = scanner.get_image_info(filter_folder, scan_filter=scan_filter)
+    assert sorted(os.path.basename(row["图片的绝对路径"]) for row in rows) == ["0.png"]
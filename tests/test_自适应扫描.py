@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+from PIL import Image
+
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+@pytest.mark.skipif(not hasattr(os, "symlink"), reason="需要符号链接")
+def test_locality_walk_matches_os_walk_with_symlink_loop(image_folder):
+    os.symlink(image_folder, os.path.join(image_folder, "a", "回到上层"))
+    os.symlink(os.path.join(image_folder, "b"), os.path.join(image_folder, "b_link"))
+    expected = sorted(path for path, _ in scanner.iter_image_files(image_folder))
+    assert sorted(scanner.iter_image_files_by_locality(image_folder)) == expected
+    assert len(expected) == 7
+
+def test_reader_only_reads_a_prefix_of_png_and_jpeg(image_folder):
+    gif_path = os.path.join(image_folder, "a", "动图.gif")
+    Image.new("P", (16, 16)).save(gif_path, comment=b"1girl")
+    data, complete, _, st = scanner._read_image_bytes(gif_path)
+    assert data is None and st.st_size == os.path.getsize(gif_path)
+    assert scanner.ADAPTIVE_READ_PREFIX_BYTES <= 256 * 1024
+
+    png_path = os.path.join(image_folder, "a", "0.png")
+    data, complete, _, _ = scanner._read_image_bytes(png_path, prefix_bytes=100) # 在 parameters 块中间截断
+    assert len(data) == 100 and not complete
+    row = scanner.extract_image_info(png_path, data, data_complete=False)
+    assert row["正面提示词"].startswith("masterpiece") and "损坏原因" not in row
+
+def test_adaptive_rows_match_sequential_rows(image_folder):
+    sequential = {row["图片的绝对路径"]: row for row in scanner.get_image_info(image_folder)}
+    adaptive = scanner.get_image_info_adaptive(image_folder)
+    assert [row["图片的绝对路径"] for row in adaptive] == list(scanner.iter_image_files_by_locality(image_folder))
+    assert {row["图片的绝对路径"]: row for row in adaptive} == sequential
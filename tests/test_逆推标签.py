@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+
+import pytest
+
+from conftest import PARAMETERS, write_png
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+class FakeTagger:
+    """
+    不需要 onnxruntime：记录同时有多少张预处理好的图片还没推理，推理到第 fail_at 批时抛异常模拟崩溃。
+    """
+    model_name = "fake"
+
+    def __init__(self, fail_at=None):
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.max_waiting = 0
+        self.batches = 0
+        self.fail_at = fail_at
+
+    def preprocess(self, image_bytes):
+        with self.lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        return len(image_bytes)
+
+    def predict_batch(self, arrays):
+        self.batches += 1
+        if self.batches == self.fail_at:
+            raise RuntimeError("模拟推理崩溃")
+        with self.lock:
+            self.waiting -= len(arrays)
+        return [[("1girl", 0.9)] for _ in arrays]
+
+@pytest.fixture
+def many_images(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for index in range(40):
+        write_png(str(tmp_path / "图片" / f"{index}.png"), PARAMETERS.replace("Seed: 1234", f"Seed: {index}")) # 内容各不相同
+    return [{"图片的绝对路径": str(tmp_path / "图片" / f"{index}.png"), "正面提示词": "1girl, smile"} for index in range(40)]
+
+def test_preprocessing_window_is_bounded(many_images, tmp_path):
+    tagger = FakeTagger()
+    scanner.run_image_tagger(many_images, cache_dir=str(tmp_path / "缓存"), batch_size=2, preprocess_threads=4, tagger=tagger)
+    assert tagger.batches == 20
+    assert tagger.max_waiting <= 2 * 2 + 2 # 窗口 2*batch_size，加上正在攒的一批
+    assert all(row["逆推标签"] == "1girl" for row in many_images)
+
+def test_caches_saved_before_a_crash(many_images, tmp_path):
+    cache_dir = str(tmp_path / "缓存")
+    with pytest.raises(RuntimeError):
+        scanner.run_image_tagger(many_images, cache_dir=cache_dir, batch_size=2, tagger=FakeTagger(fail_at=4),
+                                 save_every_batches=1)
+    with open(os.path.join(cache_dir, "逆推标签缓存_fake.json"), encoding="utf-8") as f:
+        assert len(json.load(f)) == 6 # 前三批已经保存
+    assert len(scanner.load_content_hash_index(cache_dir)) >= 6
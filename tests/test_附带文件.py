@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+from conftest import write_png
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+COMFYUI_GRAPH = {"3": {"class_type": "KSampler", "inputs": {"seed": 1, "steps": 20, "model": ["4", 0]}},
+                 "6": {"class_type": "CLIPTextEncode", "inputs": {"text": "1girl, smile", "clip": ["4", 1]}}}
+
+def scan_with_sidecar(tmp_path, content):
+    image_path = write_png(str(tmp_path / "a.png"), None)
+    with open(tmp_path / "a.json", "w", encoding="utf-8") as f:
+        json.dump(content, f)
+    sidecars = scanner.read_sidecar_files({".json": str(tmp_path / "a.json")})
+    row, _ = scanner.scan_image_file(os.path.abspath(image_path), sidecars=sidecars)
+    return row
+
+def test_comfyui_node_graph_is_not_a_prompt(tmp_path):
+    row = scan_with_sidecar(tmp_path, {"prompt": COMFYUI_GRAPH, "workflow": {"nodes": []}})
+    assert row["生成信息来源"] == "无"
+    assert "class_type" not in str(row.get("正面提示词", ""))
+
+def test_structured_values_skipped_but_text_and_numbers_kept(tmp_path):
+    row = scan_with_sidecar(tmp_path, {"prompt": COMFYUI_GRAPH, "caption": ["1girl", "smile"],
+                                       "negative_prompt": {"text": "lowres"}, "steps": 20, "seed": {"value": 1},
+                                       "sampler": "Euler a", "width": 64, "height": 64})
+    assert row["生成信息来源"] == "附带文件 a.json"
+    assert row["正面提示词"] == "1girl, smile"
+    assert "Steps: 20" in row["其他设置"] and "Seed" not in row["其他设置"] and "Size: 64x64" in row["其他设置"]
+    assert not row.get("负面提示词")
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import zlib
+import socket
+import sqlite3
+import argparse
+import threading
+import subprocess
+from datetime import datetime
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+# 多台机器一起扫描同一个归档（共享存储）：
+# 1. 协调端把目录树切成若干工作单元（一个文件夹，或者某一层以下的整棵子树），写进一个 SQLite 工作队列。
+#    队列文件放在所有机器都能访问的共享目录里；只在一台机器上跑时，这个文件就是本地的替身。
+# 2. 每台机器启动若干 worker，从队列里领取单元，用扫描脚本的 extract_image_info 逐个处理，
+#    处理结果（压缩后的 json）写回队列。
+# 3. worker 领取单元时拿到一个租约，处理期间定时续约。worker 死掉后租约过期，单元会被其他 worker 重新领取；
+#    过期的 worker 之后再交结果也会被丢弃，不会和新的结果重复。
+# 4. 全部单元完成后合并结果，生成和单机扫描一样的xlsx报告。
+
+DEFAULT_QUEUE_PATH = "分布式扫描队列.sqlite"
+PARTITION_DEPTH = 2 # 这一层的文件夹作为整棵子树的工作单元，更浅的文件夹只处理自己目录下的文件
+LEASE_SECONDS = 120 # 租约时长，worker 超过这么久没续约就认为它已经死了
+HEARTBEAT_SECONDS = 30 # worker 续约的间隔
+MAX_ATTEMPTS = 3 # 一个单元最多被领取几次，超过后标记为失败，不再重试
+
+def log_error(message):
+    scanner.log_error(message)
+
+def connect_queue(queue_path):
+    """
+    打开工作队列。自己管理事务（BEGIN IMMEDIATE），多个 worker 同时领取时不会领到同一个单元。
+    """
+    connection = sqlite3.connect(queue_path, timeout=60, isolation_level=None)
+    connection.execute("PRAGMA busy_timeout = 60000")
+    connection.execute("""CREATE TABLE IF NOT EXISTS units (
+        id INTEGER PRIMARY KEY,
+        folder TEXT NOT NULL,
+        recursive INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        worker TEXT,
+        lease_until REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        file_count INTEGER,
+        result BLOB,
+        error TEXT)""")
+    connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    return connection
+
+def partition_folder(folder_path, depth=PARTITION_DEPTH):
+    """
+    把目录树切成工作单元，返回 [(文件夹, 是否包含子文件夹)]。只列目录，不看文件，共享存储上也很快。
+    """
+    units = []
+    pending = [(os.path.abspath(folder_path), 0)]
+    while pending:
+        folder, level = pending.pop()
+        if level >= depth:
+            units.append((folder, True))
+            continue
+        units.append((folder, False))
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append((entry.path, level + 1))
+        except OSError as e:
+            log_error(f"无法列出文件夹 '{folder}': {e}")
+    units.sort()
+    return units
+
+def init_queue(queue_path, folder_path, depth=PARTITION_DEPTH):
+    """
+    协调端：清空队列，写入新的工作单元。
+    """
+    units = partition_folder(folder_path, depth)
+    connection = connect_queue(queue_path)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute("DELETE FROM units")
+        connection.executemany("INSERT INTO units (folder, recursive) VALUES (?, ?)",
+                               [(folder, int(recursive)) for folder, recursive in units])
+        connection.execute("INSERT OR REPLACE INTO meta VALUES ('root', ?)", (os.path.abspath(folder_path),))
+        connection.execute("COMMIT")
+    finally:
+        connection.close()
+    print(f"已写入 {len(units)} 个工作单元: {queue_path}")
+    return len(units)
+
+def claim_unit(connection, worker_id, lease_seconds=LEASE_SECONDS):
+    """
+    领取一个待处理的单元，或者一个租约已经过期（worker 死掉了）的单元。没有可领取的单元时返回 None。
+    """
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        # 超过重试次数的过期单元直接标记为失败
+        connection.execute("""UPDATE units SET status = 'failed', error = COALESCE(error, '多次领取后仍未完成')
+                              WHERE status = 'running' AND lease_until < ? AND attempts >= ?""", (now, MAX_ATTEMPTS))
+        unit = connection.execute("""SELECT id, folder, recursive, status, worker FROM units
+                                     WHERE status = 'pending' OR (status = 'running' AND lease_until < ?)
+                                     ORDER BY id LIMIT 1""", (now,)).fetchone()
+        if unit is not None:
+            connection.execute("""UPDATE units SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1
+                                  WHERE id = ?""", (worker_id, now + lease_seconds, unit[0]))
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    if unit is not None and unit[3] == "running":
+        print(f"重新分配工作单元 {unit[0]}（原 worker {unit[4]} 的租约已过期）: {unit[1]}")
+    return unit
+
+def renew_lease(connection, unit_id, worker_id, lease_seconds=LEASE_SECONDS):
+    """
+    续约。返回 False 表示单元已经被别的 worker 接手。
+    """
+    cursor = connection.execute("""UPDATE units SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'""",
+                                (time.time() + lease_seconds, unit_id, worker_id))
+    return cursor.rowcount == 1
+
+def complete_unit(connection, unit_id, worker_id, rows, error=None):
+    """
+    交回结果。只有仍然持有这个单元的 worker 才能交，返回是否被接受。
+    """
+    payload = zlib.compress(json.dumps(rows, ensure_ascii=False).encode("utf-8"))
+    cursor = connection.execute("""UPDATE units SET status = ?, result = ?, file_count = ?, error = ?, lease_until = NULL
+                                   WHERE id = ? AND worker = ? AND status = 'running'""",
+                                ("failed" if error else "done", payload, len(rows), error, unit_id, worker_id))
+    return cursor.rowcount == 1
+
+def iter_unit_files(folder, recursive):
+    """
+    产出 (图片路径, {扩展名: 附带文件路径})，找附带文件的规则和单机扫描一样。
+    """
+    for absolute_path, _, sidecar_paths in scanner.iter_image_files_with_sidecar_paths(folder, recursive):
+        yield absolute_path, sidecar_paths
+
+def _json_safe_row(row):
+    return {key: (value if isinstance(value, (str, int, float, bool)) or value is None else str(value))
+            for key, value in row.items()}
+
+def scan_unit(folder, recursive, stop_event=None):
+    """
+    处理一个单元。stop_event 被设置（租约丢了）时立刻停下，返回已经处理的部分（调用方会丢弃）。
+    """
+    rows = []
+    for path, sidecar_paths in iter_unit_files(folder, recursive):
+        if stop_event is not None and stop_event.is_set():
+            break
+        # 和单机扫描走同一个函数，附带文件的信息也一起合并
+        sidecars = scanner.read_sidecar_files(sidecar_paths) if scanner.ENABLE_SIDECAR_FILES else None
+        row, _ = scanner.scan_image_file(path, sidecars=sidecars)
+        rows.append(_json_safe_row(row))
+    return rows
+
+def run_worker(queue_path, worker_id=None, idle_exit=True, poll_seconds=5,
+               lease_seconds=LEASE_SECONDS, heartbeat_seconds=HEARTBEAT_SECONDS):
+    """
+    worker：不停领取单元并处理，直到队列里没有待处理的单元。
+    idle_exit 为 False 时一直等待新的单元（适合常驻的扫描机器）。
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    connection = connect_queue(queue_path)
+    processed = 0
+    try:
+        while True:
+            unit = claim_unit(connection, worker_id, lease_seconds)
+            if unit is None:
+                remaining = connection.execute("SELECT COUNT(*) FROM units WHERE status IN ('pending', 'running')").fetchone()[0]
+                if idle_exit and remaining == 0:
+                    break
+                time.sleep(poll_seconds) # 还有别的 worker 在跑的单元，等它们完成或者租约过期
+                continue
+            unit_id, folder, recursive = unit[0], unit[1], bool(unit[2])
+            stop_heartbeat = threading.Event()
+            lost = threading.Event()
+
+            def heartbeat():
+                # 续约用单独的连接，而且要在这个线程里打开：sqlite 连接不能跨线程用
+                try:
+                    heartbeat_connection = connect_queue(queue_path)
+                except sqlite3.Error as e:
+                    log_error(f"续约失败（单元 {unit_id}）: {e}")
+                    lost.set()
+                    return
+                try:
+                    while not stop_heartbeat.wait(heartbeat_seconds):
+                        if not renew_lease(heartbeat_connection, unit_id, worker_id, lease_seconds):
+                            lost.set()
+                            return
+                except sqlite3.Error as e:
+                    # 续不上约就不能保证单元还归自己，停止处理，让租约过期后由别的 worker 重做
+                    log_error(f"续约失败（单元 {unit_id}），停止处理: {e}")
+                    lost.set()
+                finally:
+                    heartbeat_connection.close()
+
+            heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+            heartbeat_thread.start()
+            rows, error = [], None
+            try:
+                rows = scan_unit(folder, recursive, stop_event=lost)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                log_error(f"工作单元 {unit_id} 处理失败 '{folder}': {error}")
+            finally:
+                stop_heartbeat.set()
+                heartbeat_thread.join()
+            if lost.is_set() or not complete_unit(connection, unit_id, worker_id, rows, error):
+                print(f"工作单元 {unit_id} 已被重新分配给别的 worker，丢弃本次结果。")
+                continue
+            processed += 1
+            print(f"[{worker_id}] 完成工作单元 {unit_id}: {folder}（{len(rows)} 个文件）")
+    finally:
+        connection.close()
+    return processed
+
+def queue_status(queue_path):
+    connection = connect_queue(queue_path)
+    try:
+        return dict(connection.execute("SELECT status, COUNT(*) FROM units GROUP BY status").fetchall())
+    finally:
+        connection.close()
+
+def merge_results(queue_path):
+    """
+    按单元顺序（文件夹路径排序）合并所有已完成单元的结果，返回和 get_image_info 一样的行列表。
+    """
+    connection = connect_queue(queue_path)
+    image_data = []
+    try:
+        for unit_id, folder, status, result, error in connection.execute(
+                "SELECT id, folder, status, result, error FROM units ORDER BY folder, id"):
+            if status != "done":
+                log_error(f"工作单元 {unit_id} 未完成（{status}）: '{folder}' {error or ''}")
+                continue
+            image_data.extend(json.loads(zlib.decompress(result).decode("utf-8")))
+    finally:
+        connection.close()
+    return image_data
+
+def create_merged_report(queue_path):
+    image_data = merge_results(queue_path)
+    prompt_table = scanner.PromptTable() if scanner.ENABLE_PROMPT_TABLE else None
+    model_usage = scanner.ModelUsageAggregator() if scanner.ENABLE_MODEL_USAGE else None
+    folder_summary = scanner.FolderSummaryAggregator() if scanner.ENABLE_FOLDER_SUMMARY else None
+    for row in image_data:
+        if prompt_table is not None:
+            prompt_table.add(row)
+        if model_usage is not None:
+            model_usage.add(row)
+        if folder_summary is not None:
+            folder_summary.add(row)
+    print(f"合并了 {len(image_data)} 个文件的结果。")
+    scanner.create_excel_report(image_data, prompt_table=prompt_table, model_usage=model_usage,
+                                folder_summary=folder_summary)
+    return image_data
+
+def run_local(folder_path, queue_path, worker_count, depth=PARTITION_DEPTH):
+    """
+    单机试运行：初始化队列，在本机启动若干个 worker 子进程，全部完成后合并出报告。
+    """
+    init_queue(queue_path, folder_path, depth)
+    workers = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker", "--queue", queue_path,
+                                 "--id", f"{socket.gethostname()}-local{i}"])
+               for i in range(worker_count)]
+    for process in workers:
+        process.wait()
+    status = queue_status(queue_path)
+    print("队列状态: " + "，".join(f"{key}: {value}" for key, value in sorted(status.items())))
+    return create_merged_report(queue_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="多台机器一起扫描共享存储上的图片归档")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    init_parser = subparsers.add_parser("init", help="协调端：切分目录树，写入工作队列")
+    init_parser.add_argument("folder")
+    init_parser.add_argument("--depth", type=int, default=PARTITION_DEPTH, help="切分到第几层文件夹")
+
+    worker_parser = subparsers.add_parser("worker", help="领取并处理工作单元")
+    worker_parser.add_argument("--id", help="worker 名称，默认是 主机名-进程号")
+    worker_parser.add_argument("--wait", action="store_true", help="队列空了也不退出，等待新的单元")
+
+    subparsers.add_parser("status", help="查看队列里各状态的单元数")
+    subparsers.add_parser("merge", help="合并已完成的结果，生成报告")
+
+    local_parser = subparsers.add_parser("local", help="单机试运行：初始化 + 本机多个 worker + 合并")
+    local_parser.add_argument("folder")
+    local_parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    local_parser.add_argument("--depth", type=int, default=PARTITION_DEPTH)
+
+    for sub in (init_parser, worker_parser, local_parser) + tuple(subparsers.choices[name] for name in ("status", "merge")):
+        sub.add_argument("--queue", default=DEFAULT_QUEUE_PATH, help="工作队列文件（放在共享目录里）")
+    args = parser.parse_args()
+
+    if args.command in ("init", "local") and not os.path.isdir(args.folder):
+        print(f"错误: 文件夹 '{args.folder}' 不存在。请提供一个有效的文件夹路径。")
+        log_error(f"用户输入的文件夹 '{args.folder}' 不存在。")
+        return
+    if args.command == "init":
+        init_queue(args.queue, args.folder, args.depth)
+    elif args.command == "worker":
+        run_worker(args.queue, args.id, idle_exit=not args.wait)
+    elif args.command == "status":
+        print(json.dumps(queue_status(args.queue), ensure_ascii=False))
+    elif args.command == "merge":
+        create_merged_report(args.queue)
+    elif args.command == "local":
+        run_local(args.folder, args.queue, args.workers, args.depth)
+
+if __name__ == "__main__":
+    main()
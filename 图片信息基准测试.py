@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import warnings
+import subprocess
+import importlib.util
+from types import SimpleNamespace
+from datetime import datetime
+import pandas as pd
+from PIL import Image, PngImagePlugin
+
+# 跨版本的回归和速度测试：
+# 1. 生成一个固定的合成图片集（不需要联网），包括带A1111参数的PNG、带UserComment的JPEG、WebP、
+#    截断和损坏的文件、超长提示词。
+# 2. 每个版本的脚本在单独的子进程里跑 get_image_info 和 create_excel_report，互不影响，峰值内存也分开算。
+# 3. 输出 每秒文件数、峰值内存，以及各版本和基准版本之间逐字段的差异。
+# 报错写进 image_scan_error.log，结果存成xlsx，跑完按扫描脚本的 REPORT_NOTIFIER 打开或通知，不阻塞。
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS_DIR = os.path.join(SCRIPT_DIR, "基准测试图片集")
+
+# 按版本先后排列，第一个是默认的对比基准
+VERSION_SCRIPTS = [
+    "获取图片信息.py",
+    "获取图片信息并且自动打开完成文件.py",
+    "获取图片信息并且自动打开完成文件_第三版.py",
+    "获取图片信息并且自动打开完成文件_第四版.py",
+    "获取图片信息并且自动打开完成文件_第7版.py",
+    "获取图片信息并且自动打开完成文件_第8版.py",
+]
+
+PROMPT_TAGS = [
+    "masterpiece", "best quality", "1girl", "solo", "long hair", "smile", "blue eyes", "school uniform",
+    "outdoors", "cherry blossoms", "(detailed face:1.2)", "[lowres]", "looking at viewer", "BREAK",
+    "score_9", "score_8_up", "<lora:detail_tweaker:0.6>", "汉服", "桜", "夕焼け",
+]
+SAMPLERS = ["Euler a", "DPM++ 2M Karras", "DDIM", "UniPC", "DPM++ SDE Karras"]
+
+def _load_scanner():
+    """
+    第8版扫描脚本，写日志和打开结果文件都用它的。不在文件开头导入：子进程也会加载本文件，
+    顶层导入会把第8版算进每个版本的内存。
+    """
+    import 获取图片信息并且自动打开完成文件_第8版 as scanner
+    return scanner
+
+def log_error(message):
+    _load_scanner().log_error(message)
+
+def make_parameters(rng, prompt_tag_count=None):
+    """
+    按 A1111 的格式生成一段生成信息。
+    """
+    tag_count = prompt_tag_count or rng.randint(3, 25)
+    prompt = ", ".join(rng.choice(PROMPT_TAGS) for _ in range(tag_count))
+    negative = ", ".join(rng.sample(["lowres", "bad hands", "text", "watermark", "blurry", "jpeg artifacts"], 3))
+    width, height = rng.choice([(512, 768), (768, 512), (1024, 1024), (832, 1216)])
+    settings = (f"Steps: {rng.randint(10, 50)}, Sampler: {rng.choice(SAMPLERS)}, CFG scale: {rng.choice([5, 6.5, 7, 9])}, "
+                f"Seed: {rng.randint(0, 2**32 - 1)}, Size: {width}x{height}, Model hash: {rng.getrandbits(40):010x}, "
+                f"Model: {rng.choice(['animagineXL', 'ponyDiffusionV6', 'sd15_anything'])}, Version: v1.7.0")
+    return f"{prompt}\nNegative prompt: {negative}\n{settings}"
+
+def _make_image(rng, size=(96, 64)):
+    image = Image.new("RGB", size, (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+    # 画几个色块，避免所有图片都是纯色
+    for _ in range(4):
+        x, y = rng.randint(0, size[0] - 16), rng.randint(0, size[1] - 16)
+        image.paste((rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)), (x, y, x + 16, y + 16))
+    return image
+
+def _user_comment_exif(image, payload):
+    exif = image.getexif()
+    exif.get_ifd(0x8769)[0x9286] = payload
+    return exif
+
+def generate_corpus(corpus_dir, count=50, seed=20250610):
+    """
+    生成固定内容的合成图片集。同样的 count 和 seed 每次生成的内容完全一样。
+    返回 {类别: 文件数}。
+    """
+    rng = random.Random(seed)
+    if os.path.isdir(corpus_dir):
+        shutil.rmtree(corpus_dir)
+    counts = {}
+
+    def path_for(category, index, extension):
+        folder = os.path.join(corpus_dir, category, f"子文件夹_{index % 3}")
+        os.makedirs(folder, exist_ok=True)
+        counts[category] = counts.get(category, 0) + 1
+        return os.path.join(folder, f"{category}_{index:05d}{extension}")
+
+    for i in range(count):
+        image = _make_image(rng)
+        info = PngImagePlugin.PngInfo()
+        info.add_text("parameters", make_parameters(rng))
+        image.save(path_for("png_a1111", i, ".png"), pnginfo=info)
+
+    for i in range(count):
+        image = _make_image(rng)
+        parameters = make_parameters(rng)
+        variant = i % 3
+        if variant == 0:
+            payload = b"UNICODE\x00" + parameters.encode("utf-16-be")
+        elif variant == 1:
+            payload = b"UNICODE\x00" + parameters.encode("utf-16-le")
+        else:
+            payload = b"ASCII\x00\x00\x00" + parameters.encode("utf-8")
+        image.save(path_for("jpeg_usercomment", i, ".jpg"), exif=_user_comment_exif(image, payload), quality=85)
+
+    for i in range(count):
+        image = _make_image(rng)
+        payload = b"UNICODE\x00" + make_parameters(rng).encode("utf-16-be")
+        image.save(path_for("webp", i, ".webp"), exif=_user_comment_exif(image, payload))
+
+    for i in range(count):
+        image = _make_image(rng)
+        image.save(path_for("no_metadata", i, rng.choice([".png", ".jpg", ".bmp", ".gif"])))
+
+    for i in range(max(1, count // 5)):
+        image = _make_image(rng, size=(256, 256))
+        info = PngImagePlugin.PngInfo()
+        info.add_text("parameters", make_parameters(rng, prompt_tag_count=20000)) # 大约 20 万字的提示词
+        image.save(path_for("giant_prompt", i, ".png"), pnginfo=info)
+
+    for i in range(max(1, count // 5)):
+        image = _make_image(rng, size=(256, 256))
+        if i % 2 == 0:
+            target = path_for("truncated", i, ".png")
+            info = PngImagePlugin.PngInfo()
+            info.add_text("parameters", make_parameters(rng))
+            image.save(target, pnginfo=info)
+        else:
+            target = path_for("truncated", i, ".jpg")
+            payload = b"ASCII\x00\x00\x00" + make_parameters(rng).encode("utf-8")
+            image.save(target, exif=_user_comment_exif(image, payload))
+        with open(target, "rb") as f:
+            data = f.read()
+        with open(target, "wb") as f:
+            f.write(data[:max(64, int(len(data) * rng.uniform(0.3, 0.9)))])
+
+    for i in range(max(1, count // 5)):
+        target = path_for("corrupt", i, rng.choice([".png", ".jpg", ".webp"]))
+        with open(target, "wb") as f:
+            f.write(bytes(rng.getrandbits(8) for _ in range(rng.randint(0, 4096))))
+
+    return counts
+
+def _peak_rss_bytes():
+    """
+    当前进程的峰值内存（字节）。Windows 上没有 resource 模块，装了 psutil 时用 psutil 的值。
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024 # Linux 的单位是 KB
+    except ImportError:
+        try:
+            import psutil
+            info = psutil.Process().memory_info()
+            return getattr(info, "peak_wset", info.rss)
+        except ImportError:
+            return None
+
+def _load_version(script_path):
+    spec = importlib.util.spec_from_file_location("scanner_under_test", script_path)
+    module = importlib.util.module_from_spec(spec)
+    # 各版本在导入时会替换 warnings.formatwarning；第7版的格式化器又调用 warnings.formatwarning（也就是它自己），
+    # 一有警告就 RecursionError。加载完恢复原来的格式化器，每个版本都能跑完
+    original_formatwarning = warnings.formatwarning
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        warnings.formatwarning = original_formatwarning
+    # 测试时不要自动打开报告
+    module.subprocess = SimpleNamespace(run=lambda *args, **kwargs: None, Popen=lambda *args, **kwargs: None,
+                                        DEVNULL=None)
+    if hasattr(os, "startfile"):
+        os.startfile = lambda *args, **kwargs: None
+    return module
+
+def run_worker(script_path, corpus_dir, output_json):
+    """
+    子进程里运行：对一个版本跑一遍扫描和写报告，把耗时、内存和扫描结果写成json。
+    """
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    os.chdir(work_dir) # 报告和日志都写到临时目录，不污染仓库
+    module = _load_version(script_path)
+    rss_after_import = _peak_rss_bytes()
+
+    start = time.perf_counter()
+    rows = module.get_image_info(corpus_dir)
+    scan_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    module.create_excel_report(rows)
+    report_seconds = time.perf_counter() - start
+
+    result = {
+        "script": os.path.basename(script_path),
+        "files": len(rows),
+        "scan_seconds": scan_seconds,
+        "report_seconds": report_seconds,
+        "rss_after_import": rss_after_import,
+        "peak_rss": _peak_rss_bytes(),
+        "rows": [{key: (value if isinstance(value, (str, int, float, bool)) or value is None else str(value))
+                  for key, value in row.items()} for row in rows],
+    }
+    with open(output_json, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+def run_version(script_path, corpus_dir, repeat=1):
+    """
+    在子进程中运行一个版本（重复 repeat 次取最快的一次），返回 run_worker 写出的结果。
+    """
+    best = None
+    for _ in range(repeat):
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+            output_json = tmp.name
+        try:
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", script_path, corpus_dir, output_json],
+                capture_output=True, text=True, encoding="utf-8", errors="replace")
+            if completed.returncode != 0:
+                log_error(f"版本 '{os.path.basename(script_path)}' 运行失败:\n{completed.stderr[-2000:]}")
+                return None
+            with open(output_json, "r", encoding="utf-8") as f:
+                result = json.load(f)
+        finally:
+            if os.path.exists(output_json):
+                os.remove(output_json)
+        if best is None or result["scan_seconds"] < best["scan_seconds"]:
+            best = result
+    return best
+
+def diff_versions(baseline, other, max_examples=20):
+    """
+    以"图片的绝对路径"为键，逐字段对比两个版本的扫描结果。
+    返回 (每个字段的差异统计列表, 差异示例列表)。
+    """
+    baseline_rows = {row.get("图片的绝对路径"): row for row in baseline["rows"]}
+    other_rows = {row.get("图片的绝对路径"): row for row in other["rows"]}
+    common_paths = baseline_rows.keys() & other_rows.keys()
+    columns = [c for c in baseline["rows"][0] if c in other["rows"][0]] if baseline["rows"] and other["rows"] else []
+
+    summary = []
+    examples = []
+    for column in columns:
+        differing = 0
+        for path in sorted(common_paths):
+            a, b = baseline_rows[path].get(column), other_rows[path].get(column)
+            if a != b:
+                differing += 1
+                if sum(1 for e in examples if e["字段"] == column) < max_examples:
+                    examples.append({
+                        "对比版本": other["script"], "字段": column, "图片的绝对路径": path,
+                        "基准值": str(a)[:500], "对比值": str(b)[:500],
+                    })
+        summary.append({"对比版本": other["script"], "字段": column, "不同的行数": differing, "共同的行数": len(common_paths)})
+
+    only_columns = [c for c in (other["rows"][0] if other["rows"] else {}) if c not in columns]
+    for column in only_columns:
+        summary.append({"对比版本": other["script"], "字段": column, "不同的行数": "基准版本没有这一列", "共同的行数": len(common_paths)})
+    summary.append({"对比版本": other["script"], "字段": "(只在基准版本中的文件)", "不同的行数": len(baseline_rows.keys() - other_rows.keys()), "共同的行数": ""})
+    summary.append({"对比版本": other["script"], "字段": "(只在对比版本中的文件)", "不同的行数": len(other_rows.keys() - baseline_rows.keys()), "共同的行数": ""})
+    return summary, examples
+
+def create_benchmark_report(results, baseline_script, base_filename="基准测试报告"):
+    """
+    把性能数据和字段差异写进xlsx，并尝试自动打开。
+    """
+    performance_rows = []
+    for result in results:
+        scan_seconds = result["scan_seconds"] or 1e-9
+        performance_rows.append({
+            "版本": result["script"],
+            "文件数": result["files"],
+            "扫描耗时(秒)": round(result["scan_seconds"], 3),
+            "每秒文件数": round(result["files"] / scan_seconds, 1),
+            "写报告耗时(秒)": round(result["report_seconds"], 3),
+            "导入后内存(MB)": round(result["rss_after_import"] / 1048576, 1) if result["rss_after_import"] else "",
+            "峰值内存(MB)": round(result["peak_rss"] / 1048576, 1) if result["peak_rss"] else "",
+        })
+
+    baseline = next(r for r in results if r["script"] == baseline_script)
+    diff_summary, diff_examples = [], []
+    for result in results:
+        if result is baseline:
+            continue
+        summary, examples = diff_versions(baseline, result)
+        diff_summary.extend(summary)
+        diff_examples.extend(examples)
+
+    print(pd.DataFrame(performance_rows).to_string(index=False))
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    output_filename = f"{base_filename}_{timestamp}.xlsx"
+    with pd.ExcelWriter(output_filename, engine="openpyxl") as writer:
+        pd.DataFrame(performance_rows).to_excel(writer, index=False, sheet_name="性能")
+        pd.DataFrame(diff_summary, columns=["对比版本", "字段", "不同的行数", "共同的行数"]).to_excel(writer, index=False, sheet_name="字段差异统计")
+        pd.DataFrame(diff_examples, columns=["对比版本", "字段", "图片的绝对路径", "基准值", "对比值"]).to_excel(writer, index=False, sheet_name="字段差异示例")
+    print(f"基准测试结果已保存到 {output_filename}（以 {baseline_script} 为对比基准）")
+
+    _load_scanner().notify_file_ready(output_filename, "基准测试结果") # 按扫描脚本的通知设置打开结果，不阻塞
+    return output_filename
+
+def main():
+    parser = argparse.ArgumentParser(description="对各版本的图片信息扫描脚本做回归和速度测试")
+    parser.add_argument("versions", nargs="*", help="要测试的脚本文件名，默认测试全部版本")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR, help="合成图片集所在的文件夹")
+    parser.add_argument("--count", type=int, default=50, help="每类图片生成多少张")
+    parser.add_argument("--seed", type=int, default=20250610)
+    parser.add_argument("--reuse-corpus", action="store_true", help="图片集已经存在时不重新生成")
+    parser.add_argument("--repeat", type=int, default=1, help="每个版本跑几次，取最快的一次")
+    parser.add_argument("--baseline", help="对比基准的脚本文件名，默认是第一个")
+    parser.add_argument("--worker", nargs=3, metavar=("SCRIPT", "CORPUS", "OUTPUT_JSON"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(*args.worker)
+        return
+
+    corpus_dir = os.path.abspath(args.corpus)
+    if not (args.reuse_corpus and os.path.isdir(corpus_dir)):
+        print(f"正在生成合成图片集: {corpus_dir}")
+        counts = generate_corpus(corpus_dir, count=args.count, seed=args.seed)
+        print("，".join(f"{category}: {n}" for category, n in counts.items()))
+
+    versions = args.versions or VERSION_SCRIPTS
+    results = []
+    for version in versions:
+        script_path = version if os.path.isabs(version) else os.path.join(SCRIPT_DIR, version)
+        if not os.path.exists(script_path):
+            log_error(f"找不到要测试的脚本 '{script_path}'")
+            continue
+        print(f"正在测试: {os.path.basename(script_path)}")
+        result = run_version(script_path, corpus_dir, repeat=args.repeat)
+        if result:
+            results.append(result)
+
+    if not results:
+        print("没有任何版本运行成功。")
+        return
+    baseline_script = os.path.basename(args.baseline) if args.baseline else results[0]["script"]
+    if baseline_script not in [r["script"] for r in results]:
+        baseline_script = results[0]["script"]
+    create_benchmark_report(results, baseline_script)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import asyncio
+import heapq
+import argparse
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+# 本地查询服务：扫描一次，把结果和"标签 → 图片"索引一直放在内存里，大家通过 HTTP 查，不用每人都把 NAS 扫一遍。
+# - 解析用的是扫描脚本里同一套流程（scan_image_file，隔离清单照常生效）；
+# - 后台定时增量刷新：只 stat 文件，大小和修改时间没变的不重新解析，新增/删除的文件同步到索引；
+# - 只用标准库的 asyncio，默认只监听 127.0.0.1。
+#
+# 接口（都返回 json）：
+#   GET /search?tag=1girl&tag=smile&q=汉服&filter=Steps>=20&limit=50&offset=0
+#       tag 可以重复，表示同时包含；q 是生成信息里的文字；filter 是扫描脚本 SCAN_FILTER 的写法
+#       只按标签查时 total 是准确的总数；带 q 或 filter 时找够 offset+limit 条就停，
+#       后面还有没扫到的结果时 total 为 null、has_more 为 true
+#   GET /file?path=/绝对/路径.png     某个文件的完整信息
+#   GET /stat                        总数、有生成信息的数量、损坏文件数、常见标签、上次刷新情况
+#   POST /refresh                    立即增量刷新一次
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+REFRESH_INTERVAL_SECONDS = 300
+DEFAULT_SEARCH_LIMIT = 100
+MAX_SEARCH_LIMIT = 5000
+
+def log_error(message):
+    scanner.log_error(message)
+
+class ImageIndex:
+    """
+    内存里的扫描结果。只在事件循环线程里修改；扫描在线程池里做，做完把变化交回事件循环再应用。
+    """
+    def __init__(self, folder_path):
+        self.folder_path = os.path.abspath(folder_path)
+        self.quarantine = scanner.QuarantineList() if scanner.ENABLE_QUARANTINE else None
+        self.entries = {} # 路径 -> (文件大小, 修改时间, 行, 附带文件的修改时间, 小写的生成信息)
+        self.tag_index = {} # 标签 -> 路径集合
+        self.sorted_paths = [] # 新增：排好序的路径，刷新时有增删才重建，不带标签的查询直接用
+        self.summary = None # 新增：/stat 的统计（常用标签等），刷新有变化时清空，下次请求时算一次
+        self.last_refresh = None
+
+    def collect_changes(self):
+        """
+        在线程池里运行：遍历目录，返回 ([(路径, 新记录)], [删除的路径], 耗时)。
+        """
+        start = time.perf_counter()
+        changed = []
+        seen = set()
+        for absolute_path, _, sidecar_paths in scanner.iter_image_files_with_sidecar_paths(self.folder_path):
+            seen.add(absolute_path)
+            try:
+                st = os.stat(absolute_path)
+            except OSError as e:
+                log_error(f"无法读取文件信息 '{absolute_path}': {e}")
+                continue
+            # 附带文件新增、删除或者修改了，图片本身没变也要重新合并
+            sidecar_key = self._sidecar_key(sidecar_paths)
+            old = self.entries.get(absolute_path)
+            if old is not None and old[0] == st.st_size and old[1] == st.st_mtime_ns and old[3] == sidecar_key:
+                continue
+            sidecars = scanner.read_sidecar_files(sidecar_paths) if scanner.ENABLE_SIDECAR_FILES else None
+            row, _ = scanner.scan_image_file(absolute_path, self.quarantine, sidecars=sidecars)
+            if row is not None:
+                # 小写的生成信息在这里（线程池里）算好，查询时不用每次都转换
+                search_text = str(row.get("去掉换行符的生成信息", "")).lower()
+                changed.append((absolute_path, (st.st_size, st.st_mtime_ns, row, sidecar_key, search_text)))
+        removed = [path for path in self.entries if path not in seen]
+        if self.quarantine is not None:
+            self.quarantine.save()
+        return changed, removed, time.perf_counter() - start
+
+    @staticmethod
+    def _sidecar_key(sidecar_paths):
+        key = []
+        for kind, sidecar_path in sorted(sidecar_paths.items()):
+            try:
+                st = os.stat(sidecar_path)
+                key.append((kind, sidecar_path, st.st_size, st.st_mtime_ns))
+            except OSError:
+                continue
+        return tuple(key)
+
+    def apply_changes(self, changed, removed, seconds):
+        paths_changed = bool(removed)
+        for absolute_path in removed:
+            self._unindex(absolute_path)
+            del self.entries[absolute_path]
+        for absolute_path, entry in changed:
+            if absolute_path in self.entries:
+                self._unindex(absolute_path)
+            else:
+                paths_changed = True
+            self.entries[absolute_path] = entry
+            for tag in scanner.split_prompt_tags(entry[2].get("正面提示词", "")):
+                self.tag_index.setdefault(tag, set()).add(absolute_path)
+        if paths_changed:
+            self.sorted_paths = sorted(self.entries)
+        if changed or removed:
+            self.summary = None
+        self.last_refresh = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "changed": len(changed),
+            "removed": len(removed),
+            "seconds": round(seconds, 3),
+        }
+
+    def _unindex(self, absolute_path):
+        for tag in scanner.split_prompt_tags(self.entries[absolute_path][2].get("正面提示词", "")):
+            paths = self.tag_index.get(tag)
+            if paths is not None:
+                paths.discard(absolute_path)
+                if not paths:
+                    del self.tag_index[tag]
+
+    def search(self, tags=(), text="", filter_expression="", limit=DEFAULT_SEARCH_LIMIT, offset=0):
+        scan_filter = scanner.ScanFilter(filter_expression) if filter_expression.strip() else None
+        text = text.lower()
+        if tags:
+            # 从最少的标签开始求交集
+            candidate_sets = sorted((self.tag_index.get(scanner._normalize_filter_tag(tag), set()) for tag in tags), key=len)
+            candidates = set(candidate_sets[0]).intersection(*candidate_sets[1:])
+            if not text and scan_filter is None:
+                # 只要这一页：不用把所有候选都排序
+                page = heapq.nsmallest(offset + limit, candidates)[offset:]
+                return self._page(page, len(candidates), offset)
+            paths = sorted(candidates)
+        elif not text and scan_filter is None:
+            return self._page(self.sorted_paths[offset:offset + limit], len(self.sorted_paths), offset)
+        else:
+            paths = self.sorted_paths
+        # 要逐行检查的查询：找够 offset+limit 条就停，不扫完整个索引
+        matched = []
+        has_more = False
+        for absolute_path in paths:
+            entry = self.entries[absolute_path]
+            if text and text not in entry[4]:
+                continue
+            if scan_filter is not None and not (scan_filter.match_path(absolute_path) and scan_filter.match_row(entry[2])):
+                continue
+            if len(matched) == offset + limit:
+                has_more = True
+                break
+            matched.append(absolute_path)
+        return self._page(matched[offset:], None if has_more else len(matched), offset, has_more)
+
+    def _page(self, paths, total, offset, has_more=None):
+        if has_more is None:
+            has_more = offset + len(paths) < total
+        return {"total": total, "has_more": has_more, "offset": offset,
+                "results": [self.entries[absolute_path][2] for absolute_path in paths]}
+
+    def stat(self, top_tags=50):
+        if self.summary is None:
+            rows = [entry[2] for entry in self.entries.values()]
+            self.summary = {
+                "images": len(rows),
+                "with_generation_info": sum(1 for row in rows if row.get("其他设置")),
+                "damaged": sum(1 for row in rows if row.get("损坏原因")),
+                "distinct_tags": len(self.tag_index),
+                "tag_counts": Counter({tag: len(paths) for tag, paths in self.tag_index.items()}),
+                "top_tags": {},
+            }
+        summary = self.summary
+        if top_tags not in summary["top_tags"]:
+            summary["top_tags"][top_tags] = summary["tag_counts"].most_common(top_tags)
+        return {
+            "folder": self.folder_path,
+            "images": summary["images"],
+            "with_generation_info": summary["with_generation_info"],
+            "damaged": summary["damaged"],
+            "distinct_tags": summary["distinct_tags"],
+            "top_tags": summary["top_tags"][top_tags],
+            "last_refresh": self.last_refresh,
+        }
+
+class QueryService:
+    def __init__(self, folder_path, host=DEFAULT_HOST, port=DEFAULT_PORT, refresh_interval=REFRESH_INTERVAL_SECONDS):
+        self.index = ImageIndex(folder_path)
+        self.host = host
+        self.port = port
+        self.refresh_interval = refresh_interval
+        self._refresh_lock = None
+        self.server = None
+
+    async def refresh(self):
+        """
+        增量刷新。同一时间只有一次刷新在跑，刷新期间照常响应查询（查到的是刷新前的数据）。
+        """
+        async with self._refresh_lock:
+            loop = asyncio.get_running_loop()
+            changed, removed, seconds = await loop.run_in_executor(None, self.index.collect_changes)
+            self.index.apply_changes(changed, removed, seconds)
+            print(f"刷新完成: 新增或修改 {len(changed)}，删除 {len(removed)}，用时 {seconds:.1f} 秒，共 {len(self.index.entries)} 个文件")
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                log_error(f"定时刷新失败: {e}")
+
+    def handle(self, method, target):
+        """
+        处理一个请求，返回 (状态码, json对象)。
+        """
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        first = lambda name, default="": params.get(name, [default])[0]
+        if url.path == "/search" and method == "GET":
+            try:
+                limit = min(int(first("limit", DEFAULT_SEARCH_LIMIT)), MAX_SEARCH_LIMIT)
+                offset = max(int(first("offset", 0)), 0)
+                return 200, self.index.search(params.get("tag", []), first("q"), first("filter"), limit, offset)
+            except ValueError as e:
+                return 400, {"error": str(e)}
+        if url.path == "/file" and method == "GET":
+            entry = self.index.entries.get(os.path.abspath(first("path"))) if first("path") else None
+            if entry is None:
+                return 404, {"error": "索引里没有这个文件"}
+            return 200, entry[2]
+        if url.path == "/stat" and method == "GET":
+            return 200, self.index.stat()
+        if url.path == "/refresh" and method == "POST":
+            return None, None # 需要等待，由 handle_connection 处理
+        return 404, {"error": f"不支持的请求: {method} {url.path}"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._send(writer, 400, {"error": "请求格式不对"}, keep_alive=False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    content_length = int(headers.get("content-length", 0) or 0)
+                    if content_length < 0:
+                        raise ValueError(content_length)
+                except ValueError:
+                    await self._send(writer, 400, {"error": "Content-Length 不对"}, keep_alive=False)
+                    break
+                if content_length:
+                    await reader.readexactly(content_length)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                try:
+                    status, body = self.handle(method, target)
+                    if status is None:
+                        await self.refresh()
+                        status, body = 200, self.index.last_refresh
+                except Exception as e:
+                    log_error(f"处理请求失败 '{target}': {e}")
+                    status, body = 500, {"error": str(e)}
+                await self._send(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send(self, writer, status, body, keep_alive):
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+        payload = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+        writer.write((f"HTTP/1.1 {status} {reasons.get(status, 'OK')}\r\n"
+                      f"Content-Type: application/json; charset=utf-8\r\n"
+                      f"Content-Length: {len(payload)}\r\n"
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode("latin-1") + payload)
+        await writer.drain()
+
+    async def start(self):
+        """
+        先完整扫描一次，再开始监听。返回实际监听的端口（port 为 0 时由系统分配）。
+        """
+        self._refresh_lock = asyncio.Lock()
+        print(f"正在扫描文件夹: {self.index.folder_path}...")
+        await self.refresh()
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        if self.refresh_interval:
+            self._refresh_task = asyncio.ensure_future(self._refresh_periodically())
+        print(f"查询服务已启动: http://{self.host}:{self.port}/stat")
+        return self.port
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="图片生成信息的本地查询服务")
+    parser.add_argument("folder", nargs="?", help="要扫描的文件夹")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--refresh-interval", type=int, default=REFRESH_INTERVAL_SECONDS, help="自动增量刷新的间隔秒数，0 表示不自动刷新")
+    args = parser.parse_args()
+
+    folder = args.folder or input("请输入要扫描的文件夹路径: ")
+    if not os.path.isdir(folder):
+        print(f"错误: 文件夹 '{folder}' 不存在。请提供一个有效的文件夹路径。")
+        log_error(f"用户输入的文件夹 '{folder}' 不存在。")
+        return
+    try:
+        asyncio.run(QueryService(folder, args.host, args.port, args.refresh_interval).serve_forever())
+    except KeyboardInterrupt:
+        print("查询服务已停止。")
+
+if __name__ == "__main__":
+    main()
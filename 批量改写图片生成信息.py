@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import mmap
+import zlib
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import 获取图片信息并且自动打开完成文件_第8版 as scanner
+
+# 批量删除/改写图片里的生成信息（比如发图前去掉提示词，或者修复 UNICODE 乱码）。
+# 用的是扫描脚本里同一套 PNG 块 / JPEG 段解析：只重写文本块或 APP1 段，图像数据原样拷贝
+# （Linux 上用 copy_file_range / sendfile 在内核里直接拷，不经过 Python），不重新编码，画质不变。
+# 写文件先写到同一个文件夹里的临时文件，写完再 os.replace，中途出错原文件不会坏。
+
+# 删除模式下会去掉的 PNG 文本块关键字：A1111 的 parameters，ComfyUI 的 prompt / workflow
+GENERATION_TEXT_KEYWORDS = ("parameters", "prompt", "workflow", "Comment", "Description")
+COPY_CHUNK_BYTES = 16 * 1024 * 1024
+
+def log_error(message):
+    scanner.log_error(message)
+
+# ---------- 拷贝：优先零拷贝，不支持时退回到内存映射切片 ----------
+
+def _copy_range(source_fd, target_fd, offset, length, source_map):
+    """
+    把源文件 [offset, offset+length) 这一段追加写到目标文件当前位置。
+    """
+    remaining = length
+    if hasattr(os, "copy_file_range"):
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(source_fd, target_fd, min(remaining, COPY_CHUNK_BYTES), offset_src=offset)
+                if copied == 0:
+                    break
+                offset += copied
+                remaining -= copied
+        except OSError:
+            pass # 比如跨文件系统或者内核太旧，下面换别的办法拷剩下的部分
+    if remaining > 0 and sys.platform.startswith("linux") and hasattr(os, "sendfile"):
+        try:
+            while remaining > 0:
+                copied = os.sendfile(target_fd, source_fd, offset, min(remaining, COPY_CHUNK_BYTES))
+                if copied == 0:
+                    break
+                offset += copied
+                remaining -= copied
+        except OSError:
+            pass
+    while remaining > 0:
+        view = memoryview(source_map)[offset:offset + min(remaining, COPY_CHUNK_BYTES)]
+        try:
+            written = os.write(target_fd, view)
+        finally:
+            view.release()
+        offset += written
+        remaining -= written
+
+def _write_all(target_fd, data):
+    view = memoryview(data)
+    while view:
+        written = os.write(target_fd, view)
+        view = view[written:]
+
+def write_pieces_atomically(source_path, pieces, target_path=None, keep_mtime=False):
+    """
+    按 pieces 生成新文件：每一项是 bytes（新写的内容）或者 (偏移, 长度)（从源文件原样拷贝）。
+    先写临时文件再替换，target_path 为空时替换源文件本身。
+    """
+    target_path = target_path or source_path
+    target_dir = os.path.dirname(os.path.abspath(target_path))
+    os.makedirs(target_dir, exist_ok=True)
+    temp_path = os.path.join(target_dir, f".{os.path.basename(target_path)}.{os.getpid()}.tmp")
+    source_stat = os.stat(source_path)
+    try:
+        with open(source_path, "rb") as source, open(temp_path, "wb") as target:
+            if source_stat.st_size: # 空文件不能做内存映射，也没有要拷的内容
+                with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as source_map:
+                    for piece in pieces:
+                        if isinstance(piece, (bytes, bytearray)):
+                            _write_all(target.fileno(), piece)
+                        else:
+                            _copy_range(source.fileno(), target.fileno(), piece[0], piece[1], source_map)
+            else:
+                for piece in pieces:
+                    if isinstance(piece, (bytes, bytearray)):
+                        _write_all(target.fileno(), piece)
+            target.flush()
+            os.fsync(target.fileno())
+        os.chmod(temp_path, source_stat.st_mode & 0o7777)
+        if keep_mtime:
+            os.utime(temp_path, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+        os.replace(temp_path, target_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def _append_piece(pieces, piece):
+    """
+    相邻的拷贝区间合并成一个，减少系统调用次数。
+    """
+    if pieces and not isinstance(piece, bytes) and not isinstance(pieces[-1], bytes):
+        last_offset, last_length = pieces[-1]
+        if last_offset + last_length == piece[0]:
+            pieces[-1] = (last_offset, last_length + piece[1])
+            return
+    if isinstance(piece, bytes) or piece[1] > 0:
+        pieces.append(piece)
+
+# ---------- PNG ----------
+
+def _png_chunk(chunk_type, payload):
+    return (len(payload).to_bytes(4, "big") + chunk_type + payload
+            + zlib.crc32(chunk_type + payload).to_bytes(4, "big"))
+
+def _png_text_chunk(keyword, text):
+    """
+    能用 latin-1 表示的写成 tEXt，否则写成 UTF-8 的 iTXt（中文日文提示词）。
+    """
+    try:
+        return _png_chunk(b"tEXt", keyword.encode("latin-1") + b"\x00" + text.encode("latin-1"))
+    except UnicodeEncodeError:
+        return _png_chunk(b"iTXt", keyword.encode("latin-1") + b"\x00\x00\x00\x00\x00" + text.encode("utf-8"))
+
+def plan_png_rewrite(data, transform, keywords):
+    """
+    生成 PNG 的改写计划。transform(关键字, 文本) 返回新文本，返回 None 表示删除这个文本块。
+    返回 (pieces, 改动说明列表)，没有改动时 pieces 为 None。
+    """
+    pieces = [(0, 8)]
+    changes = []
+    for chunk_type, chunk_start, data_start, length in scanner.iter_png_chunks(data):
+        chunk_end = data_start + length + 4
+        if chunk_type in scanner.PNG_TEXT_CHUNK_TYPES:
+            keyword, text = scanner.decode_png_text_chunk(chunk_type, data[data_start:data_start + length])
+            if keyword in keywords:
+                new_text = transform(keyword, text)
+                if new_text is None:
+                    changes.append(f"删除 {keyword}")
+                    continue
+                if new_text != text:
+                    changes.append(f"改写 {keyword}")
+                    _append_piece(pieces, _png_text_chunk(keyword, new_text))
+                    continue
+        _append_piece(pieces, (chunk_start, chunk_end - chunk_start))
+    return (pieces if changes else None), changes
+
+# ---------- JPEG ----------
+
+def _find_ifd_entry(tiff, ifd_offset, byte_order, tag):
+    """
+    返回 IFD 里某个标签的条目位置，没有时返回 None。
+    """
+    if ifd_offset + 2 > len(tiff):
+        return None
+    entry_count = int.from_bytes(tiff[ifd_offset:ifd_offset + 2], byte_order)
+    for i in range(entry_count):
+        entry = ifd_offset + 2 + i * 12
+        if entry + 12 > len(tiff):
+            return None
+        if int.from_bytes(tiff[entry:entry + 2], byte_order) == tag:
+            return entry
+    return None
+
+def _set_tiff_value(tiff, entry, byte_order, new_value):
+    """
+    改写 TIFF 条目的值（tiff 是 bytearray）。原来的位置放得下就原地写，放不下就追加到末尾再改偏移；
+    旧的内容清零，避免被删掉的提示词还留在文件里。
+    """
+    old_count = int.from_bytes(tiff[entry + 4:entry + 8], byte_order)
+    old_offset = int.from_bytes(tiff[entry + 8:entry + 12], byte_order)
+    if old_count > 4:
+        tiff[old_offset:old_offset + old_count] = b"\x00" * old_count
+    else:
+        tiff[entry + 8:entry + 12] = b"\x00" * 4
+
+    if len(new_value) <= 4:
+        tiff[entry + 8:entry + 12] = new_value.ljust(4, b"\x00")
+    elif old_count > 4 and len(new_value) <= old_count:
+        tiff[old_offset:old_offset + len(new_value)] = new_value
+    else:
+        if len(tiff) % 2:
+            tiff.append(0) # TIFF 的偏移要求是偶数
+        new_offset = len(tiff)
+        tiff.extend(new_value)
+        tiff[entry + 8:entry + 12] = new_offset.to_bytes(4, byte_order)
+    tiff[entry + 4:entry + 8] = len(new_value).to_bytes(4, byte_order)
+
+def encode_exif_user_comment(text, byte_order):
+    """
+    写成带 UNICODE 字符集标识的 UTF-16（按 TIFF 头的字节序），纯 ASCII 的写成 ASCII。
+    """
+    if text.isascii():
+        return b"ASCII\x00\x00\x00" + text.encode("ascii")
+    return b"UNICODE\x00" + text.encode("utf-16-le" if byte_order == "little" else "utf-16-be")
+
+def plan_jpeg_rewrite(data, transform):
+    """
+    生成 JPEG 的改写计划：只重建 APP1 Exif 段里的 UserComment / ImageDescription，其余部分原样拷贝。
+    返回 (pieces, 改动说明列表)，没有改动时 pieces 为 None。
+    """
+    for marker, segment_start, segment_end in scanner.iter_jpeg_segments(data):
+        if marker == 0xE1 and data[segment_start + 4:segment_start + 10] == b"Exif\x00\x00":
+            break
+    else:
+        return None, []
+    if segment_start == segment_end: # 走到了 SOS，没有 Exif
+        return None, []
+
+    tiff = bytearray(data[segment_start + 10:segment_end])
+    if len(tiff) < 8:
+        return None, []
+    byte_order = "little" if tiff[:2] == b"II" else "big"
+    fields, _ = scanner.read_exif_tiff_fields(bytes(tiff))
+    ifd0_offset = int.from_bytes(tiff[4:8], byte_order)
+    changes = []
+
+    user_comment = fields.get(scanner.EXIF_TAG_USER_COMMENT)
+    if user_comment:
+        text = scanner.decode_exif_user_comment(user_comment, byte_order)
+        new_text = transform("UserComment", text)
+        # 文本没变时只有 fix 模式才重新编码；replace / strip 没匹配到就不动文件
+        reencode = getattr(transform, "reencode", False) and encode_exif_user_comment(text, byte_order) != user_comment
+        if new_text is None or new_text != text or reencode:
+            pointer_entry = _find_ifd_entry(tiff, ifd0_offset, byte_order, scanner.EXIF_TAG_EXIF_IFD_POINTER)
+            exif_offset = int.from_bytes(tiff[pointer_entry + 8:pointer_entry + 12], byte_order)
+            entry = _find_ifd_entry(tiff, exif_offset, byte_order, scanner.EXIF_TAG_USER_COMMENT)
+            new_value = b"\x00" * 8 if new_text is None else encode_exif_user_comment(new_text, byte_order)
+            if new_value != user_comment:
+                _set_tiff_value(tiff, entry, byte_order, new_value)
+                changes.append("删除 UserComment" if new_text is None else "改写 UserComment")
+
+    description = fields.get(scanner.EXIF_TAG_IMAGE_DESCRIPTION)
+    if description:
+        raw = description.rstrip(b"\x00")
+        try:
+            text = raw.decode("utf-8")
+        except UnicodeDecodeError:
+            text = raw.decode("latin-1")
+        new_text = transform("ImageDescription", text)
+        if new_text != text:
+            entry = _find_ifd_entry(tiff, ifd0_offset, byte_order, scanner.EXIF_TAG_IMAGE_DESCRIPTION)
+            new_value = b"\x00" if new_text is None else new_text.encode("utf-8") + b"\x00"
+            _set_tiff_value(tiff, entry, byte_order, new_value)
+            changes.append("删除 ImageDescription" if new_text is None else "改写 ImageDescription")
+
+    if not changes:
+        return None, []
+    segment_payload = b"Exif\x00\x00" + bytes(tiff)
+    if len(segment_payload) + 2 > 0xFFFF:
+        raise ValueError("改写后的 Exif 段超过 64KB，JPEG 放不下")
+    new_segment = b"\xff\xe1" + (len(segment_payload) + 2).to_bytes(2, "big") + segment_payload
+    pieces = []
+    _append_piece(pieces, (0, segment_start))
+    _append_piece(pieces, new_segment)
+    _append_piece(pieces, (segment_end, len(data) - segment_end))
+    return pieces, changes
+
+# ---------- 改写方式 ----------
+
+def make_transform(mode, pattern=None, replacement=""):
+    """
+    strip: 删除生成信息；fix: 只按正确的编码重新写一遍（修 UNICODE 乱码）；replace: 正则替换文本。
+    """
+    if mode == "strip":
+        return lambda keyword, text: None
+    if mode == "fix":
+        def fix(keyword, text):
+            # 以前的版本会把 "UNICODE" 前缀当成正文，一起去掉
+            if text.startswith("UNICODE"):
+                text = text[len("UNICODE"):].lstrip("\x00 ")
+            return text
+        fix.reencode = True # 文本没变也按正确的编码重写
+        return fix
+    if mode == "replace":
+        compiled = re.compile(pattern, re.DOTALL)
+        return lambda keyword, text: compiled.sub(replacement, text)
+    raise ValueError(f"未知的改写方式: {mode}")
+
+def rewrite_file(absolute_path, transform, keywords=GENERATION_TEXT_KEYWORDS, target_path=None, dry_run=False, keep_mtime=False):
+    """
+    改写一个文件，返回改动说明列表（没有改动时为空）。
+    输出到别的文件夹（target_path）时，没改动的文件、空文件和不是 PNG/JPEG 的文件也原样拷过去，输出文件夹里不会少文件。
+    """
+    pieces = None
+    with open(absolute_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if bytes(data[:8]) == scanner.PNG_SIGNATURE:
+                    pieces, changes = plan_png_rewrite(data, transform, keywords)
+                elif data[:2] == b"\xff\xd8":
+                    pieces, changes = plan_jpeg_rewrite(data, transform)
+    if pieces is None:
+        if target_path and not dry_run:
+            write_pieces_atomically(absolute_path, [(0, size)] if size else [], target_path, keep_mtime)
+        return []
+    if not dry_run:
+        write_pieces_atomically(absolute_path, pieces, target_path, keep_mtime)
+    return changes
+
+def rewrite_folder(folder_path, transform, output_dir=None, dry_run=False, keep_mtime=False, max_workers=8):
+    """
+    并行改写文件夹里所有的 PNG/JPEG，返回 (改动的文件数, 出错的文件数)。
+    """
+    tasks = []
+    for root, _, files in os.walk(folder_path):
+        for file in files:
+            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
+                absolute_path = os.path.abspath(os.path.join(root, file))
+                target_path = None
+                if output_dir:
+                    target_path = os.path.join(output_dir, os.path.relpath(absolute_path, folder_path))
+                tasks.append((absolute_path, target_path))
+
+    changed = failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(rewrite_file, path, transform, GENERATION_TEXT_KEYWORDS, target, dry_run, keep_mtime): path
+                   for path, target in tasks}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                changes = future.result()
+            except Exception as e:
+                failed += 1
+                log_error(f"改写文件失败 '{path}': {e}")
+                continue
+            if changes:
+                changed += 1
+                print(f"{'[试运行] ' if dry_run else ''}{path}: {', '.join(changes)}")
+    print(f"共 {len(tasks)} 个文件，{'需要' if dry_run else '已'}改写 {changed} 个，出错 {failed} 个。")
+    return changed, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="批量删除或改写图片里的生成信息（不重新编码图像）")
+    parser.add_argument("folder", nargs="?", help="要处理的文件夹")
+    parser.add_argument("--mode", choices=["strip", "fix", "replace"], help="strip 删除 / fix 修复编码 / replace 正则替换")
+    parser.add_argument("--pattern", help="replace 模式的正则表达式")
+    parser.add_argument("--replacement", default="", help="replace 模式的替换文本")
+    parser.add_argument("--output-dir", help="写到另一个文件夹（保持目录结构），默认直接替换原文件")
+    parser.add_argument("--dry-run", action="store_true", help="只列出会改动哪些文件，不写入")
+    parser.add_argument("--keep-mtime", action="store_true", help="保留原文件的修改时间")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    folder = args.folder or input("请输入要处理的文件夹路径: ")
+    mode = args.mode or input("请选择改写方式 (strip 删除 / fix 修复编码 / replace 正则替换): ").strip()
+    pattern = args.pattern
+    if mode == "replace" and not pattern:
+        pattern = input("请输入要替换的正则表达式: ")
+    if not os.path.isdir(folder):
+        print(f"错误: 文件夹 '{folder}' 不存在。请提供一个有效的文件夹路径。")
+        log_error(f"用户输入的文件夹 '{folder}' 不存在。")
+        return
+    start = datetime.now()
+    rewrite_folder(folder, make_transform(mode, pattern, args.replacement), args.output_dir,
+                   args.dry_run, args.keep_mtime, args.workers)
+    print(f"用时 {(datetime.now() - start).total_seconds():.1f} 秒")
+
+if __name__ == "__main__":
+    main()
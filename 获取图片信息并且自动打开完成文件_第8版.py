@@ -4,199 +4,2926 @@ import pandas as pd
 from openpyxl.utils import get_column_letter
 from openpyxl.styles import Font, Color
 from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.drawing.image import Image as ExcelImage # 新增：用于把缩略图嵌入xlsx
 import re
 from PIL import Image, ImageFile
 from datetime import datetime
 import subprocess
 import warnings # 导入warnings模块
 import inspect # 导入inspect模块用于检查调用栈
+import hashlib # 新增：计算文件内容哈希，用于缓存
+import json # 新增：缓存索引用json保存
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED # 新增：缩略图多进程生成
+from collections import deque, Counter # 新增：自适应调度的等待队列、统计计数
+import math
+import time
+import io # 新增：从内存里的字节打开图片
+import mmap # 新增：JPEG APP 段扫描用内存映射读取文件开头
+import zlib # 新增：PNG 压缩文本块
+import fnmatch # 新增：筛选条件里的文件夹通配符
+import shlex # 新增：拆分筛选条件（支持引号）
+import gzip # 新增：扫描快照压缩保存
+import sys
+import threading # 新增：后台预先统计文件数、定时显示进度
+import heapq # 新增：外部排序的多路归并
+import shutil
+import tempfile
+from operator import itemgetter
+from openpyxl import Workbook # 新增：大数据量时流式写xlsx
+from openpyxl.cell import WriteOnlyCell
+
+# 新增：逆推标签用到的可选依赖，没安装时其他功能照常使用
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+# 新增：读 .yaml 附带文件用，没安装时按简单的"键: 值"逐行解析
+try:
+    import yaml
+except ImportError:
+    yaml = None
 
 #准备加入用点点点选择图片文件夹
 #检查一下是不是路径写反了，能开
 
 
 
-# [2025-06-10] 永远不要使用等待加载"networkidle"。
-# [2025-06-10] 原有的功能不要乱改，应该多增加代码，少去删除以前的代码，没说让你改的地方别乱改，优先处理我说的问题。
-# [2025-06-08] 代码一定是方便调试的，报错给我生成txt的log。存储信息用xlsx。log的txt和xlsx完成代码的时候要自动运行打开方便检查结果。
-# [2025-06-08] 我提供的代码不要删除我的注释
+# [2025-06-10] 永远不要使用等待加载"networkidle"。
+# [2025-06-10] 原有的功能不要乱改，应该多增加代码，少去删除以前的代码，没说让你改的地方别乱改，优先处理我说的问题。
+# [2025-06-08] 代码一定是方便调试的，报错给我生成txt的log。存储信息用xlsx。log的txt和xlsx完成代码的时候要自动运行打开方便检查结果。
+# [2025-06-08] 我提供的代码不要删除我的注释
+
+# 允许 Pillow 加载截断的图像文件，避免程序崩溃。
+# 注意：即使设置为 True，如果文件严重损坏，仍可能引发异常，被下面的try-except捕获。
+# 且UserWarning本身不会被try-except捕获，需要额外的warnings处理。
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+# 全局变量，用于在警告处理函数中访问当前处理的文件路径
+_current_processing_file = None
+# 新增：最近一次解码 UserComment 时是否换用了别的编码（比如 "utf-16-le → utf-16-be"），每个进程各自记录
+_last_encoding_repair = None
+
+# 新增：缩略图阶段的配置。默认关闭，打开后报告里每行会多一个"缩略图"列。
+ENABLE_THUMBNAILS = False
+THUMBNAIL_CACHE_DIR = "图片缩略图缓存" # 缩略图按内容哈希缓存在这个文件夹，重复生成报告时直接复用
+THUMBNAIL_SIZE = (256, 256)
+EMBED_THUMBNAILS_IN_EXCEL = False # True: 把缩略图直接嵌进xlsx；False: 只放一个指向缩略图的超链接
+
+def custom_warning_formatter(message, category, filename, lineno, file=None, line=None):
+    """
+    自定义警告格式化器，尝试获取当前处理的文件路径。
+    """
+    global _current_processing_file
+    
+    # 检查警告是否来自 PIL 的 TiffImagePlugin 并且是 Truncated File Read
+    if category is UserWarning and "Truncated File Read" in str(message) and "TiffImagePlugin.py" in filename:
+        if _current_processing_file:
+            return f"UserWarning: {message} for file: '{_current_processing_file}'\n"
+    
+    # 对于其他警告，使用默认格式
+    # 注意：这里必须调用替换之前的原始格式化器，调用 warnings.formatwarning 会调用回自己，无限递归
+    return _original_formatwarning(message, category, filename, lineno, line)
+
+# 设置自定义警告格式化器
+_original_formatwarning = warnings.formatwarning
+warnings.formatwarning = custom_warning_formatter
+
+ERROR_LOG_PATH = "image_scan_error.log" # 新增：错误日志的文件名
+
+def log_error(message):
+    """
+    记录错误信息到控制台和日志文件。
+    """
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    log_entry = f"{timestamp} - {message}\n"
+    print(message) # 在控制台打印错误信息
+    with open(ERROR_LOG_PATH, "a", encoding="utf-8") as log_file: # 新增：文件名改用常量（结束时要打开它）
+        log_file.write(log_entry)
+
+def log_warning(message):
+    """
+    新增：记录警告（比如 Pillow 的警告）。和错误写在同一个日志里，但标明是警告。
+    """
+    log_error(f"[警告] {message}")
+
+def read_raw_metadata_with_pillow(absolute_path):
+    """
+    用 Pillow 打开图片，从标准位置读取原始元数据字符串（原来写在 get_image_info 里的阶段 1）。
+    absolute_path 也可以是已经读进内存的文件对象（io.BytesIO）。
+    """
+    raw_metadata_string = ""
+    # 尝试打开图像文件。如果文件损坏或截断，Image.open()可能会引发IOError或类似的异常
+    with Image.open(absolute_path) as img:
+        # --- 阶段 1: 尝试从标准位置获取原始元数据字符串 ---
+        if "png" in img.format.lower() and "parameters" in img.info:
+            raw_metadata_string = img.info["parameters"]
+        elif "jpeg" in img.format.lower():
+            if hasattr(img, '_getexif'):
+                exif_data = img._getexif()
+                if exif_data:
+                    for tag, value in exif_data.items():
+                        if tag == 0x9286 and isinstance(value, bytes):
+                            # 新增：UserComment 按字符集标识解码，并自动判断实际编码，不再丢字
+                            # UTF-16 的字节序跟 EXIF 头（"II" 小端 / "MM" 大端）一致
+                            exif_header = img.info.get("exif", b"")[6:8]
+                            raw_metadata_string = decode_exif_user_comment(value, "little" if exif_header == b"II" else "big")
+                            break
+                        if tag in [0x9286, 0x010E]: # UserComment or ImageDescription
+                            try:
+                                # 尝试UTF-8解码，这是最常见的编码
+                                raw_metadata_string = value.decode('utf-8', errors='ignore')
+                                # 如果解码后仍然没有明显的SD参数特征，可以尝试其他编码
+                                if not re.search(r'Steps:', raw_metadata_string):
+                                    raw_metadata_string = value.decode('latin-1', errors='ignore')
+                                break # 找到就跳出
+                            except Exception:
+                                pass
+    return raw_metadata_string
+
+# ===================== 新增：JPEG APP 段扫描器 =====================
+# 不用 Pillow 的私有 _getexif()（它会把整个 EXIF 解析成字典），而是直接在文件开头的内存映射里
+# 按段走到 APP1(Exif)，只读 IFD0 的 ImageDescription 和 Exif IFD 的 UserComment，遇到 SOS（图像数据）就停。
+
+JPEG_METADATA_PREFIX_BYTES = 1024 * 1024 # 只映射文件开头这么多字节，APP 段都在图像数据前面
+EXIF_TAG_IMAGE_DESCRIPTION = 0x010E
+EXIF_TAG_EXIF_IFD_POINTER = 0x8769
+EXIF_TAG_USER_COMMENT = 0x9286
+
+def _read_tiff_ifd_tags(tiff, offset, byte_order, wanted_tags):
+    """
+    读取 TIFF 结构里一个 IFD，返回 {标签: 原始字节}（只保留 wanted_tags 里的标签）。
+    """
+    results = {}
+    if offset + 2 > len(tiff):
+        return results
+    entry_count = int.from_bytes(tiff[offset:offset + 2], byte_order)
+    type_sizes = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+    for i in range(entry_count):
+        entry = offset + 2 + i * 12
+        if entry + 12 > len(tiff):
+            break
+        tag = int.from_bytes(tiff[entry:entry + 2], byte_order)
+        if tag not in wanted_tags:
+            continue
+        value_type = int.from_bytes(tiff[entry + 2:entry + 4], byte_order)
+        count = int.from_bytes(tiff[entry + 4:entry + 8], byte_order)
+        size = type_sizes.get(value_type, 1) * count
+        if size <= 4:
+            value = tiff[entry + 8:entry + 8 + size]
+        else:
+            value_offset = int.from_bytes(tiff[entry + 8:entry + 12], byte_order)
+            value = tiff[value_offset:value_offset + size]
+        results[tag] = bytes(value)
+    return results
+
+def iter_jpeg_segments(data):
+    """
+    逐个产出 JPEG 头部的段 (标记, 段起始位置, 段结束位置)。遇到 SOS/EOI 时产出它（结束位置等于起始位置）后停止，
+    后面是图像数据，元数据不会再出现。段结构坏了或者超出了 data 的范围时抛出 ValueError。
+    """
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        raise ValueError("不是 JPEG 文件")
+    pos = 2
+    while True:
+        if pos + 4 > len(data):
+            raise ValueError("段超出了读取范围")
+        if data[pos] != 0xFF:
+            raise ValueError("段结构损坏")
+        marker = data[pos + 1]
+        if marker == 0xFF: # 填充字节
+            pos += 1
+            continue
+        if marker in (0xD9, 0xDA): # EOI / SOS
+            yield marker, pos, pos
+            return
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7: # 没有长度字段的独立标记
+            yield marker, pos, pos + 2
+            pos += 2
+            continue
+        length = int.from_bytes(data[pos + 2:pos + 4], "big")
+        segment_end = pos + 2 + length
+        if segment_end > len(data):
+            raise ValueError("段超出了读取范围")
+        yield marker, pos, segment_end
+        pos = segment_end
+
+def read_exif_tiff_fields(tiff):
+    """
+    从 APP1 段里 "Exif\0\0" 后面的 TIFF 结构中读出 ImageDescription 和 UserComment。
+    返回 (字段字典, TIFF字节序)。
+    """
+    if len(tiff) < 8:
+        return {}, "big"
+    byte_order = "little" if tiff[:2] == b"II" else "big"
+    ifd0_offset = int.from_bytes(tiff[4:8], byte_order)
+    fields = _read_tiff_ifd_tags(tiff, ifd0_offset, byte_order,
+                                 {EXIF_TAG_IMAGE_DESCRIPTION, EXIF_TAG_EXIF_IFD_POINTER})
+    exif_pointer = fields.pop(EXIF_TAG_EXIF_IFD_POINTER, None)
+    if exif_pointer is not None and len(exif_pointer) == 4:
+        exif_offset = int.from_bytes(exif_pointer, byte_order)
+        fields.update(_read_tiff_ifd_tags(tiff, exif_offset, byte_order, {EXIF_TAG_USER_COMMENT}))
+    return fields, byte_order
+
+def find_jpeg_exif_fields(data):
+    """
+    在 JPEG 字节（可以是 mmap）里找 APP1 Exif 段，返回 (字段字典, TIFF字节序)。
+    字段字典形如 {0x010E: b'...', 0x9286: b'...'}。
+    不是 JPEG 或者段结构超出了 data 的范围时返回 None。
+    """
+    try:
+        for marker, segment_start, segment_end in iter_jpeg_segments(data):
+            if marker == 0xE1 and data[segment_start + 4:segment_start + 10] == b"Exif\x00\x00":
+                return read_exif_tiff_fields(data[segment_start + 10:segment_end])
+    except ValueError:
+        return None
+    return {}, "big"
+
+def _utf16_byte_order(payload, default_byte_order):
+    """
+    UTF-16 文本的字节序：有 BOM 用 BOM，否则用 TIFF 头的字节序（EXIF 规范就是这么规定的）。
+    不按零字节的位置猜：中日韩文字的 UTF-16 里基本没有零字节，猜出来的常常是反的。
+    """
+    if payload[:2] == b"\xfe\xff":
+        return "utf-16-be", payload[2:]
+    if payload[:2] == b"\xff\xfe":
+        return "utf-16-le", payload[2:]
+    return ("utf-16-le" if default_byte_order == "little" else "utf-16-be"), payload
+
+def _decode_user_comment_as_declared(value, byte_order):
+    """
+    按 EXIF 规范解码 UserComment：前 8 个字节是字符集标识（ASCII / UNICODE / JIS / 全 0 表示未定义）。
+    返回 (使用的编码, 文本, 有效内容的字节)。
+    """
+    header, payload = value[:8], value[8:]
+    if header == b"UNICODE\x00":
+        encoding, payload = _utf16_byte_order(payload, byte_order)
+        payload = payload[:len(payload) // 2 * 2]
+        return encoding, payload.decode(encoding, errors="replace").rstrip("\x00"), payload
+    if header == b"JIS\x00\x00\x00\x00\x00":
+        for encoding in ("iso2022_jp", "shift_jis"):
+            try:
+                return encoding, payload.decode(encoding).rstrip("\x00"), payload
+            except UnicodeDecodeError:
+                pass
+        return "shift_jis", payload.decode("shift_jis", errors="replace").rstrip("\x00"), payload
+    if header not in (b"ASCII\x00\x00\x00", b"\x00" * 8):
+        payload = value # 没有字符集标识的写法，整段都是内容
+    try:
+        return "utf-8", payload.decode("utf-8").rstrip("\x00"), payload
+    except UnicodeDecodeError:
+        return "latin-1", payload.decode("latin-1").rstrip("\x00"), payload
+
+# 解码结果打分用的字符分类：提示词大部分是 ASCII，其次是中日韩文字；
+# 控制字符、替换符、私用区字符基本说明解码错了，Latin-1 补充区的字符多半是 UTF-8 被当成 Latin-1 的乱码
+_decoded_bad_chars = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f\ufffd\ue000-\uf8ff\ud800-\udfff]')
+_decoded_mojibake_chars = re.compile(r'[\x80-\xff]')
+_decoded_ascii_chars = re.compile(r'[\t\n\r\x20-\x7e]')
+_decoded_cjk_chars = re.compile(r'[\u3000-\u30ff\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+USER_COMMENT_CANDIDATE_ENCODINGS = ("utf-8", "utf-16-le", "utf-16-be", "gb18030", "shift_jis", "big5")
+ENCODING_SCORE_SAMPLE_CHARS = 4096 # 打分时只看前面这么多字
+
+def score_decoded_text(text):
+    """
+    给一种解码结果打分，越高越像正常的提示词。能找到 SD 参数（Steps: 20, Sampler: ...）的额外加分。
+    """
+    sample = text[:ENCODING_SCORE_SAMPLE_CHARS]
+    if not sample.strip():
+        return float("-inf")
+    score = (len(_decoded_ascii_chars.findall(sample))
+             + 0.6 * len(_decoded_cjk_chars.findall(sample))
+             - 0.5 * len(_decoded_mojibake_chars.findall(sample))
+             - 5 * len(_decoded_bad_chars.findall(sample))) / len(sample)
+    if sd_validation_pattern.search(text):
+        score += 1
+    return score
+
+def _iter_user_comment_candidates(payload, declared_text):
+    for encoding in USER_COMMENT_CANDIDATE_ENCODINGS:
+        data = payload
+        if encoding.startswith("utf-16"):
+            data = data[:len(data) // 2 * 2]
+        try:
+            yield encoding, data.decode(encoding).rstrip("\x00")
+        except UnicodeDecodeError:
+            continue
+    # UTF-8 被当成 Latin-1/cp1252 解码后又存了一遍的乱码（"æ¼¢å­—"），还原回去
+    if _decoded_mojibake_chars.search(declared_text):
+        for wrong_encoding in ("latin-1", "cp1252"):
+            try:
+                yield f"utf-8(修复{wrong_encoding}乱码)", declared_text.encode(wrong_encoding).decode("utf-8")
+            except (UnicodeEncodeError, UnicodeDecodeError):
+                continue
+
+def decode_exif_user_comment(value, byte_order="big"):
+    """
+    解码 UserComment。先按字符集标识解码；结果干净（没有乱码字符，并且能找到 SD 参数或者全是 ASCII）时直接返回，
+    这是绝大多数文件走的路径。否则把几种候选编码都试一遍，按 score_decoded_text 选最像的一种，
+    换了编码时记在 _last_encoding_repair 里，报告里会标出这个文件被修复过。
+    字符集标识是 UNICODE 时相信 UTF-16，只有解出替换符或控制字符时才去试别的编码。
+    """
+    global _last_encoding_repair
+    _last_encoding_repair = None
+    declared_encoding, declared_text, payload = _decode_user_comment_as_declared(value, byte_order)
+    if value[:8] == b"UNICODE\x00" and not _decoded_bad_chars.search(declared_text):
+        # 字节序写反的文件：按另一种字节序能解出 SD 参数、按声明的解不出时才换（反过来的中文不会碰巧出现 "Steps: 20"）
+        if not sd_validation_pattern.search(declared_text):
+            swapped_encoding = "utf-16-be" if declared_encoding == "utf-16-le" else "utf-16-le"
+            swapped_text = payload.decode(swapped_encoding, errors="replace").rstrip("\x00")
+            if sd_validation_pattern.search(swapped_text) and not _decoded_bad_chars.search(swapped_text):
+                _last_encoding_repair = f"{declared_encoding} → {swapped_encoding}"
+                return swapped_text
+        return declared_text
+    if not _decoded_bad_chars.search(declared_text) and not _decoded_mojibake_chars.search(declared_text) \
+            and (declared_text.isascii() or sd_validation_pattern.search(declared_text)):
+        return declared_text
+
+    best_encoding, best_text = declared_encoding, declared_text
+    best_score = score_decoded_text(declared_text)
+    for encoding, text in _iter_user_comment_candidates(payload, declared_text):
+        score = score_decoded_text(text)
+        if score > best_score + 0.05: # 分数差不多时相信字符集标识
+            best_encoding, best_text, best_score = encoding, text, score
+    if best_encoding != declared_encoding:
+        _last_encoding_repair = f"{declared_encoding} → {best_encoding}"
+    return best_text
+
+def read_jpeg_exif_comment(file_path, prefix_bytes=JPEG_METADATA_PREFIX_BYTES):
+    """
+    直接扫描 JPEG 的 APP 段读取生成信息，优先 UserComment，其次 ImageDescription。
+    返回字符串（没有找到时是空字符串）；文件不是规范的 JPEG 或者扫描不了时返回 None，交给 Pillow 处理。
+    """
+    with open(file_path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size < 4:
+            return None
+        with mmap.mmap(f.fileno(), min(file_size, prefix_bytes), access=mmap.ACCESS_READ) as data:
+            found = find_jpeg_exif_fields(data)
+    return _jpeg_comment_from_fields(found)
+
+def read_jpeg_exif_comment_from_bytes(data):
+    """
+    和 read_jpeg_exif_comment 一样，但输入是已经读进内存的文件内容。
+    """
+    return _jpeg_comment_from_fields(find_jpeg_exif_fields(data))
+
+def _jpeg_comment_from_fields(found):
+    """
+    从 find_jpeg_exif_fields 的结果里取出生成信息字符串。
+    """
+    if found is None:
+        return None
+    fields, byte_order = found
+    user_comment = fields.get(EXIF_TAG_USER_COMMENT)
+    if user_comment:
+        text = decode_exif_user_comment(user_comment, byte_order)
+        if text.strip():
+            return text
+    description = fields.get(EXIF_TAG_IMAGE_DESCRIPTION)
+    if description:
+        description = description.rstrip(b"\x00")
+        try:
+            return description.decode("utf-8")
+        except UnicodeDecodeError:
+            return description.decode("latin-1")
+    return ""
+
+# ===================== 新增：PNG 块解析 =====================
+# 按块（chunk）遍历 PNG，读取 tEXt / zTXt / iTXt 文本块。批量改写工具和动图解析都用它。
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_TEXT_CHUNK_TYPES = (b"tEXt", b"zTXt", b"iTXt")
+
+def iter_png_chunks(data):
+    """
+    逐个产出 PNG 块 (块类型, 块起始位置, 数据起始位置, 数据长度)，产出 IEND 后停止。
+    不是 PNG、块结构超出 data 的范围或者没有 IEND 时抛出 ValueError（调用方可以在这之前停止遍历）。
+    """
+    if bytes(data[:8]) != PNG_SIGNATURE:
+        raise ValueError("不是 PNG 文件")
+    pos = 8
+    while pos + 8 <= len(data):
+        length = int.from_bytes(data[pos:pos + 4], "big")
+        chunk_type = bytes(data[pos + 4:pos + 8])
+        if pos + 12 + length > len(data):
+            raise ValueError(f"{chunk_type!r} 块超出了读取范围")
+        yield chunk_type, pos, pos + 8, length
+        if chunk_type == b"IEND":
+            return
+        pos += 12 + length
+    raise ValueError("缺少 IEND 块")
+
+def decode_png_text_chunk(chunk_type, payload):
+    """
+    解码 PNG 文本块，返回 (关键字, 文本)。
+    """
+    payload = bytes(payload)
+    keyword, _, rest = payload.partition(b"\x00")
+    keyword = keyword.decode("latin-1")
+    if chunk_type == b"tEXt":
+        return keyword, rest.decode("latin-1")
+    if chunk_type == b"zTXt":
+        return keyword, zlib.decompress(rest[1:]).decode("latin-1")
+    if chunk_type == b"iTXt":
+        compressed, rest = rest[0], rest[2:]
+        _, _, rest = rest.partition(b"\x00") # 语言标签
+        _, _, text = rest.partition(b"\x00") # 翻译后的关键字
+        if compressed:
+            text = zlib.decompress(text)
+        return keyword, text.decode("utf-8", errors="replace")
+    raise ValueError(f"不是文本块: {chunk_type!r}")
+
+# ===================== 新增：动图和视频的元数据（GIF / APNG / MP4 / WebM） =====================
+# AnimateDiff、SVD 之类的输出：GIF 写在注释扩展块里，APNG 和普通 PNG 一样写在 fcTL/IDAT 前面的文本块里，
+# MP4/MOV 写在 moov/udta/meta 里（ffmpeg 的 -metadata comment=...），WebM/MKV 写在 Tags 元素里。
+# 都是按容器结构跳着读：GIF 只读每个数据子块的长度字节，MP4 直接跳过 mdat 和 trak，
+# WebM 遇到 Cluster 就按 SeekHead 跳到 Tags。不解码任何一帧，几百 MB 的视频也只会读到几个内存页。
+
+VIDEO_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.webm', '.mkv')
+ANIMATION_TEXT_KEYS = ("parameters", "comment", "description", "prompt") # 找不到 SD 参数时按这个顺序取
+MP4_MAX_TEXT_BYTES = 16 * 1024 * 1024 # 单个元数据项最多读这么多（ComfyUI 的工作流 json 也远小于这个）
+MP4_ITEM_NAMES = {b"\xa9cmt": "comment", b"\xa9des": "description", b"desc": "description", b"ldes": "description",
+                  b"\xa9nam": "title", b"\xa9too": "encoder"}
+
+def pick_generation_text(texts):
+    """
+    texts 是 [(名称, 文本)]。优先返回含有 SD 参数的文本，其次按 ANIMATION_TEXT_KEYS 的顺序，都没有时返回空字符串。
+    """
+    for _, text in texts:
+        if "Steps:" in text:
+            return text
+    by_name = {}
+    for name, text in texts:
+        by_name.setdefault(name.lower(), text)
+    for key in ANIMATION_TEXT_KEYS:
+        if by_name.get(key):
+            return by_name[key]
+    return ""
+
+def _decode_metadata_bytes(value):
+    try:
+        return bytes(value).decode("utf-8")
+    except UnicodeDecodeError:
+        return bytes(value).decode("latin-1")
+
+def read_gif_comments(data):
+    """
+    遍历 GIF 的块结构，返回所有注释扩展块（0x21 0xFE）的 [("comment", 文本)]。
+    图像数据只按子块长度跳过，不解 LZW；文件被截断时返回截断前找到的注释。
+    """
+    if bytes(data[:6]) not in (b"GIF87a", b"GIF89a"):
+        raise ValueError("不是 GIF 文件")
+    size = len(data)
+
+    def skip_sub_blocks(pos, keep):
+        parts = []
+        while pos < size:
+            block_size = data[pos]
+            pos += 1
+            if block_size == 0:
+                return parts, pos
+            if keep:
+                parts.append(bytes(data[pos:pos + block_size]))
+            pos += block_size
+        raise ValueError("GIF 数据子块被截断")
+
+    comments = []
+    pos = 13
+    if size > 10 and data[10] & 0x80: # 全局颜色表
+        pos += 3 * (2 << (data[10] & 0x07))
+    try:
+        while pos < size:
+            block = data[pos]
+            if block == 0x3B: # 结束符
+                break
+            if block == 0x21: # 扩展块
+                label = data[pos + 1]
+                parts, pos = skip_sub_blocks(pos + 2, keep=label == 0xFE)
+                if label == 0xFE:
+                    comments.append(("comment", _decode_metadata_bytes(b"".join(parts))))
+            elif block == 0x2C: # 图像描述符，后面是局部颜色表和 LZW 数据
+                flags = data[pos + 9]
+                pos += 10
+                if flags & 0x80:
+                    pos += 3 * (2 << (flags & 0x07))
+                _, pos = skip_sub_blocks(pos + 1, keep=False)
+            else:
+                raise ValueError(f"GIF 里出现了未知的块类型 0x{block:02X}")
+    except (ValueError, IndexError):
+        if not comments:
+            raise
+    return comments
+
+def read_png_texts_before_image_data(data):
+    """
+    返回 PNG/APNG 在第一个 IDAT/fcTL 之前的所有文本块 [(关键字, 文本)]，图像数据一个字节也不读。
+    """
+    texts = []
+    try:
+        for chunk_type, _, data_start, length in iter_png_chunks(data):
+            if chunk_type in (b"IDAT", b"fcTL", b"fdAT"):
+                break
+            if chunk_type in PNG_TEXT_CHUNK_TYPES:
+                texts.append(decode_png_text_chunk(chunk_type, data[data_start:data_start + length]))
+    except ValueError:
+        if not texts:
+            raise
+    return texts
+
+def _iter_mp4_boxes(data, start, end):
+    """
+    逐个产出 MP4/MOV 的 box (类型, 内容起始位置, 结束位置)。只读 8 或 16 字节的头，内容直接跳过。
+    """
+    pos = start
+    while pos + 8 <= end:
+        size = int.from_bytes(data[pos:pos + 4], "big")
+        box_type = bytes(data[pos + 4:pos + 8])
+        header_size = 8
+        if size == 1: # 64 位长度
+            size = int.from_bytes(data[pos + 8:pos + 16], "big")
+            header_size = 16
+        elif size == 0: # 一直到文件结尾
+            size = end - pos
+        if size < header_size:
+            raise ValueError(f"MP4 box {box_type!r} 的长度不对")
+        yield box_type, pos + header_size, min(pos + size, end)
+        pos += size
+
+def _read_mp4_data_box(data, start, end):
+    """
+    解析 ilst 条目里的 data box：4 字节类型（1 是 UTF-8，2 是 UTF-16）+ 4 字节区域设置 + 内容。
+    """
+    value_type = int.from_bytes(data[start:start + 4], "big") & 0xFFFFFF
+    value = bytes(data[start + 8:min(end, start + 8 + MP4_MAX_TEXT_BYTES)])
+    if value_type == 1:
+        return value.decode("utf-8", errors="replace")
+    if value_type == 2:
+        return value.decode("utf-16-be", errors="replace")
+    return None
+
+def _collect_mp4_meta_texts(data, start, end, texts):
+    keys = []
+    for box_type, box_start, box_end in _iter_mp4_boxes(data, start, end):
+        if box_type == b"keys": # QuickTime 的 mdta 写法：ilst 里的条目用 keys 里的序号（从 1 开始）表示名称
+            count = int.from_bytes(data[box_start + 4:box_start + 8], "big")
+            pos = box_start + 8
+            for _ in range(count):
+                key_size = int.from_bytes(data[pos:pos + 4], "big")
+                if key_size < 8 or pos + key_size > box_end:
+                    break
+                keys.append(_decode_metadata_bytes(data[pos + 8:pos + key_size]))
+                pos += key_size
+        elif box_type == b"ilst":
+            for item_type, item_start, item_end in _iter_mp4_boxes(data, box_start, box_end):
+                key_index = int.from_bytes(item_type, "big")
+                if keys and 1 <= key_index <= len(keys):
+                    name = keys[key_index - 1].rpartition(".")[2] # com.apple.quicktime.comment -> comment
+                else:
+                    name = MP4_ITEM_NAMES.get(item_type, item_type.decode("latin-1"))
+                value = None
+                for child_type, child_start, child_end in _iter_mp4_boxes(data, item_start, item_end):
+                    if child_type == b"name": # "----" 自定义条目的名称（full box，跳过 4 字节版本和标志）
+                        name = _decode_metadata_bytes(data[child_start + 4:child_end])
+                    elif child_type == b"data":
+                        value = _read_mp4_data_box(data, child_start, child_end)
+                if value:
+                    texts.append((name, value))
+
+def _collect_mp4_texts(data, start, end, texts):
+    for box_type, box_start, box_end in _iter_mp4_boxes(data, start, end):
+        if box_type == b"udta":
+            _collect_mp4_texts(data, box_start, box_end, texts)
+        elif box_type == b"meta":
+            # ISO 的 meta 是 full box（前面有 4 字节版本和标志），QuickTime 的没有
+            if bytes(data[box_start + 4:box_start + 8]) not in (b"hdlr", b"keys", b"ilst"):
+                box_start += 4
+            _collect_mp4_meta_texts(data, box_start, box_end, texts)
+        elif box_type[:1] == b"\xa9" and box_end - box_start > 4: # QuickTime 直接放在 udta 里的文字：2 字节长度 + 2 字节语言 + 内容
+            if bytes(data[box_start + 4:box_start + 8]) == b"data":
+                value = _read_mp4_data_box(data, box_start + 8, box_end)
+            else:
+                length = int.from_bytes(data[box_start:box_start + 2], "big")
+                value = _decode_metadata_bytes(data[box_start + 4:min(box_end, box_start + 4 + length)])
+            if value:
+                texts.append((MP4_ITEM_NAMES.get(box_type, box_type.decode("latin-1")), value))
+        # trak、mdat 之类的直接跳过
+
+def read_mp4_metadata_texts(data):
+    """
+    返回 MP4/MOV 里 moov/udta、moov/meta 中的文字元数据 [(名称, 文本)]。
+    """
+    if bytes(data[4:8]) != b"ftyp":
+        raise ValueError("不是 MP4/MOV 文件")
+    texts = []
+    for box_type, box_start, box_end in _iter_mp4_boxes(data, 0, len(data)):
+        if box_type == b"moov":
+            _collect_mp4_texts(data, box_start, box_end, texts)
+    return texts
+
+EBML_HEADER_ID = 0x1A45DFA3
+MATROSKA_SEGMENT_ID = 0x18538067
+MATROSKA_SEEK_HEAD_ID = 0x114D9B74
+MATROSKA_SEEK_ID = 0x4DBB
+MATROSKA_SEEK_ID_ID = 0x53AB
+MATROSKA_SEEK_POSITION_ID = 0x53AC
+MATROSKA_TAGS_ID = 0x1254C367
+MATROSKA_TAG_ID = 0x7373
+MATROSKA_SIMPLE_TAG_ID = 0x67C8
+MATROSKA_TAG_NAME_ID = 0x45A3
+MATROSKA_TAG_STRING_ID = 0x4487
+MATROSKA_CLUSTER_ID = 0x1F43B675
+
+def _read_ebml_element_header(data, pos):
+    """
+    读 EBML 元素头，返回 (元素ID, 内容起始位置, 内容长度)。长度未知（直播流写法）时长度为 None。
+    """
+    first = data[pos]
+    id_length = next((i + 1 for i in range(4) if first & (0x80 >> i)), None)
+    if id_length is None:
+        raise ValueError("EBML 元素 ID 不对")
+    element_id = int.from_bytes(data[pos:pos + id_length], "big")
+    pos += id_length
+    first = data[pos]
+    size_length = next((i + 1 for i in range(8) if first & (0x80 >> i)), None)
+    if size_length is None:
+        raise ValueError("EBML 长度字段不对")
+    size = first & (0xFF >> size_length)
+    for byte in bytes(data[pos + 1:pos + size_length]):
+        size = (size << 8) | byte
+    if size == (1 << (7 * size_length)) - 1:
+        size = None
+    return element_id, pos + size_length, size
+
+def _iter_ebml_elements(data, start, end):
+    pos = start
+    while pos < end:
+        element_id, content_start, size = _read_ebml_element_header(data, pos)
+        content_end = end if size is None else min(content_start + size, end)
+        yield element_id, content_start, content_end, size is None
+        if size is None:
+            return
+        pos = content_end
+
+def _collect_matroska_simple_tags(data, start, end, texts):
+    name, value = None, None
+    for element_id, content_start, content_end, _ in _iter_ebml_elements(data, start, end):
+        if element_id == MATROSKA_TAG_NAME_ID:
+            name = _decode_metadata_bytes(data[content_start:content_end])
+        elif element_id == MATROSKA_TAG_STRING_ID:
+            value = _decode_metadata_bytes(data[content_start:content_end]).rstrip("\x00")
+        elif element_id == MATROSKA_SIMPLE_TAG_ID: # SimpleTag 可以嵌套
+            _collect_matroska_simple_tags(data, content_start, content_end, texts)
+    if name and value:
+        texts.append((name, value))
+
+def _collect_matroska_tags(data, start, end, texts):
+    for element_id, content_start, content_end, _ in _iter_ebml_elements(data, start, end):
+        if element_id != MATROSKA_TAG_ID:
+            continue
+        for child_id, child_start, child_end, _ in _iter_ebml_elements(data, content_start, content_end):
+            if child_id == MATROSKA_SIMPLE_TAG_ID:
+                _collect_matroska_simple_tags(data, child_start, child_end, texts)
+
+def read_matroska_tags(data):
+    """
+    返回 WebM/MKV 的 Tags 里的 [(TagName, TagString)]。Cluster（画面数据）之前的元素按顺序读，
+    Tags 在 Cluster 后面时按 SeekHead 里记录的位置直接跳过去。
+    """
+    element_id, content_start, size = _read_ebml_element_header(data, 0)
+    if element_id != EBML_HEADER_ID:
+        raise ValueError("不是 WebM/MKV 文件")
+    element_id, segment_start, segment_size = _read_ebml_element_header(data, content_start + size)
+    if element_id != MATROSKA_SEGMENT_ID:
+        raise ValueError("WebM/MKV 缺少 Segment")
+    segment_end = len(data) if segment_size is None else min(segment_start + segment_size, len(data))
+
+    texts = []
+    tags_positions = []
+    found_tags = False
+    for element_id, content_start, content_end, _ in _iter_ebml_elements(data, segment_start, segment_end):
+        if element_id == MATROSKA_SEEK_HEAD_ID:
+            for seek_id, seek_start, seek_end, _ in _iter_ebml_elements(data, content_start, content_end):
+                if seek_id != MATROSKA_SEEK_ID:
+                    continue
+                target_id = target_position = None
+                for child_id, child_start, child_end, _ in _iter_ebml_elements(data, seek_start, seek_end):
+                    if child_id == MATROSKA_SEEK_ID_ID:
+                        target_id = int.from_bytes(data[child_start:child_end], "big")
+                    elif child_id == MATROSKA_SEEK_POSITION_ID:
+                        target_position = int.from_bytes(data[child_start:child_end], "big")
+                if target_id == MATROSKA_TAGS_ID and target_position is not None:
+                    tags_positions.append(segment_start + target_position)
+        elif element_id == MATROSKA_TAGS_ID:
+            _collect_matroska_tags(data, content_start, content_end, texts)
+            found_tags = True
+        elif element_id == MATROSKA_CLUSTER_ID:
+            break # 后面都是画面数据
+    if not found_tags:
+        for position in tags_positions:
+            if position >= segment_end:
+                continue
+            element_id, content_start, size = _read_ebml_element_header(data, position)
+            if element_id == MATROSKA_TAGS_ID:
+                content_end = segment_end if size is None else min(content_start + size, segment_end)
+                _collect_matroska_tags(data, content_start, content_end, texts)
+    return texts
+
+def read_animation_metadata(absolute_path, data=None):
+    """
+    GIF / APNG / 视频文件的生成信息。返回字符串（没有找到时是空字符串）；
+    不是这几种格式、或者结构解析不了时返回 None，交给 Pillow 处理。
+    data 为 None 时用内存映射打开文件，只有真正读到的位置才会从磁盘读取。
+    """
+    lower_path = absolute_path.lower()
+    if lower_path.endswith('.gif'):
+        reader = read_gif_comments
+    elif lower_path.endswith('.apng'):
+        reader = read_png_texts_before_image_data
+    elif lower_path.endswith(('.mp4', '.m4v', '.mov')):
+        reader = read_mp4_metadata_texts
+    elif lower_path.endswith(('.webm', '.mkv')):
+        reader = read_matroska_tags
+    else:
+        return None
+    try:
+        if data is not None:
+            return pick_generation_text(reader(data))
+        with open(absolute_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < 8:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return pick_generation_text(reader(mapped))
+    except (ValueError, IndexError):
+        return None
+
+# 定义一个更通用的正则表达式，用于从原始文本中捕获 Stable Diffusion 的信息块
+# 它会从常见的提示词或Negative prompt开始匹配，直到最后一个参数Version结束
+sd_full_info_pattern = re.compile(
+    r'.*?(?:masterpiece|score_\d|1girl|BREAK|Negative prompt:|Steps:).*?(?:Version:.*?|Module:.*?|)$',
+    re.DOTALL # 允许.匹配换行符
+)
+# 定义一个更严格的正则，用于最终验证是否是有效的SD参数
+sd_validation_pattern = re.compile(r'Steps: \d+, Sampler: [\w\s]+', re.DOTALL)
+
+image_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+image_extensions = image_extensions + ('.apng',) + VIDEO_EXTENSIONS # 新增：APNG 和 AnimateDiff/SVD 输出的视频
+
+def parse_sd_info(raw_metadata_string):
+    """
+    阶段 2 和阶段 3：清理原始元数据字符串，提取有效的SD信息并切割成正面/负面提示词和其他设置。
+    返回一个字典，键和报告里的列名一致。
+    """
+    sd_info = "没有扫描到生成信息" # 默认值
+    sd_info_no_newlines = "没有扫描到生成信息" # 新增：没有换行符的生成信息
+    positive_prompt = ""
+    negative_prompt = ""
+    other_settings = ""
+    positive_prompt_word_count = 0 # 新增：正面提示词字数
+
+    # --- 阶段 2: 清理并使用更强大的正则表达式提取有效信息 ---
+    if isinstance(raw_metadata_string, str) and raw_metadata_string:
+        # 移除 Excel 不支持的非法 XML 字符
+        cleaned_string = ILLEGAL_CHARACTERS_RE.sub(r'', raw_metadata_string)
+        
+        # Clean up the "UNICODE" prefix
+        if cleaned_string.startswith("UNICODE"):
+            cleaned_string = cleaned_string[len("UNICODE"):].lstrip() # Remove "UNICODE" and any leading whitespace
+        
+        # 尝试使用新的正则表达式捕获核心SD信息块
+        match = sd_full_info_pattern.search(cleaned_string)
+        
+        if match:
+            extracted_text = match.group(0).strip() # 获取匹配到的整个SD信息块
+            # 再次使用更严格的正则验证，确保提取的是有效的SD参数
+            if sd_validation_pattern.search(extracted_text):
+                sd_info = extracted_text
+                # 新增：生成没有换行符的生成信息
+                sd_info_no_newlines = sd_info.replace('\n', ' ').replace('\r', ' ').strip()
+                
+                # --- 阶段 3: 切割信息 (现在从 sd_info_no_newlines 切割) ---
+                # 从后往前切割
+                other_settings_match = re.search(r'(Steps:.*)', sd_info_no_newlines, re.DOTALL)
+                if other_settings_match:
+                    other_settings = other_settings_match.group(1).strip()
+                    temp_sd_info = sd_info_no_newlines[:other_settings_match.start()].strip()
+                else:
+                    temp_sd_info = sd_info_no_newlines.strip() # 如果没有Steps，则整个认为是正向提示词
+
+                negative_prompt_match = re.search(r'(Negative prompt:.*?)(?=\s*Steps:|$)', temp_sd_info, re.DOTALL)
+                if negative_prompt_match:
+                    negative_prompt = negative_prompt_match.group(1).replace("Negative prompt:", "").strip()
+                    positive_prompt = temp_sd_info[:negative_prompt_match.start()].strip()
+                else:
+                    positive_prompt = temp_sd_info.strip() # 如果没有Negative prompt，则整个认为是正向提示词
+                
+                # 统计正面提示词字数
+                positive_prompt_word_count = len(positive_prompt)
+
+            else:
+                # 即使匹配到了，但最终验证不通过，也认为没有扫描到
+                sd_info = "没有扫描到生成信息"
+                sd_info_no_newlines = "没有扫描到生成信息"
+        else:
+            # 如果通用模式都无法匹配到，那就不包含SD信息
+            sd_info = "没有扫描到生成信息"
+            sd_info_no_newlines = "没有扫描到生成信息"
+
+    return {
+        "stable diffusion的 ai图片的生成信息": sd_info,
+        "去掉换行符的生成信息": sd_info_no_newlines, # 新增列
+        "正面提示词": positive_prompt,
+        "负面提示词": negative_prompt,
+        "其他设置": other_settings,
+        "正面提示词字数": positive_prompt_word_count # 新增列
+    }
+
+def read_raw_metadata_string(absolute_path, data=None):
+    """
+    阶段 1：读取原始元数据字符串。data 是已经读进内存的文件内容（可以只是开头一部分），
+    传了 data 就不再访问磁盘。
+    """
+    # 新增：JPEG 先用 APP 段扫描器直接读 UserComment/ImageDescription，不创建 Pillow 对象；
+    # 扫描器处理不了（返回None）时，再走下面原来的 Pillow 流程
+    jpeg_comment = None
+    if absolute_path.lower().endswith(('.jpg', '.jpeg')):
+        if data is not None:
+            jpeg_comment = read_jpeg_exif_comment_from_bytes(data)
+        else:
+            jpeg_comment = read_jpeg_exif_comment(absolute_path)
+    if jpeg_comment is not None:
+        return jpeg_comment
+    # 新增：GIF 注释、APNG 文本块、视频容器的元数据，按结构直接跳到元数据，不解码画面
+    animation_text = read_animation_metadata(absolute_path, data)
+    if animation_text is not None:
+        return animation_text
+    if absolute_path.lower().endswith(VIDEO_EXTENSIONS):
+        return "" # Pillow 打不开视频
+    return read_raw_metadata_with_pillow(io.BytesIO(data) if data is not None else absolute_path)
+
+# ===================== 新增：损坏文件快速检查和隔离清单 =====================
+# 只读文件头和文件尾（几十个字节）就能判断大多数截断/损坏的文件：PNG 要有 IEND，JPEG 要有 EOI，
+# RIFF(WebP) 的长度字段要和文件大小对得上。发现过的坏文件记在隔离清单里（连同当时读到的生成信息），
+# 以后只要文件大小和修改时间没变，直接跳过，不再用 Pillow 打开，也不会每次都写一遍错误日志。
+# 隔离清单默认关闭：打开后会在当前文件夹（和报告放在一起）写一个清单文件。
+
+ENABLE_QUARANTINE = False
+QUARANTINE_LIST_PATH = "损坏文件隔离清单.json"
+FILE_TRAILER_BYTES = 64
+
+def _jpeg_has_eoi_after_scan(data):
+    """
+    EOI 不在文件末尾时，看图像数据（第一个 SOS 之后）里有没有 EOI。
+    手机、修图软件常在 EOI 后面追加数据，这种文件是完整的；EXIF 缩略图里的 EOI 在 SOS 之前，不算。
+    """
+    try:
+        for marker, segment_start, _ in iter_jpeg_segments(data):
+            if marker == 0xDA:
+                return data.find(b"\xff\xd9", segment_start) >= 0
+    except ValueError:
+        return False
+    return False
+
+def validate_image_file(absolute_path, data=None):
+    """
+    检查文件头和文件尾。返回 (损坏原因, 是否还值得尝试读取元数据)，文件正常时返回 ("", True)。
+    data 是完整的文件内容时直接用它检查，否则从磁盘读开头和结尾。
+    """
+    if data is not None:
+        file_size = len(data)
+        head = bytes(data[:32])
+        tail = bytes(data[-FILE_TRAILER_BYTES:])
+    else:
+        with open(absolute_path, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            head = f.read(32)
+            f.seek(max(0, file_size - FILE_TRAILER_BYTES))
+            tail = f.read(FILE_TRAILER_BYTES)
+
+    if file_size == 0:
+        return "空文件", False
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        # IEND 块：长度 0 + "IEND" + CRC，后面允许有少量多余的字节
+        if b"IEND\xaeB`\x82" not in tail:
+            return "PNG 缺少 IEND 结束块（文件被截断）", True
+        return "", True
+    if head.startswith(b"\xff\xd8"):
+        if b"\xff\xd9" not in tail.rstrip(b"\x00"):
+            # 新增：EOI 后面可能还有追加的数据，在整个文件里找一遍（只有这种少见的文件需要）
+            if data is not None:
+                has_eoi = _jpeg_has_eoi_after_scan(data)
+            else:
+                with open(absolute_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    has_eoi = _jpeg_has_eoi_after_scan(mapped)
+            if not has_eoi:
+                return "JPEG 缺少 EOI 结束标记（文件被截断）", True
+        return "", True
+    if head.startswith(b"RIFF") and len(head) >= 12:
+        declared_size = int.from_bytes(head[4:8], "little") + 8
+        if declared_size > file_size:
+            return f"RIFF 长度字段是 {declared_size} 字节，但文件只有 {file_size} 字节（文件被截断）", head[8:12] == b"WEBP"
+        return "", True
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        if b"\x3b" not in tail.rstrip(b"\x00")[-1:]:
+            return "GIF 缺少结束符 0x3B（文件被截断）", True
+        return "", True
+    # 新增：MP4/MOV（ftyp box）和 WebM/MKV（EBML 头）
+    if head[4:8] == b"ftyp" or head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "", True
+    if head.startswith(b"BM") and len(head) >= 6:
+        declared_size = int.from_bytes(head[2:6], "little")
+        if declared_size > file_size:
+            return f"BMP 长度字段是 {declared_size} 字节，但文件只有 {file_size} 字节（文件被截断）", False
+        return "", True
+    return "无法识别的文件头", False
+
+class QuarantineList:
+    """
+    持久化的损坏文件清单：{路径: {"size", "mtime_ns", "reason", "first_seen", "fields"}}。
+    文件被修复（大小或修改时间变了）之后会自动重新检查。
+    """
+
+    def __init__(self, path=QUARANTINE_LIST_PATH):
+        self.path = path
+        self.entries = {}
+        self.changed = False
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                log_error(f"读取损坏文件隔离清单 '{path}' 失败，将重新检查所有文件: {e}")
+
+    def lookup(self, absolute_path, st):
+        """
+        文件还是当初那个坏文件时返回清单里的记录，否则返回None（文件已修复的会从清单里删掉）。
+        """
+        entry = self.entries.get(absolute_path)
+        if entry is None:
+            return None
+        if entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            return entry
+        del self.entries[absolute_path]
+        self.changed = True
+        return None
+
+    def add(self, absolute_path, st, row):
+        self.entries[absolute_path] = {
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "reason": row["损坏原因"],
+            "first_seen": row.get("首次发现时间") or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "fields": {key: value for key, value in row.items()
+                       if key not in ("所在文件夹", "图片的绝对路径", "图片超链接", "损坏原因", "首次发现时间")},
+        }
+        self.changed = True
+
+    def row_for(self, absolute_path, entry):
+        """
+        用清单里的记录直接生成报告行，不需要打开文件。
+        """
+        row = {
+            "所在文件夹": os.path.dirname(absolute_path),
+            "图片的绝对路径": absolute_path,
+            "图片超链接": f'={absolute_path}',
+        }
+        row.update(entry["fields"])
+        row["损坏原因"] = entry["reason"]
+        row["首次发现时间"] = entry["first_seen"]
+        return row
+
+    def save(self):
+        if not self.changed:
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+        self.changed = False
+
+def check_quarantine(quarantine, absolute_path):
+    """
+    扫描前先查隔离清单。返回 (文件的 stat 结果, 已知坏文件的报告行或None)。
+    """
+    if quarantine is None:
+        return None, None
+    try:
+        st = os.stat(absolute_path)
+    except OSError:
+        return None, None
+    entry = quarantine.lookup(absolute_path, st)
+    return st, (quarantine.row_for(absolute_path, entry) if entry else None)
+
+def record_quarantine(quarantine, absolute_path, st, row):
+    """
+    扫描后把新发现的坏文件记进隔离清单。
+    """
+    if quarantine is not None and st is not None and row.get("损坏原因"):
+        row["首次发现时间"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        quarantine.add(absolute_path, st, row)
+
+def extract_image_info(absolute_path, data=None, data_complete=True, raw_filter=None):
+    """
+    处理单个图片文件，返回报告里的一行。出错时记录日志并返回"没有扫描到生成信息"的行。
+    data 是已经读进内存的文件内容；data_complete 为 False 时它只是文件开头的一部分。
+    损坏的文件会在行里多一个"损坏原因"。
+    raw_filter(原始元数据字符串) 返回 False 时不再解析，直接返回 None（筛选扫描用）。
+    """
+    global _current_processing_file # 声明使用全局变量
+    global _last_encoding_repair
+
+    containing_folder_absolute_path = os.path.dirname(absolute_path)
+    raw_metadata_string = "" # 用于存储从图片中初步提取的原始字符串
+    damage_reason = ""
+    _last_encoding_repair = None
+
+    _current_processing_file = absolute_path # 在处理每个文件前更新全局变量
+
+    # 新增：警告按文件收集（不再依赖全局的 _current_processing_file），这样每条警告都知道是哪个文件产生的
+    with warnings.catch_warnings(record=True) as caught_warnings:
+        warnings.simplefilter("always")
+        try:
+            # 新增：先检查文件头和文件尾，连文件头都不对的文件不需要再交给 Pillow
+            damage_reason, worth_reading = validate_image_file(absolute_path, data if data_complete else None)
+            if worth_reading:
+                if data is not None and not data_complete:
+                    # 只读了开头：开头里没找到，或者开头在元数据中间被截断解析不了，再从磁盘读完整文件试一次。
+                    # 截断造成的错误和警告不算文件损坏
+                    try:
+                        with warnings.catch_warnings():
+                            warnings.simplefilter("ignore")
+                            raw_metadata_string = read_raw_metadata_string(absolute_path, data)
+                    except Exception:
+                        raw_metadata_string = ""
+                    if not raw_metadata_string:
+                        raw_metadata_string = read_raw_metadata_string(absolute_path)
+                else:
+                    raw_metadata_string = read_raw_metadata_string(absolute_path, data)
+            if raw_filter is not None and not raw_filter(raw_metadata_string):
+                return None
+            sd_fields = parse_sd_info(raw_metadata_string)
+        except Exception as e:
+            # 如果Image.open()或后续操作因文件损坏而失败，这里的e会包含详细错误信息
+            log_error(f"Error processing image file '{absolute_path}': {e}") # 明确指出是哪个文件出了问题
+            sd_fields = parse_sd_info("") # 发生任何错误时都重置
+            damage_reason = damage_reason or f"无法解析: {e}"
+        finally:
+            _current_processing_file = None # 处理完一个文件后重置全局变量
+
+    for caught in caught_warnings:
+        log_warning(f"{caught.category.__name__}: {caught.message} for file: '{absolute_path}'")
+        if "Truncated" in str(caught.message) and not damage_reason:
+            damage_reason = f"文件被截断: {caught.message}"
+    if damage_reason:
+        log_error(f"发现损坏文件 '{absolute_path}': {damage_reason}")
+
+    row = {
+        "所在文件夹": containing_folder_absolute_path,
+        "图片的绝对路径": absolute_path,
+        "图片超链接": f'={absolute_path}',
+    }
+    row.update(sd_fields)
+    if damage_reason:
+        row["损坏原因"] = damage_reason
+    if _last_encoding_repair:
+        row["编码修复"] = _last_encoding_repair # 新增：UserComment 换用了别的编码才解码正确
+    return row
+
+# 新增：扫描时拿到的文件大小和修改时间放在行里，后面的统计（提示词字典、文件夹汇总、快照）直接用，
+# 不再各自 stat 一遍（NAS 上每次 stat 都是一次网络往返）。以下划线开头的列不写进报告。
+ROW_FILE_SIZE = "_文件大小"
+ROW_FILE_MTIME_NS = "_修改时间ns"
+
+def attach_file_stat(row, st):
+    if row is not None and st is not None:
+        row[ROW_FILE_SIZE] = st.st_size
+        row[ROW_FILE_MTIME_NS] = st.st_mtime_ns
+    return row
+
+def row_file_stat(row):
+    """
+    返回 (文件大小, 修改时间ns)。行里没有（比如旧的快照、别的来源的行）时才 stat，失败时返回 (None, None)。
+    """
+    if row.get(ROW_FILE_SIZE) is not None and row.get(ROW_FILE_MTIME_NS) is not None:
+        return row[ROW_FILE_SIZE], row[ROW_FILE_MTIME_NS]
+    try:
+        st = os.stat(row["图片的绝对路径"])
+    except OSError:
+        return None, None
+    return st.st_size, st.st_mtime_ns
+
+def _stat_or_none(absolute_path):
+    try:
+        return os.stat(absolute_path)
+    except OSError:
+        return None # stat 失败的文件交给后面的流程记录日志
+
+def iter_image_files(folder_path):
+    """
+    按 os.walk 的顺序产出 (图片绝对路径, 所在文件夹绝对路径)。
+    """
+    for root, _, files in os.walk(folder_path):
+        for file in files:
+            if file.lower().endswith(image_extensions):
+                yield os.path.abspath(os.path.join(root, file)), os.path.abspath(root)
+
+def scan_image_file(absolute_path, quarantine=None, scan_filter=None, sidecars=None):
+    """
+    按顺序扫描时处理一个文件：查隔离清单、按筛选条件判断、解析。
+    返回 (行, stat结果)，行为 None 表示被筛选条件排除。
+    sidecars 不为 None 时（{扩展名: (文件名, 内容)}）和附带文件的信息合并。
+    """
+    if scan_filter is not None and not scan_filter.match_path(absolute_path):
+        return None, None
+    st, row = check_quarantine(quarantine, absolute_path)
+    if st is None:
+        st = _stat_or_none(absolute_path) # 每个文件只 stat 这一次，结果放进行里
+    if scan_filter is not None and not scan_filter.match_stat(absolute_path, st):
+        return None, st
+    if row is None:
+        # 有附带文件时，内嵌信息里找不到的内容可能在附带文件里，不能提前排除
+        raw_filter = scan_filter.match_raw if scan_filter is not None and not sidecars else None
+        row = extract_image_info(absolute_path, raw_filter=raw_filter)
+        if row is None:
+            return None, st
+        record_quarantine(quarantine, absolute_path, st, row)
+    attach_file_stat(row, st)
+    if sidecars is not None:
+        merge_sidecar_info(row, sidecars)
+    if scan_filter is not None and not scan_filter.match_row(row):
+        return None, st
+    return row, st
+
+# ===================== 新增：附带文件（.txt / .json / .yaml）里的生成信息 =====================
+# 很多图片的生成信息被去掉了，但旁边有同名的附带文件：训练集打标工具写的 .txt（只有标签），
+# 一些 WebUI 保存的 .json / .yaml。扫描目录时从同一份文件名列表里顺便找出附带文件（不额外 stat），
+# 每个文件夹的附带文件一起用线程池读，再和图片内嵌的信息按 SIDECAR_PRECEDENCE 的顺序合并。
+# 报告里多一列"生成信息来源"。
+# 附带文件的命名：a.png 对应 a.txt 或 a.png.txt（后者优先）。
+
+ENABLE_SIDECAR_FILES = True
+SIDECAR_EXTENSIONS = ('.txt', '.json', '.yaml', '.yml')
+# 合并的优先顺序："embedded" 是图片内嵌的信息。排在前面、并且有完整生成信息的来源优先；
+# 都没有完整生成信息时，用排在最前面的只有标签/描述的来源填"正面提示词"
+SIDECAR_PRECEDENCE = ("embedded", ".json", ".yaml", ".txt")
+SIDECAR_MAX_BYTES = 4 * 1024 * 1024
+SIDECAR_READ_THREADS = 8
+# .json / .yaml 里常见的字段名 -> A1111 格式里的名称
+SIDECAR_SETTING_KEYS = (
+    (("steps",), "Steps"),
+    (("sampler_name", "sampler"), "Sampler"),
+    (("cfg_scale", "cfg", "guidance_scale"), "CFG scale"),
+    (("seed",), "Seed"),
+    (("sd_model_name", "model", "model_name"), "Model"),
+    (("sd_model_hash", "model_hash"), "Model hash"),
+)
+
+def find_sidecar_files(file_names):
+    """
+    从同一个文件夹的文件名列表里找出附带文件，返回 {图片文件名: {扩展名: 附带文件名}}。只看文件名，不访问磁盘。
+    """
+    image_names = set()
+    images_by_stem = {}
+    for name in file_names:
+        if name.lower().endswith(image_extensions):
+            image_names.add(name)
+            images_by_stem.setdefault(os.path.splitext(name)[0], []).append(name)
+    sidecars = {}
+    for name in file_names:
+        base, extension = os.path.splitext(name)
+        extension = extension.lower()
+        if extension not in SIDECAR_EXTENSIONS:
+            continue
+        kind = ".yaml" if extension == ".yml" else extension
+        if base in image_names: # a.png.txt
+            sidecars.setdefault(base, {})[kind] = name
+        else: # a.txt
+            for image_name in images_by_stem.get(base, []):
+                sidecars.setdefault(image_name, {}).setdefault(kind, name)
+    return sidecars
+
+def read_sidecar_files(sidecar_paths):
+    """
+    读取一张图片的附带文件，{扩展名: 路径} -> {扩展名: (文件名, 内容)}。读不了的记日志后跳过。
+    """
+    texts = {}
+    for kind, sidecar_path in sidecar_paths.items():
+        try:
+            with open(sidecar_path, "rb") as f:
+                content = f.read(SIDECAR_MAX_BYTES)
+            texts[kind] = (os.path.basename(sidecar_path), content.decode("utf-8-sig", errors="replace"))
+        except OSError as e:
+            log_error(f"读取附带文件失败 '{sidecar_path}': {e}")
+    return texts
+
+def iter_image_files_with_sidecars(folder_path):
+    """
+    和 iter_image_files 的顺序一样，产出 (图片绝对路径, 所在文件夹绝对路径, 附带文件内容)。
+    每进入一个文件夹，先用线程池把这个文件夹的附带文件一起读完。
+    """
+    with ThreadPoolExecutor(max_workers=SIDECAR_READ_THREADS) as pool:
+        for root, _, files in os.walk(folder_path):
+            sidecar_names = find_sidecar_files(files)
+            root_path = os.path.abspath(root)
+            texts_by_image = {}
+            if sidecar_names:
+                images = list(sidecar_names)
+                path_maps = [{kind: os.path.join(root_path, name) for kind, name in sidecar_names[image].items()} for image in images]
+                texts_by_image = dict(zip(images, pool.map(read_sidecar_files, path_maps)))
+            for file in files:
+                if file.lower().endswith(image_extensions):
+                    yield os.path.join(root_path, file), root_path, texts_by_image.get(file, {})
+
+def iter_image_files_with_sidecar_paths(folder_path, recursive=True):
+    """
+    和 iter_image_files 的顺序一样，产出 (图片绝对路径, 所在文件夹绝对路径, {扩展名: 附带文件绝对路径})，不读附带文件。
+    ENABLE_SIDECAR_FILES 关闭时附带文件总是空字典。recursive 为 False 时只看这一个文件夹。
+    分布式扫描和查询服务用它，和单机扫描找附带文件的规则一样。
+    """
+    for root, _, files in os.walk(folder_path):
+        root_path = os.path.abspath(root)
+        sidecar_names = find_sidecar_files(files) if ENABLE_SIDECAR_FILES else {}
+        for file in files:
+            if file.lower().endswith(image_extensions):
+                yield (os.path.join(root_path, file), root_path,
+                       {kind: os.path.join(root_path, name) for kind, name in sidecar_names.get(file, {}).items()})
+        if not recursive:
+            break
+
+def _sidecar_simple_yaml(text):
+    """
+    没有安装 PyYAML 时用的简单解析：只认顶层的"键: 值"。
+    """
+    data = {}
+    for line in text.splitlines():
+        if not line.strip() or line.lstrip().startswith("#") or line[:1].isspace():
+            continue
+        key, separator, value = line.partition(":")
+        if separator:
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+                value = value[1:-1]
+            data[key.strip()] = value
+    return data
+
+def _sidecar_text_value(value, allow_numbers=False):
+    """
+    附带文件里的一个值转成文字。只认字符串和字符串列表（设置项还认数字）；
+    字典之类的结构（比如 ComfyUI 的 "prompt" 是节点图）不是提示词，返回空字符串。
+    """
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return ", ".join(item.strip() for item in value if item.strip())
+    if allow_numbers and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return ""
+
+def _parameters_from_mapping(data):
+    """
+    把 .json / .yaml 的内容拼成 A1111 格式的生成信息文本。
+    """
+    if isinstance(data, list) and data:
+        data = data[0]
+    if not isinstance(data, dict):
+        return ""
+    lowered = {str(key).lower(): value for key, value in data.items()}
+    for key in ("parameters", "infotext", "infotexts"):
+        value = lowered.get(key)
+        if isinstance(value, list) and value:
+            value = value[0]
+        if isinstance(value, str) and value.strip():
+            return value
+    if isinstance(lowered.get("info"), str): # A1111 API 的返回值：info 是一段 json 字符串
+        try:
+            nested = _parameters_from_mapping(json.loads(lowered["info"]))
+            if nested:
+                return nested
+        except ValueError:
+            pass
+    prompt = next((text for text in (_sidecar_text_value(lowered.get(key))
+                                     for key in ("prompt", "positive_prompt", "caption", "tags")) if text), "")
+    negative = next((text for text in (_sidecar_text_value(lowered.get(key))
+                                       for key in ("negative_prompt", "negative")) if text), "")
+    settings = []
+    for keys, label in SIDECAR_SETTING_KEYS:
+        value = next((text for text in (_sidecar_text_value(lowered.get(key), allow_numbers=True) for key in keys) if text), None)
+        if value is not None:
+            settings.append(f"{label}: {value}")
+    width = _sidecar_text_value(lowered.get("width"), allow_numbers=True)
+    height = _sidecar_text_value(lowered.get("height"), allow_numbers=True)
+    if width and height:
+        settings.append(f"Size: {width}x{height}")
+    text = prompt
+    if negative:
+        text += f"\nNegative prompt: {negative}"
+    if settings:
+        text += "\n" + ", ".join(settings)
+    return text
+
+def sidecar_to_parameters(kind, text):
+    """
+    把附带文件的内容转换成 A1111 格式的生成信息文本；.txt 原样返回（可能只是标签）。
+    """
+    if kind == ".json":
+        return _parameters_from_mapping(json.loads(text))
+    if kind == ".yaml":
+        return _parameters_from_mapping(yaml.safe_load(text) if yaml is not None else _sidecar_simple_yaml(text))
+    return text.strip()
+
+def merge_sidecar_info(row, sidecars, precedence=SIDECAR_PRECEDENCE):
+    """
+    按 precedence 合并图片内嵌的信息和附带文件，结果直接写进 row，并填"生成信息来源"。
+    sidecars 是 {扩展名: (文件名, 内容)}。
+    """
+    no_info = "没有扫描到生成信息"
+    caption_choice = None
+    for source in precedence:
+        if source == "embedded":
+            if row.get("stable diffusion的 ai图片的生成信息", no_info) != no_info:
+                row["生成信息来源"] = "图片内嵌"
+                return row
+            continue
+        if source not in sidecars:
+            continue
+        name, text = sidecars[source]
+        try:
+            parameters = sidecar_to_parameters(source, text)
+        except Exception as e:
+            log_error(f"解析附带文件失败 '{os.path.join(row['所在文件夹'], name)}': {e}")
+            continue
+        fields = parse_sd_info(parameters)
+        if fields["stable diffusion的 ai图片的生成信息"] != no_info:
+            row.update(fields)
+            row["生成信息来源"] = f"附带文件 {name}"
+            return row
+        if caption_choice is None and parameters.strip():
+            caption_choice = (name, parameters)
+    if caption_choice is not None:
+        # 只有标签/描述（训练集的 caption），当作正面提示词
+        name, caption = caption_choice
+        caption = caption.split("\nNegative prompt:")[0]
+        caption = ILLEGAL_CHARACTERS_RE.sub(r'', caption).replace('\n', ' ').replace('\r', ' ').strip()
+        row["正面提示词"] = caption
+        row["正面提示词字数"] = len(caption)
+        row["生成信息来源"] = f"附带文件 {name}（只有提示词）"
+        return row
+    row["生成信息来源"] = "无"
+    return row
+
+def get_image_info(folder_path, quarantine=None, on_row=None, scan_filter=None, progress=None, collect=True):
+    """
+    Scans a folder for image files, extracts their paths, parent folders (absolute path),
+    and Stable Diffusion generation information.
+    Files listed in the quarantine (a QuarantineList) are skipped without being opened.
+    on_row, if given, is called with each row as soon as it is produced (for streaming aggregation).
+    scan_filter, if given (a ScanFilter), drops non-matching files as early as possible.
+    progress, if given (a ScanProgress), is advanced once per file.
+    With collect=False the rows are only passed to on_row and an empty list is returned
+    (for archives too large to keep in memory).
+    """
+    image_data = []
+    if ENABLE_SIDECAR_FILES: # 新增：顺便找出同名的附带文件
+        files = iter_image_files_with_sidecars(folder_path)
+    else:
+        files = ((absolute_path, root, None) for absolute_path, root in iter_image_files(folder_path))
+    for absolute_path, _, sidecars in files:
+        row, st = scan_image_file(absolute_path, quarantine, scan_filter, sidecars)
+        if progress is not None:
+            progress.advance(nbytes=st.st_size if st is not None else 0, error=bool(row and row.get("损坏原因")))
+        if row is None:
+            continue
+        if on_row is not None:
+            on_row(row)
+        if collect:
+            image_data.append(row)
+    if quarantine is not None:
+        quarantine.save()
+    return image_data
+
+# ===================== 新增：筛选扫描（筛选条件尽量提前判断） =====================
+# 只想要提示词里有某个标签、或者用某个采样器/模型生成的图片时，不需要把每个文件都解析一遍：
+# 1. 路径和文件夹通配符：打开文件之前判断；
+# 2. 修改时间：只 stat 一次（和隔离清单共用），不读文件内容；
+# 3. 读到原始元数据字符串后先做子串检查，必须包含的标签/设置值不在里面就不再解析；
+# 4. 最后对解析好的行做完整判断。报告里只有符合条件的行。
+#
+# 筛选条件的写法（空格分隔，多个条件同时满足，值里有空格时用引号括起来）：
+#   tag:1girl            正面提示词里有这个标签（忽略权重和括号，下划线等同空格）
+#   -tag:lowres          正面提示词里没有这个标签
+#   text:"red eyes"      生成信息里包含这段文字；-text: 表示不包含
+#   folder:*2024-06*     所在文件夹符合通配符；-folder: 表示排除
+#   mtime>=2025-06-01    修改时间范围，也可以写 "mtime<2025-06-10 12:00"
+#   Sampler="Euler a"    其他设置里的字段比较，支持 = != > >= < <= 和 ~（包含），两边都是数字时按数字比较；
+#   "CFG scale>=7"       字段名里有空格时整个条件用引号括起来
+#   正面提示词字数>=100   报告里已有的列也可以直接比较
+
+SCAN_FILTER = "" # 为空表示不筛选，比如 'tag:1girl -tag:lowres Sampler="Euler a" Steps>=20'
+
+_filter_comparison_pattern = re.compile(r'^([^<>=!~]+?)\s*(>=|<=|!=|=|>|<|~)\s*(.*)$')
+
+def _normalize_filter_tag(tag):
+    return re.sub(r'\s+', ' ', tag.replace('_', ' ')).strip().lower()
+
+def _normalize_raw_filter_text(text):
+    """
+    提前判断用的宽松形式：去掉括号、反斜杠和 Excel 不支持的字符，下划线当空格，空白合并成一个空格，小写。
+    提示词里的 "ganyu \\(genshin impact\\)"、"(blue hair:1.2)" 和筛选条件写的 "ganyu (genshin impact)"、
+    "blue hair" 变成这种形式后仍然是包含关系，所以提前排除不会漏掉 match_row 认为符合的文件。
+    """
+    text = ILLEGAL_CHARACTERS_RE.sub('', text).replace('_', ' ')
+    text = re.sub(r'[()\[\]{}\\]', '', text)
+    return re.sub(r'\s+', ' ', text).lower()
+
+def _is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+def _compare_filter_values(actual, operator, expected):
+    if actual is None or actual == "":
+        return operator == "!="
+    actual = str(actual).strip()
+    if operator == "~":
+        return expected.lower() in actual.lower()
+    try:
+        left, right = float(actual), float(expected)
+    except ValueError:
+        left, right = actual.lower(), expected.lower()
+        if operator not in ("=", "!="):
+            return False # 文字不比较大小
+    if operator == "=":
+        return left == right
+    if operator == "!=":
+        return left != right
+    if operator == ">":
+        return left > right
+    if operator == ">=":
+        return left >= right
+    if operator == "<":
+        return left < right
+    return left <= right
+
+class ScanFilter:
+    """
+    解析好的筛选条件，按"路径 → 修改时间 → 原始字符串 → 解析后的行"的顺序逐级判断。
+    只用普通属性，可以传给自适应扫描的解析进程。
+    """
+    def __init__(self, expression=""):
+        self.expression = expression
+        self.include_tags = []
+        self.exclude_tags = []
+        self.include_text = []
+        self.exclude_text = []
+        self.include_folders = []
+        self.exclude_folders = []
+        self.mtime_ranges = [] # [(运算符, 时间戳)]
+        self.comparisons = [] # [(字段, 运算符, 值)]
+        for token in shlex.split(expression):
+            negated = token.startswith("-") and ":" in token
+            body = token[1:] if negated else token
+            prefix, _, value = body.partition(":")
+            if prefix in ("tag", "text", "folder") and value:
+                if prefix == "tag":
+                    (self.exclude_tags if negated else self.include_tags).append(_normalize_filter_tag(value))
+                elif prefix == "text":
+                    (self.exclude_text if negated else self.include_text).append(value.lower())
+                else:
+                    (self.exclude_folders if negated else self.include_folders).append(os.path.normcase(value))
+                continue
+            match = _filter_comparison_pattern.match(token)
+            if not match:
+                raise ValueError(f"无法理解的筛选条件: {token}")
+            field, operator, value = match.group(1).strip(), match.group(2), match.group(3).strip()
+            if field.lower() == "mtime":
+                if operator in ("~", "!="):
+                    raise ValueError(f"修改时间只支持大小比较: {token}")
+                self.mtime_ranges.append((operator, datetime.fromisoformat(value).timestamp()))
+            else:
+                self.comparisons.append((field, operator, value))
+        # 原始字符串里一定要出现的片段：必须有的标签、文字，以及按文字比较的设置值
+        # （数字可能写法不同，比如 7 和 7.0；报告里的列不是原文的一部分，都不提前判断）
+        report_columns = set(parse_sd_info("")) | {"所在文件夹", "图片的绝对路径", "图片超链接", "损坏原因"}
+        required = self.include_tags + self.include_text + [
+            value for field, operator, value in self.comparisons
+            if operator in ("=", "~") and value and field not in report_columns and not _is_number(value)]
+        # 和原始字符串用同一种宽松形式比较（括号、转义、权重写法不同都不影响）
+        self.required_raw_substrings = [part for part in map(_normalize_raw_filter_text, required) if part.strip()]
+
+    def __bool__(self):
+        return bool(self.expression.strip())
+
+    def match_path(self, absolute_path):
+        folder = os.path.normcase(os.path.dirname(absolute_path))
+        if self.include_folders and not any(fnmatch.fnmatchcase(folder, pattern) for pattern in self.include_folders):
+            return False
+        return not any(fnmatch.fnmatchcase(folder, pattern) for pattern in self.exclude_folders)
+
+    def match_stat(self, absolute_path, st=None):
+        """
+        st 是已经拿到的 stat 结果（比如查隔离清单时的），没有时才 stat 一次。
+        """
+        if not self.mtime_ranges:
+            return True
+        try:
+            mtime = (st or os.stat(absolute_path)).st_mtime
+        except OSError:
+            return True # stat 失败的文件交给后面的流程记录日志
+        return all(_compare_filter_values(mtime, operator, str(value)) for operator, value in self.mtime_ranges)
+
+    def match_raw(self, raw_metadata_string):
+        """
+        解析前的快速检查：只排除一定不符合的文件，不会误删符合的文件。
+        """
+        if not self.required_raw_substrings:
+            return True
+        if not raw_metadata_string:
+            return False
+        text = _normalize_raw_filter_text(raw_metadata_string)
+        return all(part in text for part in self.required_raw_substrings)
+
+    def match_row(self, row):
+        if self.include_tags or self.exclude_tags:
+            tags = set(split_prompt_tags(row.get("正面提示词", "")))
+            if any(tag not in tags for tag in self.include_tags) or any(tag in tags for tag in self.exclude_tags):
+                return False
+        if self.include_text or self.exclude_text:
+            text = str(row.get("去掉换行符的生成信息", "")).lower()
+            if any(part not in text for part in self.include_text) or any(part in text for part in self.exclude_text):
+                return False
+        if self.comparisons:
+            settings = {key.lower(): value for key, value in parse_settings(row.get("其他设置", "")).items()}
+            for field, operator, value in self.comparisons:
+                actual = row[field] if field in row else settings.get(field.lower())
+                if not _compare_filter_values(actual, operator, value):
+                    return False
+        return True
+
+# ===================== 新增：扫描进度和剩余时间 =====================
+# 扫描开始时另起一个线程只遍历目录、数图片文件（不打开文件），很快就能知道总数；
+# 扫描线程每处理完一个文件只给几个整数加一（只有扫描线程写，不需要加锁），
+# 显示线程每隔一段时间读一次这些计数，算出速度和剩余时间。
+# 在终端里运行时显示一行进度条；输出被重定向（比如计划任务写日志）时，定时输出一行json。
+# 进度都写到 stderr，不和报告、错误信息的输出混在一起。
+
+ENABLE_PROGRESS = True
+PROGRESS_REFRESH_SECONDS = 0.5 # 终端进度条的刷新间隔
+PROGRESS_JSON_INTERVAL_SECONDS = 5 # 非交互运行时每隔多少秒输出一行json
+
+def _format_duration(seconds):
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def _format_bytes(nbytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024:
+            return f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TB"
+
+class ScanProgress:
+    """
+    扫描进度。start() 开始预先统计和定时显示，扫描过程中调用 advance()，结束时调用 close()。
+    """
+    def __init__(self, folder_path, stream=None, interactive=None):
+        self.folder_path = folder_path
+        self.stream = stream or sys.stderr
+        self.interactive = self.stream.isatty() if interactive is None else interactive
+        self.interval = PROGRESS_REFRESH_SECONDS if self.interactive else PROGRESS_JSON_INTERVAL_SECONDS
+        # 扫描线程写、显示线程读的计数
+        self.files_done = 0
+        self.bytes_done = 0
+        self.errors = 0
+        # 预先统计线程写的计数
+        self.total_files = 0
+        self.total_final = False
+        self.start_time = None
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        for target in (self._count_files, self._report_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def advance(self, files=1, nbytes=0, error=False):
+        self.files_done += files
+        self.bytes_done += nbytes
+        if error:
+            self.errors += 1
+
+    def _count_files(self):
+        count = 0
+        try:
+            for _, _, files in os.walk(self.folder_path):
+                if self._stop.is_set():
+                    return
+                count += sum(1 for file in files if file.lower().endswith(image_extensions))
+                self.total_files = count
+        finally:
+            self.total_final = True
+
+    def snapshot(self):
+        """
+        当前的进度数据（显示和 json 输出共用）。
+        """
+        elapsed = max(time.perf_counter() - self.start_time, 1e-6)
+        files_done, bytes_done = self.files_done, self.bytes_done
+        total = max(self.total_files, files_done)
+        files_per_second = files_done / elapsed
+        eta = None
+        if self.total_final and files_per_second > 0:
+            eta = (total - files_done) / files_per_second
+        return {
+            "files_done": files_done,
+            "total_files": total,
+            "total_final": self.total_final,
+            "files_per_second": round(files_per_second, 1),
+            "bytes_per_second": round(bytes_done / elapsed),
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "errors": self.errors,
+            "elapsed_seconds": round(elapsed, 1),
+        }
+
+    def render(self, final=False):
+        info = self.snapshot()
+        if not self.interactive:
+            self.stream.write(json.dumps(info, ensure_ascii=False) + "\n")
+            self.stream.flush()
+            return
+        total = info["total_files"]
+        fraction = info["files_done"] / total if total else 0
+        width = 30
+        bar = "#" * int(width * fraction) + "." * (width - int(width * fraction))
+        total_text = f"{total}" if info["total_final"] else f"{total}+ 统计中"
+        line = (f"\r[{bar}] {info['files_done']}/{total_text} {fraction:.1%} "
+                f"{info['files_per_second']:.0f} 文件/秒 {_format_bytes(info['bytes_per_second'])}/秒 "
+                f"剩余 {_format_duration(info['eta_seconds'])} 错误 {info['errors']}")
+        self.stream.write(line + ("\n" if final else ""))
+        self.stream.flush()
+
+    def _report_loop(self):
+        while not self._stop.wait(self.interval):
+            self.render()
+
+    def close(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self.render(final=True)
+
+# ===================== 新增：自适应调度（读文件和解析分开，并发数自动调整） =====================
+# 读文件是 I/O（本地SSD很快，NAS很慢），解析是 CPU。读文件放在线程池，解析放在进程池，
+# 运行中统计每个文件的读取耗时和解析耗时，自动调整同时读几个文件、同时解析几个文件。
+
+SCAN_MODE = "sequential" # "sequential": 原来的逐个处理；"adaptive": 自适应并发
+ADAPTIVE_MAX_READERS = 32 # 同时读文件的线程数上限（NAS 上延迟高，需要多一些并发才能跑满带宽）
+ADAPTIVE_MAX_PARSERS = None # 解析进程数上限，None 表示 CPU 核数
+ADAPTIVE_READ_PREFIX_BYTES = 256 * 1024 # PNG/JPEG 的元数据都在图像数据前面，只读开头这么多；不够时解析进程再读完整文件
+ADAPTIVE_ADJUST_INTERVAL = 0.5 # 每隔多少秒根据统计调整一次并发数
+
+class ConcurrencyLimit:
+    """
+    爬山法调整并发上限：吞吐量变好就继续往同一个方向调，变差就掉头。
+    """
+
+    def __init__(self, initial, minimum, maximum):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.direction = 1
+        self.last_rate = None
+
+    def update(self, rate):
+        if self.last_rate is not None:
+            if rate < self.last_rate * 0.95:
+                self.direction = -self.direction # 变慢了，往回调
+            elif rate < self.last_rate * 1.05:
+                # 差不多，说明已经在平台期；偶尔往上试探一下，硬件条件变了也能跟上
+                self.direction = 1 if self.limit < self.maximum and self.direction < 0 else self.direction
+        step = max(1, self.limit // 4)
+        self.limit = max(self.minimum, min(self.maximum, self.limit + self.direction * step))
+        self.last_rate = rate
+
+def iter_image_files_by_locality(folder_path, sidecar_paths=None):
+    """
+    按目录顺序产出图片路径，同一个目录内按 inode 号排序（大多数文件系统上接近磁盘上的存放顺序），
+    同一个目录的文件连着读，机械硬盘和 NAS 的预读缓存都能用上。
+    sidecar_paths 是一个字典时，顺便把有附带文件的图片记进去：{图片路径: {扩展名: 附带文件路径}}。
+    和 os.walk 的默认行为一样，不进入指向文件夹的符号链接（否则自己指向自己的链接会无限重复）。
+    """
+    pending_dirs = [os.path.abspath(folder_path)]
+    while pending_dirs:
+        current = pending_dirs.pop(0)
+        try:
+            entries = list(os.scandir(current))
+        except OSError as e:
+            log_error(f"无法读取文件夹 '{current}': {e}")
+            continue
+        files = []
+        sub_dirs = []
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        sub_dirs.append(entry.path)
+                elif entry.name.lower().endswith(image_extensions):
+                    files.append(entry)
+            except OSError:
+                continue
+        files.sort(key=lambda entry: (entry.inode(), entry.name))
+        if sidecar_paths is not None:
+            for image_name, names in find_sidecar_files([entry.name for entry in entries]).items():
+                sidecar_paths[os.path.abspath(os.path.join(current, image_name))] = {
+                    kind: os.path.join(current, name) for kind, name in names.items()}
+        for entry in files:
+            yield os.path.abspath(entry.path)
+        pending_dirs[0:0] = sorted(sub_dirs) # 深度优先，和 os.walk 一样先处理完一棵子树
+
+def _read_image_bytes(absolute_path, prefix_bytes=ADAPTIVE_READ_PREFIX_BYTES):
+    """
+    在读文件线程中运行，返回 (数据, 是否是完整文件, 读取耗时秒数, stat结果)。
+    只有 PNG/JPEG 在这里读，而且只读开头（元数据在图像数据前面），传给解析进程的数据很小。
+    其他格式（GIF、WebP、BMP、视频）不读（数据为 None），解析进程里和逐个扫描一样直接按路径读：
+    GIF 和视频用内存映射按结构跳着读，几百MB的动图也只碰到元数据所在的位置。
+    stat 结果用打开的文件 fstat 得到，不需要再按路径查一次。
+    """
+    start = time.perf_counter()
+    if not absolute_path.lower().endswith(('.png', '.apng', '.jpg', '.jpeg')):
+        return None, True, 0.0, _stat_or_none(absolute_path)
+    with open(absolute_path, "rb") as f:
+        st = os.fstat(f.fileno())
+        data = f.read(prefix_bytes)
+        complete = len(data) < prefix_bytes or not f.read(1)
+    return data, complete, time.perf_counter() - start, st
+
+def _parse_image_worker(absolute_path, data, complete, scan_filter=None):
+    """
+    在解析进程中运行，返回 (行, 解析耗时秒数)。行为 None 表示被筛选条件排除。
+    只读了开头的文件如果没有找到生成信息，会再从磁盘读完整文件重试一次。
+    """
+    start = time.perf_counter()
+    row = extract_image_info(absolute_path, data, data_complete=complete,
+                             raw_filter=scan_filter.match_raw if scan_filter is not None else None)
+    if row is not None and scan_filter is not None and not scan_filter.match_row(row):
+        row = None
+    return row, time.perf_counter() - start
+
+def iter_image_info_adaptive(folder_path, max_readers=ADAPTIVE_MAX_READERS, max_parsers=ADAPTIVE_MAX_PARSERS,
+                             adjust_interval=ADAPTIVE_ADJUST_INTERVAL, quarantine=None, scan_filter=None, progress=None):
+    """
+    自适应并发扫描，按完成顺序产出 (序号, 行)。序号是文件在遍历顺序中的位置，方便调用方排回原来的顺序。
+    - 读文件的并发数用爬山法根据读取吞吐量调整；
+    - 解析的并发数按 Little 定律估算：需要的解析进程数 ≈ 到达速率 × 平均解析耗时；
+    - 已读完等待解析的文件数有上限，解析跟不上时自动暂停读文件，内存不会无限增长；
+    - 隔离清单里的已知坏文件直接产出记录的行，不读也不解析；
+    - 有筛选条件（scan_filter）时，路径和修改时间不符合的文件不读，原始字符串不符合的不解析，不符合的行不产出；
+    - progress（ScanProgress）在每个文件处理完时前进一格，读到的字节数在读完时累加。
+    """
+    max_parsers = max_parsers or os.cpu_count() or 1
+    reader_limit = ConcurrencyLimit(initial=min(4, max_readers), minimum=1, maximum=max_readers)
+    parser_limit = max(1, max_parsers // 2)
+    sidecar_paths = {} if ENABLE_SIDECAR_FILES else None
+    sidecar_reads = {} # 序号 -> 读附带文件的 future
+    files = enumerate(iter_image_files_by_locality(folder_path, sidecar_paths))
+    files_exhausted = False
+
+    reading = {} # future -> (序号, 路径)
+    parsing = {} # future -> 序号
+    file_stats = {} # 序号 -> 扫描前的 stat 结果，用来记录新发现的坏文件
+    ready = deque() # 读完了、等待解析的 (序号, 路径, 数据, 是否完整)
+    window_bytes = 0
+    window_reads = 0
+    window_parse_seconds = 0.0
+    window_parses = 0
+    window_start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_readers) as read_pool, ProcessPoolExecutor(max_workers=max_parsers) as parse_pool:
+        while True:
+            # 解析跟不上时，等待解析的文件不能堆太多
+            while not files_exhausted and len(reading) < reader_limit.limit and len(ready) < parser_limit * 4:
+                try:
+                    index, absolute_path = next(files)
+                except StopIteration:
+                    files_exhausted = True
+                    break
+                if scan_filter is not None and not scan_filter.match_path(absolute_path):
+                    if progress is not None:
+                        progress.advance()
+                    continue
+                st, known_bad_row = check_quarantine(quarantine, absolute_path)
+                if scan_filter is not None and not scan_filter.match_stat(absolute_path, st):
+                    if progress is not None:
+                        progress.advance()
+                    continue
+                sidecar_future = None
+                if sidecar_paths and absolute_path in sidecar_paths:
+                    sidecar_future = read_pool.submit(read_sidecar_files, sidecar_paths.pop(absolute_path))
+                if known_bad_row is not None:
+                    attach_file_stat(known_bad_row, st)
+                    if progress is not None:
+                        progress.advance(error=True)
+                    if sidecar_paths is not None:
+                        merge_sidecar_info(known_bad_row, sidecar_future.result() if sidecar_future else {})
+                    if scan_filter is None or scan_filter.match_row(known_bad_row):
+                        yield index, known_bad_row
+                    continue
+                file_stats[index] = st
+                if sidecar_future is not None:
+                    sidecar_reads[index] = sidecar_future
+                reading[read_pool.submit(_read_image_bytes, absolute_path)] = (index, absolute_path)
+
+            while ready and len(parsing) < parser_limit * 2:
+                index, absolute_path, data, complete = ready.popleft()
+                # 有附带文件的图片要合并以后才能判断筛选条件
+                worker_filter = None if index in sidecar_reads else scan_filter
+                parsing[parse_pool.submit(_parse_image_worker, absolute_path, data, complete, worker_filter)] = index
+
+            if not reading and not parsing and not ready and files_exhausted:
+                break
+
+            done, _ = wait(list(reading) + list(parsing), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in reading:
+                    index, absolute_path = reading.pop(future)
+                    try:
+                        data, complete, _, read_st = future.result()
+                        if file_stats.get(index) is None:
+                            file_stats[index] = read_st
+                        if progress is not None:
+                            progress.advance(files=0, nbytes=len(data or b""))
+                        window_bytes += len(data or b"")
+                        window_reads += 1
+                        ready.append((index, absolute_path, data, complete))
+                    except Exception as e:
+                        # 读都读不了的文件，交给原来的流程处理和记录日志
+                        log_error(f"读取文件失败 '{absolute_path}': {e}")
+                        row = extract_image_info(absolute_path)
+                        st = file_stats.pop(index, None)
+                        record_quarantine(quarantine, absolute_path, st, row)
+                        attach_file_stat(row, st)
+                        if progress is not None:
+                            progress.advance(error=True)
+                        if sidecar_paths is not None:
+                            sidecar_future = sidecar_reads.pop(index, None)
+                            merge_sidecar_info(row, sidecar_future.result() if sidecar_future else {})
+                        if scan_filter is None or scan_filter.match_row(row):
+                            yield index, row
+                else:
+                    index = parsing.pop(future)
+                    row, parse_seconds = future.result()
+                    window_parse_seconds += parse_seconds
+                    window_parses += 1
+                    st = file_stats.pop(index, None)
+                    if progress is not None:
+                        progress.advance(error=bool(row and row.get("损坏原因")))
+                    sidecar_future = sidecar_reads.pop(index, None)
+                    if row is None:
+                        continue
+                    record_quarantine(quarantine, row["图片的绝对路径"], st, row)
+                    attach_file_stat(row, st)
+                    if sidecar_paths is not None:
+                        merge_sidecar_info(row, sidecar_future.result() if sidecar_future else {})
+                        if sidecar_future is not None and scan_filter is not None and not scan_filter.match_row(row):
+                            continue
+                    yield index, row
+
+            elapsed = time.perf_counter() - window_start
+            if elapsed >= adjust_interval and window_reads:
+                reader_limit.update(window_bytes / elapsed)
+                if window_parses:
+                    arrival_rate = window_reads / elapsed
+                    average_parse_seconds = window_parse_seconds / window_parses
+                    parser_limit = max(1, min(max_parsers, math.ceil(arrival_rate * average_parse_seconds * 1.2)))
+                window_bytes = window_reads = window_parses = 0
+                window_parse_seconds = 0.0
+                window_start = time.perf_counter()
+
+def get_image_info_adaptive(folder_path, on_row=None, collect=True, **kwargs):
+    """
+    和 get_image_info 返回一样的行，但用自适应并发扫描。结果按 iter_image_files_by_locality 的遍历顺序排好：
+    文件夹的顺序和 os.walk 一样，同一个文件夹里按 inode 号排序（不是 os.walk 的文件名顺序）。
+    on_row 按完成顺序调用。collect 为 False 时不保留行，只调用 on_row。
+    """
+    indexed_rows = []
+    for index, row in iter_image_info_adaptive(folder_path, **kwargs):
+        if on_row is not None:
+            on_row(row)
+        if collect:
+            indexed_rows.append((index, row))
+    if kwargs.get("quarantine") is not None:
+        kwargs["quarantine"].save()
+    indexed_rows.sort(key=lambda item: item[0])
+    return [row for _, row in indexed_rows]
+
+# ===================== 新增：内容哈希缓存 =====================
+# 按 (路径, 文件大小, 修改时间) 记住每个文件的内容哈希，没变过的文件不需要重新读一遍。
+
+CONTENT_HASH_INDEX_FILENAME = "内容哈希索引.json"
+
+def compute_content_hash(file_path, chunk_size=1024 * 1024):
+    """
+    读取整个文件计算 sha1 内容哈希。
+    """
+    hasher = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def load_content_hash_index(cache_dir):
+    """
+    读取缓存文件夹里的内容哈希索引，不存在或损坏时返回空字典。
+    """
+    index_path = os.path.join(cache_dir, CONTENT_HASH_INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        return {}
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        log_error(f"读取内容哈希索引 '{index_path}' 失败，将重新计算: {e}")
+        return {}
+
+def save_content_hash_index(cache_dir, index):
+    """
+    先写临时文件再替换，避免中途崩溃把索引写坏。
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, CONTENT_HASH_INDEX_FILENAME)
+    temp_path = index_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(temp_path, index_path)
+
+def lookup_content_hash(index, file_path):
+    """
+    如果文件大小和修改时间都没变，直接返回索引里记下的哈希，否则返回None。
+    """
+    entry = index.get(file_path)
+    if not entry:
+        return None
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    if entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+        return entry[2]
+    return None
+
+def remember_content_hash(index, file_path, content_hash):
+    """
+    把新算出来的哈希连同当前的文件大小/修改时间写进索引。
+    """
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return
+    index[file_path] = [st.st_size, st.st_mtime_ns, content_hash]
+
+# ===================== 新增：缩略图生成 =====================
+
+def get_thumbnail_path(cache_dir, content_hash):
+    """
+    缩略图按哈希前两位分子文件夹存放，避免单个文件夹里文件过多。
+    """
+    return os.path.join(cache_dir, content_hash[:2], f"{content_hash}.jpg")
+
+def _thumbnail_worker(image_path, content_hash, cache_dir, size):
+    """
+    在子进程中运行：必要时计算内容哈希，然后生成缩略图。
+    返回 (图片路径, 内容哈希, 缩略图路径, 错误信息)。
+    """
+    try:
+        if content_hash is None:
+            content_hash = compute_content_hash(image_path)
+        thumbnail_path = get_thumbnail_path(cache_dir, content_hash)
+        if os.path.exists(thumbnail_path):
+            return image_path, content_hash, thumbnail_path, None
+
+        with Image.open(image_path) as img:
+            # draft() 让 JPEG 在解码时直接按 1/2、1/4、1/8 缩小，不需要完整解码整张大图
+            img.draft("RGB", size)
+            # reducing_gap 会先用 reduce() 做整数倍快速缩小，再做高质量缩放
+            img.thumbnail(size, reducing_gap=2.0)
+            if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+                img = img.convert("RGBA")
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.split()[-1])
+                img = background
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+
+            os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+            temp_path = f"{thumbnail_path}.{os.getpid()}.tmp"
+            img.save(temp_path, "JPEG", quality=80)
+            os.replace(temp_path, thumbnail_path)
+        return image_path, content_hash, thumbnail_path, None
+    except Exception as e:
+        return image_path, content_hash, "", str(e)
+
+def generate_thumbnails(image_data, cache_dir=THUMBNAIL_CACHE_DIR, size=THUMBNAIL_SIZE, max_workers=None):
+    """
+    为 image_data 里的每张图片生成缩略图，并把路径写到每行的"缩略图"列。
+    已经生成过的（内容哈希相同）直接复用，不会再打开原图。
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    index = load_content_hash_index(cache_dir)
+    pending = []
+
+    for row in image_data:
+        image_path = row["图片的绝对路径"]
+        if image_path.lower().endswith(VIDEO_EXTENSIONS): # 视频不生成缩略图
+            row["缩略图"] = ""
+            continue
+        content_hash = lookup_content_hash(index, image_path)
+        if content_hash is not None:
+            thumbnail_path = get_thumbnail_path(cache_dir, content_hash)
+            if os.path.exists(thumbnail_path):
+                row["缩略图"] = os.path.abspath(thumbnail_path)
+                continue
+        row["缩略图"] = ""
+        pending.append((row, content_hash))
+
+    if pending:
+        print(f"需要生成 {len(pending)} 张缩略图（其余 {len(image_data) - len(pending)} 张使用缓存）...")
+        rows_by_path = {row["图片的绝对路径"]: row for row, _ in pending}
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_thumbnail_worker, row["图片的绝对路径"], content_hash, cache_dir, size)
+                for row, content_hash in pending
+            ]
+            for future in as_completed(futures):
+                image_path, content_hash, thumbnail_path, error = future.result()
+                if content_hash:
+                    remember_content_hash(index, image_path, content_hash)
+                if error:
+                    log_error(f"生成缩略图失败 '{image_path}': {error}")
+                    continue
+                rows_by_path[image_path]["缩略图"] = os.path.abspath(thumbnail_path)
+
+    save_content_hash_index(cache_dir, index)
+    return image_data
+
+# ===================== 新增：感知哈希与相似图片分组 =====================
+# 图生图、高清修复出来的变体和原图只差一点点，内容哈希认不出来。
+# 这里对缩小的灰度图算 64 位 dHash，用 BK 树按汉明距离找相似图片，不需要两两比较。
+
+ENABLE_PERCEPTUAL_HASH = False
+PERCEPTUAL_HASH_CACHE_FILENAME = "感知哈希缓存.json" # 存在 THUMBNAIL_CACHE_DIR 里，按内容哈希复用
+PERCEPTUAL_HASH_MAX_DISTANCE = 6 # 汉明距离不超过这个值就认为是相似图片
+
+def compute_dhash(image_path, hash_size=8):
+    """
+    计算 dHash：缩成 (hash_size+1) x hash_size 的灰度图，比较相邻像素的明暗，得到一个整数。
+    """
+    with Image.open(image_path) as img:
+        # JPEG 用 draft 直接按比例解码成小图，省掉大部分解码时间
+        img.draft("L", (hash_size * 8, hash_size * 8))
+        img = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+        pixels = list(img.getdata())
+    value = 0
+    for y in range(hash_size):
+        row_start = y * (hash_size + 1)
+        for x in range(hash_size):
+            value = (value << 1) | (1 if pixels[row_start + x] > pixels[row_start + x + 1] else 0)
+    return value
+
+def _perceptual_hash_worker(image_path, content_hash):
+    """
+    在子进程中运行，返回 (图片路径, 内容哈希, 感知哈希十六进制字符串, 错误信息)。
+    """
+    try:
+        if content_hash is None:
+            content_hash = compute_content_hash(image_path)
+        return image_path, content_hash, f"{compute_dhash(image_path):016x}", None
+    except Exception as e:
+        return image_path, content_hash, "", str(e)
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+class BKTree:
+    """
+    按汉明距离组织的 BK 树，查询"距离不超过 d 的所有哈希"时只需要访问一小部分节点。
+    每个节点是 [哈希值, {距离: 子节点}]。
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value):
+        if self.root is None:
+            self.root = [value, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [value, {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """
+        返回 [(距离, 哈希值), ...]。
+        """
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                results.append((distance, node[0]))
+            # 三角不等式：只有距离在 [d - max, d + max] 之间的子树里才可能有结果
+            for child_distance, child in node[1].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return results
+
+def find_similar_image_groups(hash_values, max_distance=PERCEPTUAL_HASH_MAX_DISTANCE):
+    """
+    输入 {键: 感知哈希整数}，返回 {键: 组号}，只有两张及以上的组才会分配组号。
+    完全相同的哈希先合并，再用 BK 树查找相近的哈希，用并查集连成组。
+    """
+    keys_by_hash = {}
+    for key, value in hash_values.items():
+        keys_by_hash.setdefault(value, []).append(key)
+
+    tree = BKTree()
+    for value in keys_by_hash:
+        tree.add(value)
+
+    parent = {value: value for value in keys_by_hash}
+
+    def find(value):
+        while parent[value] != value:
+            parent[value] = parent[parent[value]]
+            value = parent[value]
+        return value
+
+    for value in keys_by_hash:
+        for _, other in tree.search(value, max_distance):
+            root_a, root_b = find(value), find(other)
+            if root_a != root_b:
+                parent[root_b] = root_a
+
+    members = {}
+    for value, keys in keys_by_hash.items():
+        members.setdefault(find(value), []).extend(keys)
+
+    groups = {}
+    group_id = 0
+    for keys in sorted(members.values(), key=lambda ks: min(ks)):
+        if len(keys) < 2:
+            continue
+        group_id += 1
+        for key in keys:
+            groups[key] = group_id
+    return groups
+
+def compute_perceptual_hashes(image_data, cache_dir=THUMBNAIL_CACHE_DIR, max_distance=PERCEPTUAL_HASH_MAX_DISTANCE, max_workers=None):
+    """
+    给每行加上"感知哈希"和"相似图片组ID"两列。
+    感知哈希按内容哈希缓存，没有变化的图片不会被重新解码。
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    index = load_content_hash_index(cache_dir)
+    cache_path = os.path.join(cache_dir, PERCEPTUAL_HASH_CACHE_FILENAME)
+    phash_cache = {}
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                phash_cache = json.load(f)
+        except Exception as e:
+            log_error(f"读取感知哈希缓存 '{cache_path}' 失败，将重新计算: {e}")
+
+    rows_by_path = {}
+    pending = []
+    for row in image_data:
+        image_path = row["图片的绝对路径"]
+        if image_path.lower().endswith(VIDEO_EXTENSIONS):
+            row["感知哈希"] = ""
+            row["相似图片组ID"] = ""
+            continue
+        rows_by_path[image_path] = row
+        content_hash = lookup_content_hash(index, image_path)
+        if content_hash is not None and content_hash in phash_cache:
+            row["感知哈希"] = phash_cache[content_hash]
+        else:
+            row["感知哈希"] = ""
+            pending.append((image_path, content_hash))
+
+    if pending:
+        print(f"需要计算 {len(pending)} 张图片的感知哈希（其余 {len(image_data) - len(pending)} 张使用缓存）...")
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_perceptual_hash_worker, image_path, content_hash) for image_path, content_hash in pending]
+            for future in as_completed(futures):
+                image_path, content_hash, phash, error = future.result()
+                if content_hash:
+                    remember_content_hash(index, image_path, content_hash)
+                if error:
+                    log_error(f"计算感知哈希失败 '{image_path}': {error}")
+                    continue
+                phash_cache[content_hash] = phash
+                rows_by_path[image_path]["感知哈希"] = phash
+
+    save_content_hash_index(cache_dir, index)
+    temp_path = cache_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(phash_cache, f)
+    os.replace(temp_path, cache_path)
+
+    hash_values = {path: int(row["感知哈希"], 16) for path, row in rows_by_path.items() if row["感知哈希"]}
+    groups = find_similar_image_groups(hash_values, max_distance)
+    for path, row in rows_by_path.items():
+        row["相似图片组ID"] = groups.get(path, "")
+    print(f"找到 {len(set(groups.values()))} 组相似图片，共 {len(groups)} 张。")
+    return image_data
+
+def build_similar_group_rows(image_data):
+    """
+    把带"相似图片组ID"的行整理成报告用的列表：每组里的每张图片一行，附带和组内第一张的汉明距离。
+    """
+    groups = {}
+    for row in image_data:
+        group_id = row.get("相似图片组ID")
+        if group_id:
+            groups.setdefault(group_id, []).append(row)
+
+    report_rows = []
+    for group_id in sorted(groups):
+        members = sorted(groups[group_id], key=lambda r: r["图片的绝对路径"])
+        first_hash = int(members[0]["感知哈希"], 16)
+        for row in members:
+            file_size = row_file_stat(row)[0]
+            if file_size is None:
+                file_size = ""
+            report_rows.append({
+                "相似图片组ID": group_id,
+                "组内图片数量": len(members),
+                "图片的绝对路径": row["图片的绝对路径"],
+                "感知哈希": row["感知哈希"],
+                "与组内第一张的汉明距离": hamming_distance(first_hash, int(row["感知哈希"], 16)),
+                "文件大小(字节)": file_size,
+            })
+    return report_rows
+
+def write_extra_sheet(writer, sheet_name, rows, columns):
+    """
+    往报告里追加一个工作表，并按内容调整列宽（最长不超过80，避免提示词把列撑得太宽）。
+    """
+    df = pd.DataFrame(rows, columns=columns)
+    df.to_excel(writer, index=False, sheet_name=sheet_name)
+    sheet = writer.sheets[sheet_name]
+    for col_idx, column_name in enumerate(df.columns):
+        max_length = len(column_name)
+        for cell_value in df[column_name]:
+            max_length = max(max_length, len(str(cell_value)))
+        sheet.column_dimensions[get_column_letter(col_idx + 1)].width = min(max_length + 2, 80)
+
+# ===================== 新增：本地逆推标签（WD14 风格 ONNX 模型）并和自带提示词对比 =====================
+# 模型和标签表都从本地文件读取，不联网。批量推理，按内容哈希缓存结果，
+# 几十万张图片第二次跑时只会对新图片做推理。
 
-# 允许 Pillow 加载截断的图像文件，避免程序崩溃。
-# 注意：即使设置为 True，如果文件严重损坏，仍可能引发异常，被下面的try-except捕获。
-# 且UserWarning本身不会被try-except捕获，需要额外的warnings处理。
-ImageFile.LOAD_TRUNCATED_IMAGES = True
+ENABLE_TAGGER = False
+TAGGER_MODEL_PATH = "wd14_tagger/model.onnx"
+TAGGER_TAGS_CSV_PATH = "wd14_tagger/selected_tags.csv" # WD14 自带的标签表：tag_id,name,category,count
+TAGGER_GENERAL_THRESHOLD = 0.35
+TAGGER_CHARACTER_THRESHOLD = 0.85
+TAGGER_BATCH_SIZE = 32
+TAGGER_PREPROCESS_THREADS = 4 # 负责读图和缩放的线程数
+TAGGER_INFERENCE_THREADS = 0 # onnxruntime 的线程数，0 表示让它自己决定
+TAGGER_SAVE_EVERY_BATCHES = 20 # 每推理这么多批保存一次标签缓存和哈希索引，中途崩溃也不会全部白做
 
-# 全局变量，用于在警告处理函数中访问当前处理的文件路径
-_current_processing_file = None
+def split_prompt_tags(prompt):
+    """
+    把提示词按逗号切成标签，去掉权重语法、括号和 <lora:...>，统一成小写、空格分隔的形式，
+    方便和逆推出来的标签比较。
+    """
+    if not prompt:
+        return []
+    text = re.sub(r'<[^>]*>', ',', prompt) # <lora:xxx:0.8> 之类的不是画面内容
+    text = re.sub(r'\bBREAK\b', ',', text)
+    tags = []
+    for part in text.split(','):
+        tag = re.sub(r':\s*-?\d+(?:\.\d+)?\s*(?=[)\]]|$)', '', part.strip()) # 去掉 (tag:1.2) 里的权重
+        tag = tag.replace('\\(', '\x00').replace('\\)', '\x01') # 保留转义的括号，比如 "ganyu \(genshin impact\)"
+        tag = re.sub(r'[()\[\]{}]', '', tag)
+        tag = tag.replace('\x00', '(').replace('\x01', ')')
+        tag = re.sub(r'\s+', ' ', tag.replace('_', ' ')).strip().lower()
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
 
-def custom_warning_formatter(message, category, filename, lineno, file=None, line=None):
+class LocalImageTagger:
     """
-    自定义警告格式化器，尝试获取当前处理的文件路径。
+    封装一个 WD14 风格的 ONNX 逆推模型：输入 NHWC、BGR、0-255 的正方形图片，输出每个标签的概率。
     """
-    global _current_processing_file
-    
-    # 检查警告是否来自 PIL 的 TiffImagePlugin 并且是 Truncated File Read
-    if category is UserWarning and "Truncated File Read" in str(message) and "TiffImagePlugin.py" in filename:
-        if _current_processing_file:
-            return f"UserWarning: {message} for file: '{_current_processing_file}'\n"
-    
-    # 对于其他警告，使用默认格式
-    return warnings.formatwarning(message, category, filename, lineno, line)
 
-# 设置自定义警告格式化器
-warnings.formatwarning = custom_warning_formatter
+    def __init__(self, model_path=TAGGER_MODEL_PATH, tags_csv_path=TAGGER_TAGS_CSV_PATH,
+                 general_threshold=TAGGER_GENERAL_THRESHOLD, character_threshold=TAGGER_CHARACTER_THRESHOLD,
+                 inference_threads=TAGGER_INFERENCE_THREADS):
+        if ort is None or np is None:
+            raise RuntimeError("逆推标签需要安装 onnxruntime 和 numpy：pip install onnxruntime numpy")
+        options = ort.SessionOptions()
+        if inference_threads:
+            options.intra_op_num_threads = inference_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.image_size = model_input.shape[1] if isinstance(model_input.shape[1], int) else 448
+        self.model_name = os.path.basename(os.path.dirname(os.path.abspath(model_path))) or os.path.basename(model_path)
 
-def log_error(message):
+        tags_df = pd.read_csv(tags_csv_path)
+        self.tag_names = [name.replace('_', ' ') for name in tags_df["name"]]
+        self.tag_categories = list(tags_df["category"])
+        self.general_threshold = general_threshold
+        self.character_threshold = character_threshold
+
+    def preprocess(self, image_bytes):
+        """
+        把图片按比例缩放后贴到白色正方形画布中间，转成模型要的 BGR float32 数组。
+        """
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.draft("RGB", (self.image_size, self.image_size))
+            if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+                img = img.convert("RGBA")
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.split()[-1])
+                img = background
+            else:
+                img = img.convert("RGB")
+            img.thumbnail((self.image_size, self.image_size), Image.BICUBIC, reducing_gap=2.0)
+            canvas = Image.new("RGB", (self.image_size, self.image_size), (255, 255, 255))
+            canvas.paste(img, ((self.image_size - img.width) // 2, (self.image_size - img.height) // 2))
+        array = np.asarray(canvas, dtype=np.float32)
+        return array[:, :, ::-1] # RGB -> BGR
+
+    def predict_batch(self, arrays):
+        """
+        对一批预处理好的图片做推理，返回每张图片的 [(标签, 置信度), ...]，按置信度从高到低。
+        评级类标签（category 9）不算画面内容，不输出。
+        """
+        probabilities = self.session.run(None, {self.input_name: np.stack(arrays)})[0]
+        results = []
+        for probs in probabilities:
+            tags = []
+            for tag_index in np.nonzero(probs >= min(self.general_threshold, self.character_threshold))[0]:
+                category = self.tag_categories[tag_index]
+                confidence = float(probs[tag_index])
+                if category == 9:
+                    continue
+                if category == 4 and confidence < self.character_threshold:
+                    continue
+                if category != 4 and confidence < self.general_threshold:
+                    continue
+                tags.append((self.tag_names[tag_index], round(confidence, 4)))
+            tags.sort(key=lambda item: -item[1])
+            results.append(tags)
+        return results
+
+def _read_for_tagger(image_path, content_hash, tagger):
     """
-    记录错误信息到控制台和日志文件。
+    在预处理线程中运行：读一次文件，同时算内容哈希和做预处理。
+    返回 (图片路径, 内容哈希, 数组, 错误信息)。
     """
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = f"{timestamp} - {message}\n"
-    print(message) # 在控制台打印错误信息
-    with open("image_scan_error.log", "a", encoding="utf-8") as log_file:
-        log_file.write(log_entry)
+    try:
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+        if content_hash is None:
+            content_hash = hashlib.sha1(image_bytes).hexdigest()
+        return image_path, content_hash, tagger.preprocess(image_bytes), None
+    except Exception as e:
+        return image_path, content_hash, None, str(e)
 
-def get_image_info(folder_path):
+def compare_prompt_and_inferred_tags(row, inferred_tags):
     """
-    Scans a folder for image files, extracts their paths, parent folders (absolute path),
-    and Stable Diffusion generation information.
+    把逆推结果和"正面提示词"里解析出来的标签做对比，结果写回这一行。
     """
-    global _current_processing_file # 声明使用全局变量
+    embedded = split_prompt_tags(row.get("正面提示词", ""))
+    inferred = [tag for tag, _ in inferred_tags]
+    embedded_set, inferred_set = set(embedded), set(inferred)
+    overlap = [tag for tag in inferred if tag in embedded_set]
+    union_size = len(embedded_set | inferred_set)
 
-    image_data = []
-    image_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+    row["逆推标签"] = ", ".join(inferred)
+    row["逆推标签置信度"] = ", ".join(f"{tag}:{confidence:.2f}" for tag, confidence in inferred_tags)
+    row["自带与逆推重合标签"] = ", ".join(overlap)
+    row["仅自带标签"] = ", ".join(tag for tag in embedded if tag not in inferred_set)
+    row["仅逆推标签"] = ", ".join(tag for tag in inferred if tag not in embedded_set)
+    row["标签重合率"] = round(len(overlap) / union_size, 4) if union_size else 0
 
-    # 定义一个更通用的正则表达式，用于从原始文本中捕获 Stable Diffusion 的信息块
-    # 它会从常见的提示词或Negative prompt开始匹配，直到最后一个参数Version结束
-    sd_full_info_pattern = re.compile(
-        r'.*?(?:masterpiece|score_\d|1girl|BREAK|Negative prompt:|Steps:).*?(?:Version:.*?|Module:.*?|)$',
-        re.DOTALL # 允许.匹配换行符
-    )
-    # 定义一个更严格的正则，用于最终验证是否是有效的SD参数
-    sd_validation_pattern = re.compile(r'Steps: \d+, Sampler: [\w\s]+', re.DOTALL)
+def run_image_tagger(image_data, cache_dir=THUMBNAIL_CACHE_DIR, batch_size=TAGGER_BATCH_SIZE,
+                     preprocess_threads=TAGGER_PREPROCESS_THREADS, tagger=None,
+                     save_every_batches=TAGGER_SAVE_EVERY_BATCHES):
+    """
+    对 image_data 里的图片批量逆推标签，并和自带提示词做对比。
+    预处理（读文件、解码、缩放）在线程池里进行，和模型推理重叠；结果按内容哈希缓存。
+    同时在预处理的图片最多 2*batch_size 张：预处理比推理快得多，全部提交的话预处理好的数组
+    （每张 448x448x3 float32，约2.4MB）会堆在内存里等推理。
+    """
+    if tagger is None:
+        tagger = LocalImageTagger()
+    os.makedirs(cache_dir, exist_ok=True)
+    index = load_content_hash_index(cache_dir)
+    cache_path = os.path.join(cache_dir, f"逆推标签缓存_{tagger.model_name}.json")
+    tag_cache = {}
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                tag_cache = json.load(f)
+        except Exception as e:
+            log_error(f"读取逆推标签缓存 '{cache_path}' 失败，将重新推理: {e}")
 
+    rows_by_path = {}
+    pending = []
+    for row in image_data:
+        image_path = row["图片的绝对路径"]
+        if image_path.lower().endswith(VIDEO_EXTENSIONS):
+            compare_prompt_and_inferred_tags(row, [])
+            continue
+        rows_by_path[image_path] = row
+        content_hash = lookup_content_hash(index, image_path)
+        if content_hash is not None and content_hash in tag_cache:
+            compare_prompt_and_inferred_tags(row, [tuple(item) for item in tag_cache[content_hash]])
+        else:
+            compare_prompt_and_inferred_tags(row, [])
+            pending.append((image_path, content_hash))
 
-    for root, _, files in os.walk(folder_path):
-        for file in files:
-            if file.lower().endswith(image_extensions):
-                absolute_path = os.path.abspath(os.path.join(root, file))
-                containing_folder_absolute_path = os.path.abspath(root)
-                sd_info = "没有扫描到生成信息" # 默认值
-                sd_info_no_newlines = "没有扫描到生成信息" # 新增：没有换行符的生成信息
-                positive_prompt = ""
-                negative_prompt = ""
-                other_settings = ""
-                positive_prompt_word_count = 0 # 新增：正面提示词字数
+    if pending:
+        print(f"需要逆推 {len(pending)} 张图片的标签（其余 {len(image_data) - len(pending)} 张使用缓存）...")
+        processed = 0
+        flushed_batches = 0
 
-                raw_metadata_string = "" # 用于存储从图片中初步提取的原始字符串
+        def save_caches():
+            save_content_hash_index(cache_dir, index)
+            temp_path = cache_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(tag_cache, f, ensure_ascii=False)
+            os.replace(temp_path, cache_path)
 
-                _current_processing_file = absolute_path # 在处理每个文件前更新全局变量
+        def flush(batch):
+            nonlocal flushed_batches
+            results = tagger.predict_batch([array for _, _, array in batch])
+            for (image_path, content_hash, _), inferred_tags in zip(batch, results):
+                tag_cache[content_hash] = inferred_tags
+                compare_prompt_and_inferred_tags(rows_by_path[image_path], inferred_tags)
+            flushed_batches += 1
+            if save_every_batches and flushed_batches % save_every_batches == 0:
+                save_caches()
 
-                try:
-                    # 尝试打开图像文件。如果文件损坏或截断，Image.open()可能会引发IOError或类似的异常
-                    with Image.open(absolute_path) as img:
-                        # --- 阶段 1: 尝试从标准位置获取原始元数据字符串 ---
-                        if "png" in img.format.lower() and "parameters" in img.info:
-                            raw_metadata_string = img.info["parameters"]
-                        elif "jpeg" in img.format.lower():
-                            if hasattr(img, '_getexif'):
-                                exif_data = img._getexif()
-                                if exif_data:
-                                    for tag, value in exif_data.items():
-                                        if tag in [0x9286, 0x010E]: # UserComment or ImageDescription
-                                            try:
-                                                # 尝试UTF-8解码，这是最常见的编码
-                                                raw_metadata_string = value.decode('utf-8', errors='ignore')
-                                                # 如果解码后仍然没有明显的SD参数特征，可以尝试其他编码
-                                                if not re.search(r'Steps:', raw_metadata_string):
-                                                    raw_metadata_string = value.decode('latin-1', errors='ignore')
-                                                break # 找到就跳出
-                                            except Exception:
-                                                pass
-                        
-                        # --- 阶段 2: 清理并使用更强大的正则表达式提取有效信息 ---
-                        if isinstance(raw_metadata_string, str) and raw_metadata_string:
-                            # 移除 Excel 不支持的非法 XML 字符
-                            cleaned_string = ILLEGAL_CHARACTERS_RE.sub(r'', raw_metadata_string)
-                            
-                            # Clean up the "UNICODE" prefix
-                            if cleaned_string.startswith("UNICODE"):
-                                cleaned_string = cleaned_string[len("UNICODE"):].lstrip() # Remove "UNICODE" and any leading whitespace
-                            
-                            # 尝试使用新的正则表达式捕获核心SD信息块
-                            match = sd_full_info_pattern.search(cleaned_string)
-                            
-                            if match:
-                                extracted_text = match.group(0).strip() # 获取匹配到的整个SD信息块
-                                # 再次使用更严格的正则验证，确保提取的是有效的SD参数
-                                if sd_validation_pattern.search(extracted_text):
-                                    sd_info = extracted_text
-                                    # 新增：生成没有换行符的生成信息
-                                    sd_info_no_newlines = sd_info.replace('\n', ' ').replace('\r', ' ').strip()
-                                    
-                                    # --- 阶段 3: 切割信息 (现在从 sd_info_no_newlines 切割) ---
-                                    # 从后往前切割
-                                    other_settings_match = re.search(r'(Steps:.*)', sd_info_no_newlines, re.DOTALL)
-                                    if other_settings_match:
-                                        other_settings = other_settings_match.group(1).strip()
-                                        temp_sd_info = sd_info_no_newlines[:other_settings_match.start()].strip()
-                                    else:
-                                        temp_sd_info = sd_info_no_newlines.strip() # 如果没有Steps，则整个认为是正向提示词
-
-                                    negative_prompt_match = re.search(r'(Negative prompt:.*?)(?=\s*Steps:|$)', temp_sd_info, re.DOTALL)
-                                    if negative_prompt_match:
-                                        negative_prompt = negative_prompt_match.group(1).replace("Negative prompt:", "").strip()
-                                        positive_prompt = temp_sd_info[:negative_prompt_match.start()].strip()
-                                    else:
-                                        positive_prompt = temp_sd_info.strip() # 如果没有Negative prompt，则整个认为是正向提示词
-                                    
-                                    # 统计正面提示词字数
-                                    positive_prompt_word_count = len(positive_prompt)
-
-                                else:
-                                    # 即使匹配到了，但最终验证不通过，也认为没有扫描到
-                                    sd_info = "没有扫描到生成信息"
-                                    sd_info_no_newlines = "没有扫描到生成信息"
-                            else:
-                                # 如果通用模式都无法匹配到，那就不包含SD信息
-                                sd_info = "没有扫描到生成信息"
-                                sd_info_no_newlines = "没有扫描到生成信息"
-
-                except Exception as e:
-                    # 如果Image.open()或后续操作因文件损坏而失败，这里的e会包含详细错误信息
-                    log_error(f"Error processing image file '{absolute_path}': {e}") # 明确指出是哪个文件出了问题
-                    sd_info = "没有扫描到生成信息" # 发生任何错误时都重置
-                    sd_info_no_newlines = "没有扫描到生成信息"
-                    positive_prompt = ""
-                    negative_prompt = ""
-                    other_settings = ""
-                    positive_prompt_word_count = 0
-                finally:
-                    _current_processing_file = None # 处理完一个文件后重置全局变量
-
-                image_data.append({
-                    "所在文件夹": containing_folder_absolute_path,
-                    "图片的绝对路径": absolute_path,
-                    "图片超链接": f'={absolute_path}',
-                    "stable diffusion的 ai图片的生成信息": sd_info,
-                    "去掉换行符的生成信息": sd_info_no_newlines, # 新增列
-                    "正面提示词": positive_prompt,
-                    "负面提示词": negative_prompt,
-                    "其他设置": other_settings,
-                    "正面提示词字数": positive_prompt_word_count # 新增列
-                })
+        with ThreadPoolExecutor(max_workers=preprocess_threads) as executor:
+            # 按提交顺序取结果；窗口里始终有后面的图片在预处理，推理时 CPU 不会闲着
+            pending_items = iter(pending)
+            in_flight = deque()
+            max_in_flight = max(2 * batch_size, preprocess_threads)
+
+            def submit_more():
+                while len(in_flight) < max_in_flight:
+                    item = next(pending_items, None)
+                    if item is None:
+                        return
+                    in_flight.append(executor.submit(_read_for_tagger, item[0], item[1], tagger))
+
+            submit_more()
+            batch = []
+            while in_flight:
+                image_path, content_hash, array, error = in_flight.popleft().result()
+                submit_more()
+                if content_hash:
+                    remember_content_hash(index, image_path, content_hash)
+                if error:
+                    log_error(f"逆推标签时读取图片失败 '{image_path}': {error}")
+                    continue
+                batch.append((image_path, content_hash, array))
+                if len(batch) >= batch_size:
+                    flush(batch)
+                    processed += len(batch)
+                    batch = []
+                    print(f"已逆推 {processed}/{len(pending)} 张")
+            if batch:
+                flush(batch)
+
+        save_caches()
     return image_data
 
-def create_excel_report(image_data, base_filename="图片信息报告"):
+# ===================== 新增：提示词规范化和提示词字典 =====================
+# 成千上万张图片用的是同一段提示词，只是空格、权重写法不一样。先把提示词规范化，
+# 再给每个不同的提示词分配一个整数ID，"哪些图片是同一个提示词生成的"就变成了按ID分组。
+
+ENABLE_PROMPT_TABLE = False
+PROMPT_TABLE_SORT_TAGS = False # True: 标签顺序不同也算同一个提示词
+DEDUPE_PROMPTS_IN_REPORT = False # True: 主表不再重复存放提示词原文，只放提示词ID，原文在"提示词字典"表里
+
+_prompt_weight_pattern = re.compile(r'\(\s*([^():]+?)\s*:\s*(-?\d+(?:\.\d+)?)\s*\)')
+
+def _canonical_weight(match):
+    """
+    (tag:1.20) -> (tag:1.2)；(tag:1.0) 和直接写 tag 效果一样，写成 tag。
+    """
+    tag = match.group(1)
+    weight = float(match.group(2))
+    if weight == 1.0:
+        return tag
+    return f"({tag}:{weight:g})"
+
+def split_prompt_top_level(prompt):
+    """
+    按逗号切分提示词，但括号里的逗号不切。
+    """
+    parts = []
+    depth = 0
+    current = []
+    for char in prompt:
+        if char in "([{<":
+            depth += 1
+        elif char in ")]}>" and depth > 0:
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return parts
+
+def normalize_prompt(prompt, sort_tags=False):
+    """
+    规范化提示词：统一小写（CLIP 分词本来就不区分大小写），合并空白，统一逗号和权重写法，
+    去掉空标签；sort_tags 为 True 时再按标签排序。
+    """
+    if not prompt:
+        return ""
+    text = re.sub(r'\s+', ' ', prompt.lower())
+    text = _prompt_weight_pattern.sub(_canonical_weight, text)
+    tags = [re.sub(r'\s*([()\[\]{}<>:])\s*', r'\1', tag).strip() for tag in split_prompt_top_level(text)]
+    tags = [tag for tag in tags if tag]
+    if sort_tags:
+        tags.sort()
+    return ", ".join(tags)
+
+class PromptTable:
+    """
+    提示词字典：规范化提示词 -> 提示词ID，记录每个提示词的使用次数和最早/最晚出现时间（按图片修改时间）。
+    可以边扫描边调用 add()，不需要先拿到全部数据。
+    """
+
+    def __init__(self, sort_tags=PROMPT_TABLE_SORT_TAGS):
+        self.sort_tags = sort_tags
+        self.ids = {}
+        self.entries = [] # 下标 = 提示词ID - 1
+
+    def add(self, row):
+        """
+        给一行分配提示词ID（写到"提示词ID"列），没有提示词的行ID为空。
+        """
+        positive_prompt = row.get("正面提示词", "")
+        if not positive_prompt:
+            row["提示词ID"] = ""
+            return None
+        normalized = normalize_prompt(positive_prompt, self.sort_tags)
+        mtime_ns = row_file_stat(row)[1] # 新增：用扫描时记下的修改时间
+        modified = mtime_ns / 1e9 if mtime_ns is not None else None
+        prompt_id = self.ids.get(normalized)
+        if prompt_id is None:
+            prompt_id = len(self.entries) + 1
+            self.ids[normalized] = prompt_id
+            self.entries.append({"normalized": normalized, "example": positive_prompt, "count": 0,
+                                 "first_seen": modified, "last_seen": modified})
+        entry = self.entries[prompt_id - 1]
+        entry["count"] += 1
+        if modified is not None:
+            if entry["first_seen"] is None or modified < entry["first_seen"]:
+                entry["first_seen"] = modified
+            if entry["last_seen"] is None or modified > entry["last_seen"]:
+                entry["last_seen"] = modified
+        row["提示词ID"] = prompt_id
+        return prompt_id
+
+    def report_rows(self):
+        def format_time(timestamp):
+            return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S") if timestamp is not None else ""
+        return [{
+            "提示词ID": prompt_id,
+            "图片数量": entry["count"],
+            "最早出现": format_time(entry["first_seen"]),
+            "最晚出现": format_time(entry["last_seen"]),
+            "规范化提示词": entry["normalized"],
+            "原始提示词示例": entry["example"],
+        } for prompt_id, entry in enumerate(self.entries, start=1)]
+
+def build_prompt_table(image_data, sort_tags=PROMPT_TABLE_SORT_TAGS):
+    """
+    给 image_data 的每一行加上"提示词ID"，返回 PromptTable。
+    """
+    prompt_table = PromptTable(sort_tags)
+    for row in image_data:
+        prompt_table.add(row)
+    print(f"{len(image_data)} 张图片共有 {len(prompt_table.entries)} 个不同的提示词。")
+    return prompt_table
+
+# ===================== 新增：模型 / LoRA / Embedding 使用统计 =====================
+# "其他设置"里有 Model、Model hash、Lora hashes、TI hashes，正面提示词里有 <lora:...>。
+# 扫描时每出一行就累加到计数器里（内存只和不同模型、文件夹的数量有关，和图片数量无关），
+# 最后输出使用统计、按文件夹的统计，以及引用了本地模型文件夹里没有的 LoRA 的图片。
+
+ENABLE_MODEL_USAGE = False
+LOCAL_MODELS_DIR = "" # 本地模型文件夹（比如 stable-diffusion-webui/models），为空时不检查缺失
+MODEL_FILE_EXTENSIONS = ('.safetensors', '.ckpt', '.pt', '.pth', '.bin')
+MISSING_LORA_MAX_ROWS = 100000 # "缺失的LoRA"表最多列出多少行
+
+# A1111 写参数的格式：key: value，value 里有逗号时用双引号括起来
+_settings_param_pattern = re.compile(r'\s*([\w ]+):\s*("(?:\\.|[^\\"])+"|[^,]*)(?:,|$)')
+_prompt_network_pattern = re.compile(r'<(lora|lyco|hypernet):([^:>]+)(?::[^>]*)?>', re.IGNORECASE)
+
+def parse_settings(other_settings):
+    """
+    把"其他设置"解析成字典，比如 {"Steps": "20", "Sampler": "Euler a", "Lora hashes": "a: 123, b: 456"}。
+    """
+    settings = {}
+    if not other_settings:
+        return settings
+    for key, value in _settings_param_pattern.findall(other_settings):
+        value = value.strip()
+        if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+            value = value[1:-1].replace('\\"', '"')
+        settings[key.strip()] = value
+    return settings
+
+def _parse_name_hash_list(value):
+    """
+    解析 "name1: hash1, name2: hash2" 这种写法，返回 [(名称, 哈希), ...]。
+    """
+    pairs = []
+    for item in value.split(","):
+        name, _, hash_value = item.rpartition(":")
+        if not name:
+            name, hash_value = hash_value, ""
+        if name.strip():
+            pairs.append((name.strip(), hash_value.strip()))
+    return pairs
+
+def extract_model_references(row):
+    """
+    从一行里提取引用的模型，返回 [(类型, 名称, 哈希), ...]，类型是 "模型" / "LoRA" / "Embedding" / "Hypernetwork"。
+    """
+    settings = parse_settings(row.get("其他设置", ""))
+    references = []
+    if settings.get("Model") or settings.get("Model hash"):
+        references.append(("模型", settings.get("Model", ""), settings.get("Model hash", "")))
+
+    lora_hashes = dict(_parse_name_hash_list(settings.get("Lora hashes", "")))
+    seen_loras = set()
+    for kind, name in _prompt_network_pattern.findall(row.get("正面提示词", "")):
+        name = name.strip()
+        kind_name = "Hypernetwork" if kind.lower() == "hypernet" else "LoRA"
+        if (kind_name, name) not in seen_loras:
+            seen_loras.add((kind_name, name))
+            references.append((kind_name, name, lora_hashes.get(name, "")))
+    for name, hash_value in lora_hashes.items():
+        if ("LoRA", name) not in seen_loras: # 提示词里没写但参数里记了哈希（比如被 Dynamic Prompts 去掉了）
+            references.append(("LoRA", name, hash_value))
+
+    for name, hash_value in _parse_name_hash_list(settings.get("TI hashes", "")):
+        references.append(("Embedding", name, hash_value))
+    return references
+
+def list_local_model_names(models_dir):
+    """
+    列出本地模型文件夹里所有模型文件的文件名（不含扩展名，小写）。
+    """
+    names = set()
+    if not models_dir or not os.path.isdir(models_dir):
+        return names
+    for root, _, files in os.walk(models_dir):
+        for file in files:
+            if file.lower().endswith(MODEL_FILE_EXTENSIONS):
+                names.add(os.path.splitext(file)[0].lower())
+    return names
+
+class ModelUsageAggregator:
+    """
+    边扫描边统计模型使用情况。用法：把 add 作为 on_row 传给 get_image_info。
+    """
+
+    def __init__(self, models_dir=LOCAL_MODELS_DIR, missing_max_rows=MISSING_LORA_MAX_ROWS):
+        self.local_names = list_local_model_names(models_dir)
+        self.check_missing = bool(self.local_names)
+        self.usage = Counter() # (类型, 名称) -> 图片数
+        self.hashes = {} # (类型, 名称) -> 出现过的哈希集合
+        self.folder_usage = Counter() # (所在文件夹, 类型, 名称) -> 图片数
+        self.missing_rows = []
+        self.missing_max_rows = missing_max_rows
+        self.missing_total = 0
+        self.images_with_references = 0
+
+    def add(self, row):
+        references = extract_model_references(row)
+        if not references:
+            return
+        self.images_with_references += 1
+        folder = row.get("所在文件夹", "")
+        for kind, name, hash_value in references:
+            key = (kind, name)
+            self.usage[key] += 1
+            self.folder_usage[(folder, kind, name)] += 1
+            if hash_value:
+                self.hashes.setdefault(key, set()).add(hash_value)
+            if self.check_missing and kind == "LoRA" and name.lower() not in self.local_names:
+                self.missing_total += 1
+                if len(self.missing_rows) < self.missing_max_rows:
+                    self.missing_rows.append({"图片的绝对路径": row["图片的绝对路径"], "所在文件夹": folder, "缺失的LoRA": name})
+
+    def usage_rows(self):
+        rows = []
+        for (kind, name), count in self.usage.most_common():
+            rows.append({
+                "类型": kind,
+                "名称": name,
+                "哈希": ", ".join(sorted(self.hashes.get((kind, name), ()))),
+                "使用图片数": count,
+                "本地是否存在": ("是" if name.lower() in self.local_names else "否") if self.check_missing and kind != "模型" else "",
+            })
+        return rows
+
+    def folder_rows(self):
+        return [{"所在文件夹": folder, "类型": kind, "名称": name, "使用图片数": count}
+                for (folder, kind, name), count in sorted(self.folder_usage.items(), key=lambda item: (item[0][0], -item[1]))]
+
+# ===================== 新增：按文件夹的汇总统计 =====================
+# 扫描时顺便按"所在文件夹"累计：图片数、有生成信息的比例、正面提示词字数的平均值和分位数、
+# 最常用的 Sampler / Steps / CFG scale / Size、文件总大小。每个文件夹只保存几个计数器和两种小"草图"，
+# 内存只和文件夹数有关，和图片数无关：
+#   最常用的值用 Space-Saving 算法，每个字段最多记 FOLDER_SUMMARY_TOP_K_CAPACITY 个候选值；
+#   分位数用对数分桶（相对误差 FOLDER_SUMMARY_QUANTILE_ACCURACY 以内），桶数只和取值范围有关。
+
+ENABLE_FOLDER_SUMMARY = True
+FOLDER_SUMMARY_FIELDS = ("Sampler", "Steps", "CFG scale", "Size") # 统计最常用值的"其他设置"字段
+FOLDER_SUMMARY_TOP_K_CAPACITY = 16 # 每个字段记多少个候选值，越大越准
+FOLDER_SUMMARY_TOP_VALUES = 3 # 报告里每个字段列出前几个
+FOLDER_SUMMARY_QUANTILE_ACCURACY = 0.02 # 分位数的相对误差
+
+class TopKSketch:
+    """
+    Space-Saving 近似计数：最多保存 capacity 个值。出现次数超过总数 1/capacity 的值一定在里面，
+    记下的次数最多多算 errors[值] 次。
+    """
+    def __init__(self, capacity=FOLDER_SUMMARY_TOP_K_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, value):
+        if value in self.counts:
+            self.counts[value] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[value] = 1
+            self.errors[value] = 0
+        else:
+            # 替换掉次数最少的值，新值继承它的次数（所以可能多算）
+            evicted = min(self.counts, key=self.counts.get)
+            evicted_count = self.counts.pop(evicted)
+            del self.errors[evicted]
+            self.counts[value] = evicted_count + 1
+            self.errors[value] = evicted_count
+
+    def top(self, n):
+        return sorted(self.counts.items(), key=lambda item: -item[1])[:n]
+
+class QuantileSketch:
+    """
+    对数分桶的分位数草图（DDSketch 的简化版）：非负数按 log(x)/log(gamma) 分桶，
+    返回的分位数和真实值的相对误差不超过 relative_accuracy。
+    """
+    def __init__(self, relative_accuracy=FOLDER_SUMMARY_QUANTILE_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = Counter()
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            self.buckets[math.ceil(math.log(value) / self.log_gamma)] += 1
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+class FolderSummaryAggregator:
+    """
+    边扫描边按文件夹汇总。用法：把 add 作为 on_row 传给 get_image_info，最后用 summary_rows() 写报告。
+    文件大小用扫描时放进行里的值。
+    """
+    def __init__(self, fields=FOLDER_SUMMARY_FIELDS):
+        self.fields = tuple(fields)
+        self.folders = {}
+
+    def _new_folder(self):
+        return {"count": 0, "with_info": 0, "word_total": 0, "bytes": 0,
+                "words": QuantileSketch(), "top": {field: TopKSketch() for field in self.fields}}
+
+    def add(self, row):
+        folder = row.get("所在文件夹", "")
+        stats = self.folders.get(folder)
+        if stats is None:
+            stats = self.folders[folder] = self._new_folder()
+        stats["count"] += 1
+        stats["bytes"] += row_file_stat(row)[0] or 0
+        if row.get("stable diffusion的 ai图片的生成信息", "没有扫描到生成信息") == "没有扫描到生成信息":
+            return
+        stats["with_info"] += 1
+        word_count = row.get("正面提示词字数") or 0
+        if isinstance(word_count, (int, float)):
+            stats["word_total"] += word_count
+            stats["words"].add(word_count)
+        settings = parse_settings(row.get("其他设置", ""))
+        for field in self.fields:
+            value = settings.get(field)
+            if value:
+                stats["top"][field].add(value)
+
+    def columns(self):
+        return (["所在文件夹", "图片数量", "有生成信息的比例", "正面提示词平均字数", "正面提示词字数中位数(约)",
+                 "正面提示词字数P90(约)"] + [f"最常用的{field}" for field in self.fields] + ["总字节数", "总大小"])
+
+    def summary_rows(self):
+        rows = []
+        for folder in sorted(self.folders):
+            stats = self.folders[folder]
+            words = stats["words"]
+            row = {
+                "所在文件夹": folder,
+                "图片数量": stats["count"],
+                "有生成信息的比例": round(stats["with_info"] / stats["count"], 4) if stats["count"] else 0,
+                "正面提示词平均字数": round(stats["word_total"] / words.count, 1) if words.count else "",
+                "正面提示词字数中位数(约)": round(words.quantile(0.5)) if words.count else "",
+                "正面提示词字数P90(约)": round(words.quantile(0.9)) if words.count else "",
+            }
+            for field in self.fields:
+                row[f"最常用的{field}"] = "、".join(f"{value} ({count})" for value, count
+                                                  in stats["top"][field].top(FOLDER_SUMMARY_TOP_VALUES))
+            row["总字节数"] = stats["bytes"]
+            row["总大小"] = _format_bytes(stats["bytes"])
+            rows.append(row)
+        return rows
+
+def create_excel_report(image_data, base_filename="图片信息报告", embed_thumbnails=EMBED_THUMBNAILS_IN_EXCEL,
+                        prompt_table=None, dedupe_prompts=DEDUPE_PROMPTS_IN_REPORT, model_usage=None,
+                        folder_summary=None):
     """
     Creates an Excel report from the collected image data with a timestamped filename
     and attempts to open it automatically.
+    If the rows carry a "缩略图" column, it is written as a link to the thumbnail
+    (or the thumbnail itself when embed_thumbnails is True).
+    With a prompt_table, a "提示词字典" sheet is added; dedupe_prompts then leaves the
+    prompt text out of the main sheet so each unique prompt is stored only once.
+    With a model_usage aggregator, model/LoRA usage sheets are added.
+    With a folder_summary aggregator, a per-folder "文件夹汇总" sheet is added.
     """
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
     output_filename = f"{base_filename}_{timestamp}.xlsx"
 
     df = pd.DataFrame(image_data)
 
+    # 新增：损坏文件单独列在"损坏文件"工作表里，主表不放这两列
+    damaged_rows = []
+    if "损坏原因" in df.columns:
+        damaged_df = df[df["损坏原因"].notna() & (df["损坏原因"] != "")]
+        for _, damaged in damaged_df.iterrows():
+            damaged_rows.append(damaged_sheet_row(damaged))
+
+    # 新增：提示词原文只在"提示词字典"里存一份（流式报告用同一个函数选列）
+    df = df[main_sheet_columns(list(df.columns), prompt_table, dedupe_prompts)]
+
     if df.empty:
         print("没有找到任何图片文件，将创建一个空的Excel文件。")
         df = pd.DataFrame(columns=[
@@ -254,23 +2981,898 @@ def create_excel_report(image_data, base_filename="图片信息报告"):
                 cell.value = "点击查看原图"
                 cell.font = Font(color=Color("0000FF"), underline="single")
 
+        # 新增：缩略图列，默认是指向缩略图的超链接，可选直接嵌入图片
+        if column_name == "缩略图":
+            sheet.column_dimensions[get_column_letter(col_idx + 1)].width = 15
+            for row_idx, thumbnail_path in enumerate(df[column_name]):
+                if not thumbnail_path:
+                    continue
+                cell = sheet.cell(row=row_idx + 2, column=col_idx + 1)
+                cell.hyperlink = f"file:///{thumbnail_path}"
+                cell.font = Font(color=Color("0000FF"), underline="single")
+                if embed_thumbnails:
+                    try:
+                        excel_image = ExcelImage(thumbnail_path)
+                        scale = 80 / max(excel_image.width, excel_image.height)
+                        excel_image.width = int(excel_image.width * scale)
+                        excel_image.height = int(excel_image.height * scale)
+                        sheet.add_image(excel_image, cell.coordinate)
+                        sheet.row_dimensions[row_idx + 2].height = 62
+                        cell.value = ""
+                    except Exception as e:
+                        log_error(f"嵌入缩略图失败 '{thumbnail_path}': {e}")
+                        cell.value = "查看缩略图"
+                else:
+                    cell.value = "查看缩略图"
+
+    if prompt_table is not None:
+        write_extra_sheet(writer, "提示词字典", prompt_table.report_rows(),
+                          ["提示词ID", "图片数量", "最早出现", "最晚出现", "规范化提示词", "原始提示词示例"])
+
+    if model_usage is not None:
+        write_extra_sheet(writer, "模型使用统计", model_usage.usage_rows(), ["类型", "名称", "哈希", "使用图片数", "本地是否存在"])
+        write_extra_sheet(writer, "按文件夹的模型使用", model_usage.folder_rows(), ["所在文件夹", "类型", "名称", "使用图片数"])
+        if model_usage.check_missing:
+            write_extra_sheet(writer, "缺失的LoRA", model_usage.missing_rows, ["图片的绝对路径", "所在文件夹", "缺失的LoRA"])
+            if model_usage.missing_total > len(model_usage.missing_rows):
+                print(f"引用缺失LoRA的记录共 {model_usage.missing_total} 条，报告里只列出前 {len(model_usage.missing_rows)} 条。")
+
+    if damaged_rows:
+        write_extra_sheet(writer, "损坏文件", damaged_rows, ["图片的绝对路径", "所在文件夹", "损坏原因", "首次发现时间"])
+
+    if folder_summary is not None: # 新增：按文件夹的汇总统计
+        write_extra_sheet(writer, "文件夹汇总", folder_summary.summary_rows(), folder_summary.columns())
+
+    # 新增：相似图片分组工作表，方便按组清理重复图片
+    if "相似图片组ID" in df.columns:
+        similar_group_rows = build_similar_group_rows(image_data)
+        if similar_group_rows:
+            write_extra_sheet(writer, "相似图片组", similar_group_rows, list(similar_group_rows[0].keys()))
+
     writer.close()
     print(f"数据已成功保存到 {output_filename}")
 
+    # 新增：原来这里同步调用 xdg-open，无图形界面的服务器上会卡住或报错；改成不等待的通知
+    open_file_automatically(output_filename)
+    return output_filename
+
+# ===================== 新增：大数据量报告的外部排序和分组 =====================
+# 按文件夹、提示词、Seed 排序或者按提示词分组时，原来是把所有行放进 pandas 里做，最大的归档会把内存用完。
+# 这里改成外部归并排序：行先放在内存里，超过内存预算就排好序、压缩写到临时文件（一个"顺串"），
+# 最后把所有顺串多路归并，一边归并一边用 openpyxl 的只写模式写xlsx。任何时候内存里只有预算内的行。
+# 分组也是先按分组字段外部排序，再顺序扫一遍，相同的值连在一起，逐组汇总。
+
+REPORT_SORT_KEYS = () # 比如 ("所在文件夹", "Seed")；报告里的列名和"其他设置"里的字段名都可以
+REPORT_SORT_DESCENDING = False
+REPORT_GROUP_BY = "" # 比如 "正面提示词"，报告里多一个分组汇总的工作表
+REPORT_MEMORY_BUDGET_MB = 256 # 排序时内存里最多放多少数据，超过就写临时文件
+REPORT_SORT_TEMP_DIR = None # 临时文件放在哪里，None 表示系统临时目录
+EXTERNAL_SORT_MERGE_FAN_IN = 64 # 一次最多同时归并多少个临时文件（太多会超过能同时打开的文件数）
+EXCEL_CELL_MAX_CHARS = 32767 # xlsx 单元格最多能放这么多字
+
+def _sort_value(value):
+    """
+    排序用的值：空值排最后，数字按数字比较，其他按文字比较（不同类型之间不会比较出错）。
+    """
+    if value is None or value == "" or value != value:
+        return [2, ""]
+    if isinstance(value, (int, float)):
+        return [0, value]
+    try:
+        return [0, float(value)]
+    except (TypeError, ValueError):
+        return [1, str(value)]
+
+def get_row_field(row, name, settings_cache=None):
+    """
+    取一行里的某个字段：报告里有这一列就用列的值，否则到"其他设置"里找（比如 Seed、Sampler）。
+    同一行要取好几个字段时传同一个 settings_cache（空字典），"其他设置"只解析一次。
+    """
+    if name in row:
+        return row[name]
+    if settings_cache is None:
+        return parse_settings(row.get("其他设置", "")).get(name)
+    if "settings" not in settings_cache:
+        settings_cache["settings"] = parse_settings(row.get("其他设置", ""))
+    return settings_cache["settings"].get(name)
+
+def make_row_sort_key(keys):
+    def sort_key(row):
+        settings_cache = {}
+        return [_sort_value(get_row_field(row, name, settings_cache)) for name in keys]
+    return sort_key
+
+def _estimate_row_bytes(row):
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row.values())
+
+class ExternalSorter:
+    """
+    在内存预算内排序任意多的行。add() 逐行加入，sorted_rows() 按顺序逐行产出，用完调用 close() 删除临时文件。
+    键相同的行保持加入的先后顺序。
+    """
+    def __init__(self, key, memory_budget_bytes, reverse=False, temp_dir=REPORT_SORT_TEMP_DIR):
+        self.key = key
+        self.memory_budget_bytes = memory_budget_bytes
+        self.reverse = reverse
+        self.temp_dir = tempfile.mkdtemp(prefix="图片信息排序_", dir=temp_dir)
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.runs = []
+        self.run_count = 0 # 生成过的临时文件数，用来给文件编号
+        self.row_count = 0
+        self.columns = {} # 出现过的列名，保持第一次出现的顺序
+
+    def add(self, row):
+        self.buffer.append((self.key(row), row))
+        self.buffer_bytes += _estimate_row_bytes(row)
+        self.row_count += 1
+        for column in row:
+            if column not in self.columns:
+                self.columns[column] = None
+        if self.buffer_bytes >= self.memory_budget_bytes:
+            self._spill()
+
+    def _write_run(self, items):
+        path = os.path.join(self.temp_dir, f"run_{self.run_count:06d}.jsonl.gz")
+        self.run_count += 1
+        with gzip.open(path, "wt", encoding="utf-8", compresslevel=1) as f:
+            for key, row in items:
+                f.write(json.dumps([key, row], ensure_ascii=False, default=str) + "\n")
+        return path
+
+    def _spill(self):
+        # sort 是稳定的，键相同的行保持加入顺序
+        self.buffer.sort(key=itemgetter(0), reverse=self.reverse)
+        self.runs.append(self._write_run(self.buffer))
+        self.buffer = []
+        self.buffer_bytes = 0
+
+    @staticmethod
+    def _read_run(path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def _merge(self, streams):
+        # heapq.merge 在键相同时按参数顺序输出，顺串按生成顺序排列，所以整体也是稳定的
+        return heapq.merge(*streams, key=itemgetter(0), reverse=self.reverse)
+
+    def sorted_rows(self):
+        # 顺串太多时先分批合并成更大的顺串
+        while len(self.runs) > EXTERNAL_SORT_MERGE_FAN_IN:
+            batch, self.runs = self.runs[:EXTERNAL_SORT_MERGE_FAN_IN], self.runs[EXTERNAL_SORT_MERGE_FAN_IN:]
+            merged_path = self._write_run(self._merge([self._read_run(path) for path in batch]))
+            for path in batch:
+                os.remove(path)
+            self.runs.insert(0, merged_path)
+        self.buffer.sort(key=itemgetter(0), reverse=self.reverse)
+        for _, row in self._merge([self._read_run(path) for path in self.runs] + [iter(self.buffer)]):
+            yield row
+
+    def close(self):
+        self.buffer = []
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+def create_report_sorters(memory_budget_bytes, sort_keys=REPORT_SORT_KEYS, group_by=REPORT_GROUP_BY,
+                          descending=REPORT_SORT_DESCENDING):
+    """
+    返回 (排序器, 分组排序器)，没有设置排序和分组时都是 None。
+    两个都要时平分内存预算，加起来不超过 REPORT_MEMORY_BUDGET_MB。
+    """
+    if not sort_keys and not group_by:
+        return None, None
+    sorter_budget = memory_budget_bytes // 2 if group_by else memory_budget_bytes
+    streaming_sorter = ExternalSorter(make_row_sort_key(sort_keys), sorter_budget, reverse=descending)
+    group_sorter = GroupBySorter(group_by, memory_budget_bytes - sorter_budget) if group_by else None
+    return streaming_sorter, group_sorter
+
+class GroupBySorter:
+    """
+    按一个字段外部分组。每行只保留分组值、路径和文件夹，排序后逐组汇总。
+    """
+    def __init__(self, field, memory_budget_bytes, temp_dir=REPORT_SORT_TEMP_DIR):
+        self.field = field
+        self.sorter = ExternalSorter(lambda item: [_sort_value(item["分组值"])], memory_budget_bytes, temp_dir=temp_dir)
+
+    def add(self, row):
+        value = get_row_field(row, self.field)
+        self.sorter.add({"分组值": "" if value is None else value,
+                         "图片的绝对路径": row["图片的绝对路径"], "所在文件夹": row.get("所在文件夹", "")})
+
+    def group_rows(self):
+        """
+        逐组产出 {分组字段: 值, 图片数量, 文件夹数量, 示例图片}，按分组值排序。
+        """
+        current_key = None
+        summary = None
+        folders = set()
+        for item in self.sorter.sorted_rows():
+            key = _sort_value(item["分组值"])
+            if summary is None or key != current_key:
+                if summary is not None:
+                    summary["文件夹数量"] = len(folders)
+                    yield summary
+                current_key = key
+                summary = {self.field: item["分组值"], "图片数量": 0, "文件夹数量": 0, "示例图片": item["图片的绝对路径"]}
+                folders = set()
+            summary["图片数量"] += 1
+            folders.add(item["所在文件夹"])
+        if summary is not None:
+            summary["文件夹数量"] = len(folders)
+            yield summary
+
+    def close(self):
+        self.sorter.close()
+
+def _write_only_value(value):
+    if isinstance(value, str) and len(value) > EXCEL_CELL_MAX_CHARS:
+        return value[:EXCEL_CELL_MAX_CHARS]
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    return value if isinstance(value, (str, int, float, bool)) else str(value)
+
+def _safe_sheet_name(name):
+    return re.sub(r'[\[\]:*?/\\]', '_', name)[:31]
+
+def append_write_only_sheet(workbook, sheet_name, rows, columns, widths=None):
+    """
+    往只写模式的工作簿里追加一个工作表，rows 可以是生成器。列宽只能事先设定。
+    """
+    sheet = workbook.create_sheet(_safe_sheet_name(sheet_name))
+    for col_idx, column_name in enumerate(columns):
+        width = (widths or {}).get(column_name, max(15, len(column_name) + 2))
+        sheet.column_dimensions[get_column_letter(col_idx + 1)].width = width
+    sheet.append(columns)
+    for row in rows:
+        sheet.append([_write_only_value(row.get(column, "")) for column in columns])
+    return sheet
+
+def main_sheet_columns(columns, prompt_table=None, dedupe_prompts=DEDUPE_PROMPTS_IN_REPORT):
+    """
+    主表"图片信息"要放的列（和 create_excel_report 一样）：损坏原因、首次发现时间单独放在"损坏文件"表；
+    有提示词字典并且 dedupe_prompts 时不放提示词原文。
+    """
+    dropped = {"损坏原因", "首次发现时间"} | {column for column in columns if str(column).startswith("_")}
+    if prompt_table is not None and dedupe_prompts and "提示词ID" in columns:
+        dropped.update(("stable diffusion的 ai图片的生成信息", "去掉换行符的生成信息", "正面提示词"))
+    return [column for column in columns if column not in dropped]
+
+def damaged_sheet_row(row):
+    first_seen = row.get("首次发现时间", "")
+    return {"图片的绝对路径": row["图片的绝对路径"], "所在文件夹": row["所在文件夹"], "损坏原因": row["损坏原因"],
+            "首次发现时间": first_seen if isinstance(first_seen, str) else ""}
+
+def create_streaming_excel_report(sorter, base_filename="图片信息报告", group_by=None, prompt_table=None, model_usage=None,
+                                  folder_summary=None, dedupe_prompts=DEDUPE_PROMPTS_IN_REPORT):
+    """
+    按 sorter 的顺序把行流式写进xlsx（openpyxl 只写模式），不在内存里建表。
+    主表的列和其他工作表都和 create_excel_report 一样；group_by 是 GroupBySorter 时，多一个分组汇总的工作表。写完自动打开。
+    """
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    output_filename = f"{base_filename}_{timestamp}.xlsx"
+    workbook = Workbook(write_only=True)
+    columns = main_sheet_columns(list(sorter.columns), prompt_table, dedupe_prompts) or ["所在文件夹", "图片的绝对路径", "图片超链接", "stable diffusion的 ai图片的生成信息",
+                                       "去掉换行符的生成信息", "正面提示词", "负面提示词", "其他设置", "正面提示词字数"]
+    wide_columns = ("stable diffusion的 ai图片的生成信息", "去掉换行符的生成信息", "正面提示词", "负面提示词", "其他设置")
+
+    sheet = workbook.create_sheet("图片信息")
+    for col_idx, column_name in enumerate(columns):
+        if column_name == "图片超链接":
+            width = 15
+        elif column_name in wide_columns:
+            width = 80
+        elif column_name in ("所在文件夹", "图片的绝对路径"):
+            width = 60
+        else:
+            width = max(15, len(column_name) + 2)
+        sheet.column_dimensions[get_column_letter(col_idx + 1)].width = width
+    sheet.append(columns)
+    link_font = Font(color=Color("0000FF"), underline="single")
+    damaged_rows = [] # 损坏文件一般很少，顺便收集起来单独列一个表
+    for row in sorter.sorted_rows():
+        if row.get("损坏原因"):
+            damaged_rows.append(damaged_sheet_row(row))
+        cells = []
+        for column_name in columns:
+            if column_name == "图片超链接":
+                cell = WriteOnlyCell(sheet, value="点击查看原图")
+                cell.hyperlink = f"file:///{row.get('图片的绝对路径', '')}"
+                cell.font = link_font
+                cells.append(cell)
+            else:
+                cells.append(_write_only_value(row.get(column_name, "")))
+        sheet.append(cells)
+
+    if prompt_table is not None:
+        append_write_only_sheet(workbook, "提示词字典", prompt_table.report_rows(),
+                                ["提示词ID", "图片数量", "最早出现", "最晚出现", "规范化提示词", "原始提示词示例"])
+    if model_usage is not None:
+        append_write_only_sheet(workbook, "模型使用统计", model_usage.usage_rows(), ["类型", "名称", "哈希", "使用图片数", "本地是否存在"])
+        append_write_only_sheet(workbook, "按文件夹的模型使用", model_usage.folder_rows(), ["所在文件夹", "类型", "名称", "使用图片数"])
+        if model_usage.check_missing:
+            append_write_only_sheet(workbook, "缺失的LoRA", model_usage.missing_rows, ["图片的绝对路径", "所在文件夹", "缺失的LoRA"])
+    if damaged_rows:
+        append_write_only_sheet(workbook, "损坏文件", damaged_rows, ["图片的绝对路径", "所在文件夹", "损坏原因", "首次发现时间"])
+    if folder_summary is not None:
+        append_write_only_sheet(workbook, "文件夹汇总", folder_summary.summary_rows(), folder_summary.columns(), {"所在文件夹": 60})
+    if group_by is not None:
+        append_write_only_sheet(workbook, f"按{group_by.field}分组", group_by.group_rows(),
+                                [group_by.field, "图片数量", "文件夹数量", "示例图片"],
+                                {group_by.field: 80, "示例图片": 60})
+
+    workbook.save(output_filename)
+    print(f"数据已成功保存到 {output_filename}（共 {sorter.row_count} 行，临时文件 {sorter.run_count} 个）")
+    open_file_automatically(output_filename)
+    return output_filename
+
+# ===================== 新增：HTML 报告（虚拟滚动） =====================
+# 几十万行的xlsx用Excel打开要好几分钟，HTML报告把数据按块写成 .js 文件（file:// 下 fetch 不能用，
+# 所以用 <script> 标签加载），页面只渲染看得见的那几十行，离线双击 index.html 就能用。
+
+REPORT_FORMAT = "xlsx" # 可选 "xlsx"、"html"、"both"
+HTML_REPORT_CHUNK_SIZE = 5000 # 每个数据块的行数
+# 这两列在HTML里是多余的：超链接是Excel公式，原始生成信息和"去掉换行符的生成信息"重复
+HTML_REPORT_SKIP_COLUMNS = ("图片超链接", "stable diffusion的 ai图片的生成信息")
+
+HTML_REPORT_TEMPLATE = r"""<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+body { margin: 0; font: 13px sans-serif; display: flex; flex-direction: column; height: 100vh; }
+#toolbar { padding: 6px; background: #f3f3f3; border-bottom: 1px solid #ccc; display: flex; gap: 6px; flex-wrap: wrap; align-items: center; }
+#toolbar input { width: 200px; padding: 3px; }
+#status { color: #555; margin-left: auto; }
+.row { display: flex; box-sizing: border-box; border-bottom: 1px solid #eee; }
+.row:hover { background: #f7fbff; }
+.row.selected { background: #e3f0ff; }
+.cell { flex: 0 0 auto; overflow: hidden; white-space: nowrap; text-overflow: ellipsis; padding: 2px 4px; box-sizing: border-box; }
+#header { background: #fafafa; font-weight: bold; border-bottom: 2px solid #ccc; cursor: pointer; user-select: none; }
+#viewport { flex: 1; overflow-y: auto; position: relative; }
+#rows { position: absolute; left: 0; right: 0; top: 0; }
+#detail { max-height: 30vh; overflow: auto; border-top: 2px solid #ccc; padding: 6px; white-space: pre-wrap; word-break: break-all; display: none; }
+#detail b { color: #333; }
+img.thumb { max-height: 100%; max-width: 100%; }
+</style>
+</head>
+<body>
+<div id="toolbar">
+  <input id="filter-all" placeholder="全部列包含...">
+  <input data-column="正面提示词" placeholder="正面提示词包含...">
+  <input data-column="负面提示词" placeholder="负面提示词包含...">
+  <input data-column="其他设置" placeholder="其他设置包含...">
+  <input data-column="所在文件夹" placeholder="所在文件夹包含...">
+  <span id="status"></span>
+</div>
+<div id="header" class="row"></div>
+<div id="viewport"><div id="spacer"></div><div id="rows"></div></div>
+<div id="detail"></div>
+<script src="data/manifest.js"></script>
+<script>
+(function () {
+  var M = window.REPORT_MANIFEST;
+  var columns = M.columns, rowHeight = M.rowHeight;
+  var widths = columns.map(function (c) { return M.widths[c] || 150; });
+  var col = {};
+  columns.forEach(function (c, i) { col[c] = i; });
+  var rows = [], view = [], loadedChunks = 0;
+  var lowered = {}; // 每列的小写缓存，按需建立
+  var filters = {}, filterAll = "";
+  var sortColumn = -1, sortDesc = false, sortDirty = false;
+  var selected = -1;
+  var MAX_SCROLL_HEIGHT = 10000000; // 浏览器对元素高度有上限，超过后按比例映射
+  var viewport = document.getElementById("viewport");
+  var spacer = document.getElementById("spacer");
+  var rowsBox = document.getElementById("rows");
+  var statusBox = document.getElementById("status");
+  var detail = document.getElementById("detail");
+
+  function fileUrl(path) {
+    path = String(path).replace(/\\/g, "/");
+    if (path.charAt(0) !== "/") path = "/" + path;
+    return "file://" + encodeURI(path).replace(/#/g, "%23").replace(/\?/g, "%3F");
+  }
+
+  function lowerOf(rowIndex, colIndex) {
+    var cache = lowered[colIndex];
+    if (!cache) cache = lowered[colIndex] = [];
+    var v = cache[rowIndex];
+    if (v === undefined) {
+      v = rows[rowIndex][colIndex];
+      v = cache[rowIndex] = (v === null || v === undefined) ? "" : String(v).toLowerCase();
+    }
+    return v;
+  }
+
+  function matches(i) {
+    for (var c in filters) {
+      if (lowerOf(i, c).indexOf(filters[c]) < 0) return false;
+    }
+    if (filterAll) {
+      for (var j = 0; j < columns.length; j++) {
+        if (lowerOf(i, j).indexOf(filterAll) >= 0) return true;
+      }
+      return false;
+    }
+    return true;
+  }
+
+  function compareRows(a, b) {
+    var x = rows[a][sortColumn], y = rows[b][sortColumn], r;
+    if (typeof x === "number" && typeof y === "number") r = x - y;
+    else r = String(x === null ? "" : x).localeCompare(String(y === null ? "" : y));
+    if (r === 0) r = a - b;
+    return sortDesc ? -r : r;
+  }
+
+  function refilter() {
+    view = [];
+    for (var i = 0; i < rows.length; i++) if (matches(i)) view.push(i);
+    if (sortColumn >= 0) view.sort(compareRows);
+    sortDirty = false;
+    selected = -1;
+    viewport.scrollTop = 0;
+    render();
+  }
+
+  function totalHeight() { return view.length * rowHeight; }
+
+  function render() {
+    var real = totalHeight();
+    var virtual = Math.min(real, MAX_SCROLL_HEIGHT);
+    spacer.style.height = virtual + "px";
+    var clientHeight = viewport.clientHeight;
+    var scrollTop = viewport.scrollTop;
+    var ratio = (virtual > clientHeight && real > virtual) ? (real - clientHeight) / (virtual - clientHeight) : 1;
+    var offset = scrollTop * ratio;
+    var first = Math.floor(offset / rowHeight);
+    var count = Math.ceil(clientHeight / rowHeight) + 2;
+    rowsBox.style.transform = "translateY(" + (scrollTop - (offset - first * rowHeight)) + "px)";
+    var html = document.createDocumentFragment();
+    for (var k = first; k < Math.min(first + count, view.length); k++) {
+      html.appendChild(renderRow(view[k]));
+    }
+    rowsBox.textContent = "";
+    rowsBox.appendChild(html);
+    statusBox.textContent = "显示 " + view.length + " / 已加载 " + rows.length + " / 共 " + M.total + " 行" +
+      (loadedChunks < M.chunks ? "（加载中 " + loadedChunks + "/" + M.chunks + "）" : "");
+  }
+
+  function renderRow(i) {
+    var div = document.createElement("div");
+    div.className = "row" + (i === selected ? " selected" : "");
+    div.style.height = rowHeight + "px";
+    div.dataset.index = i;
+    var r = rows[i];
+    for (var j = 0; j < columns.length; j++) {
+      var cell = document.createElement("div");
+      cell.className = "cell";
+      cell.style.width = widths[j] + "px";
+      var v = r[j];
+      if (columns[j] === "图片的绝对路径" && v) {
+        var a = document.createElement("a");
+        a.href = fileUrl(v);
+        a.target = "_blank";
+        a.textContent = v;
+        cell.appendChild(a);
+      } else if (columns[j] === "缩略图" && v) {
+        var img = document.createElement("img");
+        img.className = "thumb";
+        img.loading = "lazy";
+        img.src = /^[a-zA-Z]:|^\//.test(v) ? fileUrl(v) : v;
+        cell.appendChild(img);
+      } else {
+        cell.textContent = (v === null || v === undefined) ? "" : v;
+      }
+      div.appendChild(cell);
+    }
+    return div;
+  }
+
+  function showDetail(i) {
+    detail.textContent = "";
+    var r = rows[i];
+    for (var j = 0; j < columns.length; j++) {
+      var b = document.createElement("b");
+      b.textContent = columns[j] + ": ";
+      detail.appendChild(b);
+      detail.appendChild(document.createTextNode((r[j] === null ? "" : r[j]) + "\n"));
+    }
+    detail.style.display = "block";
+  }
+
+  columns.forEach(function (c, j) {
+    var h = document.createElement("div");
+    h.className = "cell";
+    h.style.width = widths[j] + "px";
+    h.textContent = c;
+    h.title = "点击排序";
+    h.onclick = function () {
+      if (sortColumn === j) sortDesc = !sortDesc; else { sortColumn = j; sortDesc = false; }
+      view.sort(compareRows);
+      render();
+    };
+    document.getElementById("header").appendChild(h);
+  });
+
+  var timer = null;
+  function scheduleRefilter() {
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      filters = {};
+      document.querySelectorAll("#toolbar input[data-column]").forEach(function (input) {
+        var c = col[input.dataset.column];
+        if (c !== undefined && input.value) filters[c] = input.value.toLowerCase();
+      });
+      filterAll = document.getElementById("filter-all").value.toLowerCase();
+      refilter();
+    }, 150);
+  }
+  document.querySelectorAll("#toolbar input").forEach(function (input) {
+    input.addEventListener("input", scheduleRefilter);
+  });
+  viewport.addEventListener("scroll", function () { window.requestAnimationFrame(render); });
+  window.addEventListener("resize", render);
+  rowsBox.addEventListener("click", function (e) {
+    var rowDiv = e.target.closest(".row");
+    if (!rowDiv || e.target.tagName === "A") return;
+    selected = Number(rowDiv.dataset.index);
+    showDetail(selected);
+    render();
+  });
+
+  // 数据块按顺序一个一个加载，先到的先显示，不需要等全部加载完
+  window.__loadChunk = function (n, data) {
+    var start = rows.length;
+    for (var i = 0; i < data.length; i++) {
+      rows.push(data[i]);
+      if (matches(start + i)) view.push(start + i);
+    }
+    loadedChunks++;
+    if (sortColumn >= 0) sortDirty = true;
+    loadNextChunk();
+    render();
+  };
+  function loadNextChunk() {
+    if (loadedChunks >= M.chunks) {
+      if (sortDirty) { view.sort(compareRows); sortDirty = false; render(); }
+      return;
+    }
+    var s = document.createElement("script");
+    s.src = "data/chunk_" + String(loadedChunks).padStart(5, "0") + ".js";
+    document.body.appendChild(s);
+  }
+  render();
+  loadNextChunk();
+})();
+</script>
+</body>
+</html>
+"""
+
+def _html_report_value(value):
+    """
+    把单元格的值转换成可以写进json的类型，NaN之类的变成空字符串。
+    """
+    if value is None:
+        return ""
+    if isinstance(value, (bool, int, str)):
+        return value
+    if isinstance(value, float):
+        return value if value == value else "" # NaN != NaN
+    return str(value)
+
+def create_html_report(image_data, base_filename="图片信息报告", chunk_size=HTML_REPORT_CHUNK_SIZE):
+    """
+    生成一个可以离线打开的HTML报告文件夹：index.html + data/ 下分块的数据文件。
+    返回 index.html 的路径。
+    """
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    output_dir = os.path.abspath(f"{base_filename}_{timestamp}_html")
+    data_dir = os.path.join(output_dir, "data")
+    os.makedirs(data_dir, exist_ok=True)
+
+    columns = []
+    for row in image_data:
+        for column_name in row:
+            if column_name not in columns and column_name not in HTML_REPORT_SKIP_COLUMNS and not column_name.startswith("_"):
+                columns.append(column_name)
+    if not columns:
+        print("没有找到任何图片文件，将创建一个空的HTML报告。")
+        columns = ["所在文件夹", "图片的绝对路径", "去掉换行符的生成信息", "正面提示词", "负面提示词", "其他设置", "正面提示词字数"]
+
+    has_thumbnails = "缩略图" in columns
+    widths = {column_name: 150 for column_name in columns}
+    widths.update({"所在文件夹": 220, "图片的绝对路径": 320, "正面提示词": 360, "负面提示词": 240,
+                   "其他设置": 300, "去掉换行符的生成信息": 300, "正面提示词字数": 90, "缩略图": 80})
+
+    chunk_count = 0
+    for start in range(0, len(image_data), chunk_size):
+        chunk_rows = []
+        for row in image_data[start:start + chunk_size]:
+            values = []
+            for column_name in columns:
+                value = _html_report_value(row.get(column_name, ""))
+                if column_name == "缩略图" and value:
+                    # 缩略图尽量写成相对路径，整个报告文件夹和缓存一起拷走也能显示
+                    try:
+                        value = os.path.relpath(value, output_dir).replace(os.sep, "/")
+                    except ValueError: # Windows上不同盘符没法算相对路径
+                        pass
+                values.append(value)
+            chunk_rows.append(values)
+        chunk_path = os.path.join(data_dir, f"chunk_{chunk_count:05d}.js")
+        with open(chunk_path, "w", encoding="utf-8") as f:
+            f.write(f"window.__loadChunk({chunk_count},")
+            json.dump(chunk_rows, f, ensure_ascii=False, separators=(",", ":"))
+            f.write(");\n")
+        chunk_count += 1
+
+    manifest = {
+        "columns": columns,
+        "total": len(image_data),
+        "chunks": chunk_count,
+        "rowHeight": 64 if has_thumbnails else 24,
+        "widths": widths,
+    }
+    with open(os.path.join(data_dir, "manifest.js"), "w", encoding="utf-8") as f:
+        f.write("window.REPORT_MANIFEST = ")
+        json.dump(manifest, f, ensure_ascii=False)
+        f.write(";\n")
+
+    index_path = os.path.join(output_dir, "index.html")
+    with open(index_path, "w", encoding="utf-8") as f:
+        f.write(HTML_REPORT_TEMPLATE.replace("__TITLE__", f"{base_filename}_{timestamp}"))
+
+    print(f"HTML报告已成功保存到 {index_path}")
+    open_file_automatically(index_path)
+    return index_path
+
+# ===================== 新增：报告完成后的通知（不阻塞） =====================
+# 原来写完报告后同步等 xdg-open 返回，服务器上没有图形界面时会卡住或报错，批量任务也白白多等几秒。
+# 现在所有"打开结果"的动作都交给通知器，启动后立刻返回，不等打开的程序结束：
+#   "open"    用系统默认程序打开（没有图形界面时什么也不做）
+#   "command" 运行 REPORT_NOTIFY_COMMAND，{path} 换成文件路径，{kind} 换成 "报告"/"错误日志"
+#   "webhook" 把 {"event", "kind", "path", "time"} 以 JSON POST 到 REPORT_NOTIFY_WEBHOOK_URL（在独立的子进程里发）
+#   "none"    只打印文件路径
+REPORT_NOTIFIER = "open"
+REPORT_NOTIFY_COMMAND = "" # 比如 'notify-send 图片扫描完成 "{path}"'
+REPORT_NOTIFY_WEBHOOK_URL = "" # 比如 "http://127.0.0.1:8000/hook"
+REPORT_NOTIFY_WEBHOOK_TIMEOUT_SECONDS = 10
+OPEN_ERROR_LOG_AFTER_RUN = True # 这次运行写过错误日志时，结束后把 image_scan_error.log 也打开
+
+# webhook 子进程执行的代码：参数是 url、JSON 内容、超时秒数
+_WEBHOOK_SENDER_CODE = (
+    "import sys, urllib.request\n"
+    "request = urllib.request.Request(sys.argv[1], data=sys.argv[2].encode('utf-8'), "
+    "headers={'Content-Type': 'application/json; charset=utf-8'})\n"
+    "urllib.request.urlopen(request, timeout=float(sys.argv[3])).close()\n"
+)
+
+def has_graphical_session():
+    """
+    当前环境能不能打开图形界面程序。Windows 和 macOS 认为总是可以；其他系统看 DISPLAY / WAYLAND_DISPLAY。
+    """
+    if os.name == 'nt' or sys.platform == 'darwin':
+        return True
+    return bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+def start_detached_process(args):
+    """
+    启动一个子进程后立刻返回，不等它结束；子进程的输入输出不接到当前终端，扫描脚本退出也不影响它。
+    """
+    kwargs = {"stdin": subprocess.DEVNULL, "stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL, "close_fds": True}
+    if os.name == 'nt':
+        kwargs["creationflags"] = getattr(subprocess, "DETACHED_PROCESS", 0) | getattr(subprocess, "CREATE_NEW_PROCESS_GROUP", 0)
+    else:
+        kwargs["start_new_session"] = True
+    return subprocess.Popen(args, **kwargs)
+
+def _open_with_default_application(file_path):
+    if os.name == 'nt':  # For Windows（startfile 本来就不等待）
+        os.startfile(file_path)
+    elif sys.platform == 'darwin':  # For macOS
+        start_detached_process(['open', file_path])
+    else:  # For Linux
+        if not has_graphical_session():
+            print(f"没有图形界面，不自动打开，请手动查看: {file_path}")
+            return
+        opener = shutil.which('xdg-open')
+        if opener is None:
+            print(f"错误: 无法找到打开 '{file_path}' 的应用程序。请手动打开。")
+            return
+        start_detached_process([opener, file_path])
+    print(f"尝试自动打开文件: {file_path}")
+
+def notify_file_ready(file_path, kind="报告", notifier=None):
+    """
+    按 REPORT_NOTIFIER 的设置通知文件已经生成，立刻返回。出错只记日志，不影响扫描结果。
+    """
+    notifier = notifier or REPORT_NOTIFIER
+    absolute_path = os.path.abspath(file_path)
     try:
-        if os.name == 'nt':  # For Windows
-            os.startfile(output_filename)
-        elif os.uname().sysname == 'Darwin':  # For macOS
-            subprocess.run(['open', output_filename], check=True)
-        else:  # For Linux (assuming xdg-open is available)
-            subprocess.run(['xdg-open', output_filename], check=True)
-        print(f"尝试自动打开文件: {output_filename}")
+        if notifier == "open":
+            _open_with_default_application(file_path)
+        elif notifier == "command":
+            if not REPORT_NOTIFY_COMMAND.strip():
+                print(f"没有设置 REPORT_NOTIFY_COMMAND，{kind}在: {absolute_path}")
+                return
+            # 先拆分再替换，路径里有空格也不会被拆开
+            args = [part.replace("{path}", absolute_path).replace("{kind}", kind)
+                    for part in shlex.split(REPORT_NOTIFY_COMMAND, posix=(os.name != 'nt'))]
+            start_detached_process(args)
+        elif notifier == "webhook":
+            if not REPORT_NOTIFY_WEBHOOK_URL:
+                print(f"没有设置 REPORT_NOTIFY_WEBHOOK_URL，{kind}在: {absolute_path}")
+                return
+            payload = json.dumps({"event": "file_ready", "kind": kind, "path": absolute_path,
+                                  "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}, ensure_ascii=False)
+            start_detached_process([sys.executable, "-c", _WEBHOOK_SENDER_CODE, REPORT_NOTIFY_WEBHOOK_URL,
+                                    payload, str(REPORT_NOTIFY_WEBHOOK_TIMEOUT_SECONDS)])
+        else:
+            print(f"{kind}已生成: {absolute_path}")
     except FileNotFoundError:
-        print(f"错误: 无法找到打开 '{output_filename}' 的应用程序。请手动打开。")
+        print(f"错误: 无法找到打开 '{file_path}' 的应用程序。请手动打开。")
     except Exception as e:
-        print(f"自动打开文件时发生错误: {e}")
+        log_error(f"通知{kind}生成时发生错误 '{file_path}': {e}")
+
+def open_file_automatically(file_path):
+    """
+    用系统默认程序打开文件（和 create_excel_report 里自动打开xlsx的逻辑一样）。
+    新增：改为交给 notify_file_ready，不再等待打开的程序。
+    """
+    notify_file_ready(file_path)
+
+def get_error_log_size():
+    """
+    错误日志现在的大小（不存在时是 0），运行开始时记下来，结束时比较就知道这次有没有写过错误。
+    """
+    try:
+        return os.path.getsize(ERROR_LOG_PATH)
+    except OSError:
+        return 0
+
+def notify_error_log_if_written(size_before_run):
+    if OPEN_ERROR_LOG_AFTER_RUN and get_error_log_size() > size_before_run:
+        print(f"这次运行有错误记录，见 {ERROR_LOG_PATH}")
+        notify_file_ready(ERROR_LOG_PATH, kind="错误日志")
+
+# ===================== 新增：变化报告（和上一次扫描的快照比较） =====================
+# 每次扫描后把结果存成一份按路径排好序的快照（每行一个json，gzip压缩）。下一次扫描时，
+# 把这次的结果也按路径排序，和快照一边读一边归并比较（像归并排序的合并步骤），只用线性时间，
+# 旧快照不需要整个读进内存。报告里只有新增、修改、删除的图片，修改的图片会列出哪些字段变了。
+# 快照按"扫描的文件夹 + 筛选条件"区分，扫别的文件夹或者换了筛选条件不会互相干扰。
+
+ENABLE_DELTA_REPORT = False
+SCAN_MANIFEST_DIR = "扫描快照"
+# 比较这些字段，另外还比较文件大小和修改时间
+DELTA_COMPARED_FIELDS = ("正面提示词", "负面提示词", "其他设置", "损坏原因")
+DELTA_VALUE_PREVIEW_LENGTH = 200 # "变化的字段"里每个值最多显示多少个字
+DELTA_SKIP_FULL_REPORT = True # 有上一次的快照时只生成变化报告，不再生成完整报告
+
+def get_manifest_path(folder_path, scan_filter_expression="", manifest_dir=SCAN_MANIFEST_DIR):
+    key = f"{os.path.normcase(os.path.abspath(folder_path))}\n{scan_filter_expression}"
+    folder_name = os.path.basename(os.path.abspath(folder_path)) or "根目录"
+    return os.path.join(manifest_dir, f"{folder_name}_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}.jsonl.gz")
+
+def build_manifest_entry(row):
+    """
+    把报告里的一行变成快照里的一条记录。
+    """
+    absolute_path = row["图片的绝对路径"]
+    size, mtime_ns = row_file_stat(row)
+    entry = {"path": absolute_path, "folder": row.get("所在文件夹", ""), "size": size, "mtime_ns": mtime_ns}
+    for field in DELTA_COMPARED_FIELDS:
+        value = row.get(field, "")
+        entry[field] = value if isinstance(value, (str, int, float)) and value == value else "" # NaN 当成空
+    return entry
+
+def iter_manifest(manifest_path):
+    """
+    逐行读取快照，没有快照时什么也不产出。
+    """
+    if not os.path.exists(manifest_path):
+        return
+    with gzip.open(manifest_path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def _preview_value(value):
+    text = str(value)
+    return text if len(text) <= DELTA_VALUE_PREVIEW_LENGTH else text[:DELTA_VALUE_PREVIEW_LENGTH] + "…"
+
+def describe_entry_changes(old, new):
+    """
+    返回变化的字段说明，比如 ["其他设置: Steps: 20 → Steps: 30", "文件大小: 1000 → 1200"]；没有变化时返回空列表。
+    """
+    changes = []
+    for field in DELTA_COMPARED_FIELDS:
+        if old.get(field, "") != new.get(field, ""):
+            changes.append(f"{field}: {_preview_value(old.get(field, ''))} → {_preview_value(new.get(field, ''))}")
+    if old.get("size") != new.get("size"):
+        changes.append(f"文件大小: {old.get('size')} → {new.get('size')}")
+    elif old.get("mtime_ns") != new.get("mtime_ns"):
+        changes.append("修改时间变了（内容大小没变）")
+    return changes
+
+def merge_join_manifests(old_entries, new_entries):
+    """
+    两边都按 path 升序排列，归并比较，产出 (变化类型, 旧记录, 新记录, 变化的字段)。没变化的不产出。
+    """
+    old_iter, new_iter = iter(old_entries), iter(new_entries)
+    old, new = next(old_iter, None), next(new_iter, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old["path"] < new["path"]):
+            yield "删除", old, None, []
+            old = next(old_iter, None)
+        elif old is None or new["path"] < old["path"]:
+            yield "新增", None, new, []
+            new = next(new_iter, None)
+        else:
+            changes = describe_entry_changes(old, new)
+            if changes:
+                yield "修改", old, new, changes
+            old, new = next(old_iter, None), next(new_iter, None)
+
+def compare_with_manifest(image_data, manifest_path, save=True):
+    """
+    把这次扫描的结果和快照比较，返回 (变化列表, 是否有上一次的快照)。
+    save 为 True 时比较的同时写出新的快照（先写临时文件，比较完再替换）。
+    """
+    had_previous = os.path.exists(manifest_path)
+    new_entries = (build_manifest_entry(row) for row in sorted(image_data, key=lambda row: row["图片的绝对路径"]))
+    temp_path = manifest_path + ".tmp"
+    writer = None
+    if save:
+        os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+        writer = gzip.open(temp_path, "wt", encoding="utf-8")
+
+    def written(entries):
+        for entry in entries:
+            if writer is not None:
+                writer.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            yield entry
+
+    changes = []
+    try:
+        for change_type, old, new, changed_fields in merge_join_manifests(iter_manifest(manifest_path), written(new_entries)):
+            entry = new or old
+            change = {"变化类型": change_type, "图片的绝对路径": entry["path"], "所在文件夹": entry["folder"],
+                      "变化的字段": "\n".join(changed_fields)}
+            for field in DELTA_COMPARED_FIELDS:
+                change[field] = entry.get(field, "")
+            changes.append(change)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(temp_path)
+        raise
+    if writer is not None:
+        writer.close()
+        os.replace(temp_path, manifest_path)
+    return changes, had_previous
+
+def create_delta_report(changes, base_filename="图片变化报告"):
+    """
+    把变化写成xlsx：新增、修改、删除各一个工作表，写完自动打开。
+    """
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    output_filename = f"{base_filename}_{timestamp}.xlsx"
+    columns = ["图片的绝对路径", "所在文件夹", "变化的字段"] + list(DELTA_COMPARED_FIELDS)
+    writer = pd.ExcelWriter(output_filename, engine='openpyxl')
+    for change_type in ("新增", "修改", "删除"):
+        rows = [change for change in changes if change["变化类型"] == change_type]
+        write_extra_sheet(writer, change_type, rows, columns)
+    writer.close()
+    counts = Counter(change["变化类型"] for change in changes)
+    print(f"变化报告已保存到 {output_filename}（新增 {counts['新增']}，修改 {counts['修改']}，删除 {counts['删除']}）")
+    open_file_automatically(output_filename)
+    return output_filename
 
 if __name__ == "__main__":
+    error_log_size_before_run = get_error_log_size() # 新增：结束时判断这次有没有写过错误日志
     folder_to_scan = input("请输入要扫描的文件夹路径: ")
 
     if not os.path.isdir(folder_to_scan):
@@ -278,5 +3880,79 @@ if __name__ == "__main__":
         log_error(f"用户输入的文件夹 '{folder_to_scan}' 不存在。") # 记录文件夹不存在的错误
     else:
         print(f"正在扫描文件夹: {folder_to_scan}...")
-        image_info = get_image_info(folder_to_scan)
-        create_excel_report(image_info)
\ No newline at end of file
+        quarantine = QuarantineList() if ENABLE_QUARANTINE else None
+        scan_filter = ScanFilter(SCAN_FILTER) if SCAN_FILTER.strip() else None # 新增：筛选扫描
+        if scan_filter is not None:
+            print(f"筛选条件: {SCAN_FILTER}")
+        # 新增：需要边扫描边统计的功能都挂在 on_row 上，扫描完统计也就做完了
+        row_handlers = []
+        prompt_table = PromptTable() if ENABLE_PROMPT_TABLE else None
+        if prompt_table is not None:
+            row_handlers.append(prompt_table.add)
+        model_usage = ModelUsageAggregator() if ENABLE_MODEL_USAGE else None
+        if model_usage is not None:
+            row_handlers.append(model_usage.add)
+        folder_summary = FolderSummaryAggregator() if ENABLE_FOLDER_SUMMARY else None # 新增：按文件夹汇总
+        if folder_summary is not None:
+            row_handlers.append(folder_summary.add)
+
+        # 新增：设置了排序或分组时，行直接进外部排序器，不在内存里保留整个列表
+        streaming_sorter, group_sorter = create_report_sorters(int(REPORT_MEMORY_BUDGET_MB * 1024 * 1024))
+        if streaming_sorter is not None:
+            row_handlers.append(streaming_sorter.add)
+        if group_sorter is not None:
+            row_handlers.append(group_sorter.add)
+
+        row_counts = Counter() # 新增：边扫描边数，流式报告模式下不保留行也能统计
+
+        def on_row(row):
+            if row.get("编码修复"):
+                row_counts["编码修复"] += 1
+            for handler in row_handlers:
+                handler(row)
+
+        progress = ScanProgress(folder_to_scan).start() if ENABLE_PROGRESS else None # 新增：显示进度和剩余时间
+        collect_rows = streaming_sorter is None
+        try:
+            if SCAN_MODE == "adaptive":
+                image_info = get_image_info_adaptive(folder_to_scan, quarantine=quarantine, on_row=on_row,
+                                                     scan_filter=scan_filter, progress=progress, collect=collect_rows)
+            else:
+                image_info = get_image_info(folder_to_scan, quarantine=quarantine, on_row=on_row,
+                                            scan_filter=scan_filter, progress=progress, collect=collect_rows)
+        finally:
+            if progress is not None:
+                progress.close()
+        if row_counts["编码修复"]:
+            print(f"自动修复了 {row_counts['编码修复']} 个文件的 UserComment 编码（见报告的\"编码修复\"列）。")
+        if streaming_sorter is not None:
+            # 缩略图、相似图片、打标签、快照比较和HTML报告都需要完整列表，排序/分组模式下不做
+            print("已设置报告排序或分组，使用流式xlsx报告（不生成缩略图、相似图片、标签、变化报告和HTML报告）。")
+            try:
+                create_streaming_excel_report(streaming_sorter, group_by=group_sorter,
+                                              prompt_table=prompt_table, model_usage=model_usage, folder_summary=folder_summary)
+            finally:
+                streaming_sorter.close()
+                if group_sorter is not None:
+                    group_sorter.close()
+        else:
+            if ENABLE_THUMBNAILS:
+                generate_thumbnails(image_info)
+            if ENABLE_PERCEPTUAL_HASH:
+                compute_perceptual_hashes(image_info)
+            if ENABLE_TAGGER:
+                run_image_tagger(image_info)
+            write_full_report = True
+            if ENABLE_DELTA_REPORT: # 新增：和上一次扫描的快照比较
+                delta_changes, had_previous = compare_with_manifest(image_info, get_manifest_path(folder_to_scan, SCAN_FILTER))
+                if had_previous:
+                    create_delta_report(delta_changes)
+                    write_full_report = not DELTA_SKIP_FULL_REPORT
+                else:
+                    print("没有找到上一次扫描的快照，这次先生成完整报告，下次运行时再比较变化。")
+            if write_full_report and REPORT_FORMAT in ("xlsx", "both"):
+                create_excel_report(image_info, prompt_table=prompt_table, model_usage=model_usage,
+                                    folder_summary=folder_summary)
+            if write_full_report and REPORT_FORMAT in ("html", "both"):
+                create_html_report(image_info)
+    notify_error_log_if_written(error_log_size_before_run) # 新增：有错误时把日志也打开